@@ -0,0 +1,408 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - asyncio front end
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Every usb.bulk_transfer() in the tutorials blocks the calling
+# thread until it completes or times out (up to 1S for a read).
+# That rules the blocking calls out for asyncio applications.
+#
+# AsyncBridge offers write(), read() and transact() coroutines
+# backed by libusb asynchronous transfers. The libusb file
+# descriptors are registered with the asyncio event loop, so
+# libusb events are handled by the loop itself and any number of
+# transfers can be outstanding without blocking it. Where libusb
+# cannot provide pollable descriptors (Windows) events are handled
+# on a helper thread and completions are passed back to the loop.
+#
+# PipelinedChannel builds on AsyncBridge for request/response
+# traffic. Requests carry a sequence tag right after the opcode,
+# a window of them is kept in flight and responses are matched
+# back to their request by tag, so small transactions are no
+# longer limited to one per USB round trip.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import asyncio
+import ctypes as ct
+import struct
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, EP2IN_SIZE,
+							EP2IN_TIMEOUT, EP2OUT_SIZE, EP2OUT_TIMEOUT)
+
+
+#
+# Definitions
+#
+POLLIN = 0x001					# <poll.h> event flags
+POLLOUT = 0x004
+AIO_THREAD_TIMEOUT = 100		# mS per pass of the fallback event thread
+AIO_CLOSE_TIMEOUT = 2.0			# S to wait for cancelled transfers on close()
+
+PIPE_WINDOW = 32				# requests in flight per channel
+PIPE_READS = 4					# BULK2 IN reads kept queued per channel
+PIPE_TAG = struct.Struct('<H')	# sequence tag following the opcode byte
+PIPE_HEADER = 1 + PIPE_TAG.size
+PIPE_TIMEOUT = EP2IN_TIMEOUT / 1000	# S to wait for a response
+
+
+# ------------------------------------------------------------
+# Description: AsyncBridge
+# ------------------------------------------------------------
+# asyncio wrapper around an open bridge handle. Each coroutine
+# submits one asynchronous transfer and awaits its completion:
+#
+#   bridge = AsyncBridge(session.dev_handle, session.ctx)
+#   bridge.open()
+#   n = await bridge.write(packet)
+#   data = await bridge.read(64)
+#
+# A failed transfer raises TimeoutError for a libusb timeout and
+# RuntimeError for anything else. Cancelling a coroutine cancels
+# its libusb transfer; close() cancels whatever is still in
+# flight and waits for libusb to hand it back.
+#
+# transact() pairs one write with the next read. It assumes the
+# caller does not have other reads outstanding on BULK2 IN,
+# otherwise responses can be picked up by the wrong caller.
+# ------------------------------------------------------------
+class AsyncBridge:
+
+	def __init__(self, dev_handle, ctx=None, loop=None):
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.loop = loop
+
+		self._pending = {}				# transfer address -> (future, buffer, transfer)
+		self._free = []					# recycled libusb transfers
+		self._fds = {}					# fd -> events registered with the loop
+		self._timer = None
+		self._timeouts_handled = False
+		self._thread = None
+		self._running = False
+
+		# C callbacks must stay referenced while registered
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+		self._added_cb = usb.pollfd_added_cb(self._on_fd_added)
+		self._removed_cb = usb.pollfd_removed_cb(self._on_fd_removed)
+
+	# --------------------------------------
+	# hook libusb event handling into the loop
+	# --------------------------------------
+	def open(self):
+		if self.loop is None:
+			self.loop = asyncio.get_running_loop()
+		self._running = True
+
+		pollfds = usb.get_pollfds(self.ctx)
+		if not pollfds:
+			# no pollable fds on this platform - fall back to a thread
+			self._thread = threading.Thread(target=self._event_thread,
+											name='bridge-aio', daemon=True)
+			self._thread.start()
+			return
+
+		i = 0
+		while pollfds[i]:
+			self._watch(pollfds[i].contents.fd, pollfds[i].contents.events)
+			i += 1
+		usb.free_pollfds(pollfds)
+
+		usb.set_pollfd_notifiers(self.ctx, self._added_cb, self._removed_cb, None)
+		self._timeouts_handled = bool(usb.pollfds_handle_timeouts(self.ctx))
+
+	def close(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		else:
+			usb.set_pollfd_notifiers(self.ctx, usb.pollfd_added_cb(), usb.pollfd_removed_cb(), None)
+			for fd in list(self._fds):
+				self._unwatch(fd)
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+
+		# nothing handles events any more - complete the rest here
+		for future, buf, xfer in list(self._pending.values()):
+			usb.cancel_transfer(xfer)
+		end = time.perf_counter() + AIO_CLOSE_TIMEOUT
+		tv = usb.timeval(0, AIO_THREAD_TIMEOUT * 1000)
+		while self._pending and time.perf_counter() < end:
+			if usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None) < 0:
+				break
+		if self._pending:
+			# libusb still owns these - leaking beats a use after free
+			return
+
+		for xfer in self._free:
+			usb.free_transfer(xfer)
+		self._free = []
+
+	async def __aenter__(self):
+		self.open()
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	# --------------------------------------
+	# transfer coroutines
+	# --------------------------------------
+	async def write(self, data, endpoint=ENDPOINT_BLK2_OUT, timeout=EP2OUT_TIMEOUT):
+		buf = (ct.c_ubyte*len(data)).from_buffer_copy(data)
+		return await self._transfer(endpoint, buf, len(data), timeout)
+
+	async def read(self, n=EP2IN_SIZE, endpoint=ENDPOINT_BLK2_IN, timeout=EP2IN_TIMEOUT):
+		buf = (ct.c_ubyte*n)()
+		count = await self._transfer(endpoint, buf, n, timeout)
+		return ct.string_at(buf, count)
+
+	async def transact(self, opcode, payload=b'', response_size=EP2IN_SIZE):
+		packet = bytearray(EP2OUT_SIZE)
+		packet[0] = opcode
+		packet[1:1 + len(payload)] = payload
+		await self.write(packet)
+		return await self.read(response_size)
+
+	# --------------------------------------
+	# wait until libusb has returned the
+	# transfers of cancelled coroutines
+	# --------------------------------------
+	async def settle(self, timeout=AIO_CLOSE_TIMEOUT):
+		end = time.perf_counter() + timeout
+		while time.perf_counter() < end:
+			if not any(f.cancelled() for f, buf, xfer in list(self._pending.values())):
+				return True
+			await asyncio.sleep(AIO_THREAD_TIMEOUT / 10000)
+		return False
+
+	def _transfer(self, endpoint, buf, length, timeout):
+		xfer = self._free.pop() if self._free else usb.alloc_transfer(0)
+		if not xfer:
+			raise RuntimeError('failed to allocate transfer')
+
+		usb.fill_bulk_transfer(xfer, self.dev_handle, endpoint, buf, length,
+								self._cb, None, timeout)
+		future = self.loop.create_future()
+		key = ct.addressof(xfer.contents)
+		self._pending[key] = (future, buf, xfer)
+
+		r = usb.submit_transfer(xfer)
+		if r < 0:
+			del self._pending[key]
+			self._free.append(xfer)
+			future.set_exception(RuntimeError(f'submit failure: {r} - {usb.strerror(r)}'))
+		else:
+			future.add_done_callback(lambda f: self._on_cancel(f, key))
+			self._arm_timer()
+		return future
+
+	def _on_cancel(self, future, key):
+		# the transfer of a cancelled coroutine is still queued
+		entry = self._pending.get(key)
+		if future.cancelled() and entry is not None and entry[0] is future:
+			usb.cancel_transfer(entry[2])
+
+	# --------------------------------------
+	# transfer completion - runs inside
+	# libusb event handling
+	# --------------------------------------
+	def _on_complete(self, xfer):
+		future, buf, xfer = self._pending.pop(ct.addressof(xfer.contents))
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+		if self._thread is not None:
+			self.loop.call_soon_threadsafe(self._finish, future, xfer, status, n)
+		else:
+			self._finish(future, xfer, status, n)
+
+	def _finish(self, future, xfer, status, n):
+		self._free.append(xfer)
+		if future.done():
+			return
+		if status == usb.LIBUSB_TRANSFER_COMPLETED:
+			future.set_result(n)
+		elif status == usb.LIBUSB_TRANSFER_TIMED_OUT:
+			future.set_exception(TimeoutError(f'transfer timed out after {n} bytes'))
+		elif status == usb.LIBUSB_TRANSFER_CANCELLED:
+			future.cancel()
+		else:
+			future.set_exception(RuntimeError(f'transfer failed: status {status}'))
+
+	# --------------------------------------
+	# event loop integration
+	# --------------------------------------
+	def _handle_events(self):
+		tv = usb.timeval(0, 0)
+		usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+		self._arm_timer()
+
+	def _arm_timer(self):
+		# libusb timeouts need a wakeup unless the fds already cover them
+		if self._thread is not None or self._timeouts_handled:
+			return
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+		tv = usb.timeval()
+		r = usb.get_next_timeout(self.ctx, ct.byref(tv))
+		if r == 1:
+			delay = tv.tv_sec + tv.tv_usec / 1e6
+			self._timer = self.loop.call_later(delay, self._handle_events)
+
+	def _watch(self, fd, events):
+		if events & POLLIN:
+			self.loop.add_reader(fd, self._handle_events)
+		if events & POLLOUT:
+			self.loop.add_writer(fd, self._handle_events)
+		self._fds[fd] = events
+
+	def _unwatch(self, fd):
+		events = self._fds.pop(fd, 0)
+		if events & POLLIN:
+			self.loop.remove_reader(fd)
+		if events & POLLOUT:
+			self.loop.remove_writer(fd)
+
+	def _on_fd_added(self, fd, events, user_data):
+		self.loop.call_soon_threadsafe(self._watch, fd, events)
+
+	def _on_fd_removed(self, fd, user_data):
+		self.loop.call_soon_threadsafe(self._unwatch, fd)
+
+	def _event_thread(self):
+		tv = usb.timeval(0, AIO_THREAD_TIMEOUT * 1000)
+		while self._running:
+			usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+
+
+# ------------------------------------------------------------
+# Description: PipelinedChannel
+# ------------------------------------------------------------
+# Tagged request/response layer over an AsyncBridge. Each request
+# goes out as one 64 byte packet:
+#
+#   byte[0]     opcode
+#   byte[1..2]  sequence tag (little endian)
+#   byte[3..]   payload
+#
+# The embedded side must return the tag in the same position of
+# its response, as the echo opcode (10d) does. Up to 'window'
+# requests are outstanding at once and 'reads' BULK2 IN reads
+# are kept queued to collect responses, which are matched to the
+# waiting request by tag in whatever order they arrive.
+#
+#   async with PipelinedChannel(bridge) as chan:
+#       replies = await asyncio.gather(*(chan.request(10, p) for p in payloads))
+#
+# request() returns the response payload following the tag. A
+# response that has not arrived within 'timeout' seconds raises
+# TimeoutError and frees the request's tag and window slot, so
+# lost responses cannot stall the channel; counted in 'timeouts'.
+# Responses with an unknown tag (including late ones) are counted
+# in 'unmatched'. stop() cancels the queued IN reads.
+# ------------------------------------------------------------
+class PipelinedChannel:
+
+	def __init__(self, bridge, window=PIPE_WINDOW, reads=PIPE_READS,
+					read_size=EP2IN_SIZE, timeout=PIPE_TIMEOUT):
+		self.bridge = bridge
+		self.window = window
+		self.reads = reads
+		self.read_size = read_size
+		self.timeout = timeout
+
+		self.unmatched = 0
+		self.timeouts = 0
+		self._seq = 0
+		self._waiting = {}				# tag -> future
+		self._slots = None
+		self._readers = []
+
+	async def __aenter__(self):
+		self.start()
+		return self
+
+	async def __aexit__(self, exc_type, exc, tb):
+		await self.stop()
+		return False
+
+	def start(self):
+		self._slots = asyncio.Semaphore(self.window)
+		self._readers = [asyncio.ensure_future(self._reader()) for i in range(self.reads)]
+
+	async def stop(self):
+		for task in self._readers:
+			task.cancel()
+		await asyncio.gather(*self._readers, return_exceptions=True)
+		self._readers = []
+		await self.bridge.settle()
+		for future in self._waiting.values():
+			future.cancel()
+		self._waiting = {}
+
+	# --------------------------------------
+	# send one tagged request and wait for
+	# the matching response
+	# --------------------------------------
+	async def request(self, opcode, payload=b'', timeout=None):
+		if timeout is None:
+			timeout = self.timeout
+		async with self._slots:
+			tag = self._seq
+			self._seq = (self._seq + 1) & 0xffff
+
+			packet = bytearray(EP2OUT_SIZE)
+			packet[0] = opcode
+			PIPE_TAG.pack_into(packet, 1, tag)
+			packet[PIPE_HEADER:PIPE_HEADER + len(payload)] = payload
+
+			future = self.bridge.loop.create_future()
+			self._waiting[tag] = future
+			try:
+				await self.bridge.write(packet)
+				return await asyncio.wait_for(future, timeout)
+			except asyncio.TimeoutError:
+				self.timeouts += 1
+				raise TimeoutError(f'no response to tag {tag} within {timeout}S') from None
+			finally:
+				self._waiting.pop(tag, None)
+
+	async def _reader(self):
+		while True:
+			try:
+				data = await self.bridge.read(self.read_size)
+			except TimeoutError:
+				continue
+			except RuntimeError as e:
+				for future in self._waiting.values():
+					if not future.done():
+						future.set_exception(e)
+				raise
+
+			# a read may carry several 64 byte responses
+			for offset in range(0, len(data) - PIPE_HEADER + 1, EP2IN_SIZE):
+				tag = PIPE_TAG.unpack_from(data, offset + 1)[0]
+				future = self._waiting.get(tag)
+				if future is None or future.done():
+					self.unmatched += 1
+					continue
+				future.set_result(data[offset + PIPE_HEADER:offset + EP2IN_SIZE])
@@ -0,0 +1,36 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - USB backend selection
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Every module talks to the bridge through the 'usb' name exported
+# here. By default that is the libusb Python package, exactly as
+# in the tutorials. Setting BRIDGE_BACKEND=sim in the environment
+# swaps in bridge_sim, an in-process model of the bridge and the
+# embedded emulator, so the same code runs without hardware:
+#
+#   BRIDGE_BACKEND=sim python tutorial2.py
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import os
+
+
+BACKEND = os.environ.get('BRIDGE_BACKEND', 'libusb')
+
+if BACKEND == 'sim':
+	import bridge_sim as usb
+else:
+	import libusb as usb
@@ -0,0 +1,355 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Throughput benchmark
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Test case 2 of the tutorial times a single 8k read with one pair
+# of time stamps, which is fine for a demo but too noisy to compare
+# host software versions. This module runs a repeatable benchmark
+# against the embedded emulator:
+#
+#  - read: the emulator is asked for enough 8k bursts (opcode 12d)
+#    to fill each repetition and the data is streamed back with
+#    BulkStream, sweeping transfer (block) size and the number of
+#    transfers kept in flight (queue depth)
+#  - echo: round trip latency of single 64 byte echo (opcode 10d)
+#    transactions
+#
+# Each configuration runs warm-up repetitions that are discarded
+# followed by measured repetitions timed with perf_counter_ns. Rates
+# are computed from the bytes actually transferred. Results are
+# printed and can be written as JSON for tracking regressions:
+#
+#   python bridge_bench.py --blocks 64,8192,65536 --depths 1,4,8 --json out.json
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import argparse
+import ctypes as ct
+import json
+import math
+import platform
+import sys
+import time
+from bridge_backend import usb, BACKEND
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, EP2IN_TIMEOUT,
+							EP2OUT_TIMEOUT, USB_PACKET_SIZE, OPCODE_ECHO,
+							OPCODE_BURST_8K, BURST_8K_SIZE)
+from bridge_session import BridgeSession
+from bridge_upload import BulkUpload
+
+
+#
+# Definitions
+#
+BENCH_BLOCKS = [64, 512, 8192, 65536]
+BENCH_DEPTHS = [1, 2, 4, 8]
+BENCH_TOTAL = 256*1024			# minimum bytes per repetition
+BENCH_WARMUP = 2
+BENCH_REPS = 10
+BENCH_MIN_RATE = 100			# kB/S assumed when sizing timeouts
+
+
+# ------------------------------------------------------------
+# Description: percentile
+# ------------------------------------------------------------
+# Nearest rank percentile of an already sorted list.
+# ------------------------------------------------------------
+def percentile(values, p):
+	if not values:
+		return 0
+	k = max(0, math.ceil(p / 100 * len(values)) - 1)
+	return values[k]
+
+
+def summarize(samples_ns):
+	s = sorted(samples_ns)
+	return {
+		'min_us': s[0] / 1000,
+		'p50_us': percentile(s, 50) / 1000,
+		'p99_us': percentile(s, 99) / 1000,
+		'max_us': s[-1] / 1000,
+		'mean_us': sum(s) / len(s) / 1000,
+	}
+
+
+# ------------------------------------------------------------
+# Description: request_bursts
+# ------------------------------------------------------------
+# Asks the emulator for 'count' 8k bursts with a single OUT
+# transfer of 'count' opcode 12d packets. The timeout grows with
+# the number of packets.
+# ------------------------------------------------------------
+def request_bursts(dev_handle, count):
+	out = (ct.c_ubyte*(count * USB_PACKET_SIZE))()
+	for i in range(count):
+		out[i * USB_PACKET_SIZE] = OPCODE_BURST_8K
+	transferred = ct.c_int(0)
+	timeout = max(EP2OUT_TIMEOUT, len(out) // BENCH_MIN_RATE)
+	return usb.bulk_transfer(dev_handle, ENDPOINT_BLK2_OUT, out, len(out),
+								ct.byref(transferred), timeout)
+
+
+# ------------------------------------------------------------
+# Description: bench_read
+# ------------------------------------------------------------
+# Streams 'total' bytes per repetition (rounded up so it is a
+# whole number of bursts and of blocks) with 'depth' transfers
+# of 'block' bytes in flight. A repetition that has not received
+# all of its data within 'rep_timeout' seconds (default: 'total'
+# at BENCH_MIN_RATE plus one read timeout) fails, so a lost burst
+# cannot hang the benchmark.
+# ------------------------------------------------------------
+def bench_read(session, block, depth, total=BENCH_TOTAL, reps=BENCH_REPS,
+				warmup=BENCH_WARMUP, rep_timeout=None):
+	unit = math.lcm(block, BURST_8K_SIZE)
+	total = max(unit, math.ceil(total / unit) * unit)
+	timeout = max(EP2IN_TIMEOUT, block // BENCH_MIN_RATE)
+	if rep_timeout is None:
+		rep_timeout = (total // BENCH_MIN_RATE + timeout) / 1000
+
+	samples = []
+	nbytes = 0
+	wall_ns = 0
+	cpu_ns = 0
+	short = 0
+
+	stream = session.stream(transfer_size=block, num_transfers=depth, timeout=timeout)
+	try:
+		with stream:
+			for rep in range(warmup + reps):
+				got = 0
+				c0 = time.process_time_ns()
+				t0 = time.perf_counter_ns()
+				deadline = t0 + int(rep_timeout * 1e9)
+				r = request_bursts(session.dev_handle, total // BURST_8K_SIZE)
+				if r < 0:
+					raise RuntimeError(f'burst request failure: {r} - {usb.strerror(r)}')
+				while got < total and stream.running:
+					item = stream.ring.get()
+					if item is None:
+						if time.perf_counter_ns() > deadline:
+							raise RuntimeError(f'read timeout: {got} of {total} bytes after {rep_timeout:.1f}S')
+						stream.poll()
+						continue
+					slot, data = item
+					got += len(data)
+					if len(data) < block:
+						short += 1
+					stream.release(slot)
+				t1 = time.perf_counter_ns()
+				c1 = time.process_time_ns()
+				if stream.error:
+					raise RuntimeError(f'stream failure: {stream.error} - {usb.strerror(stream.error)}')
+
+				if rep >= warmup:
+					samples.append(t1 - t0)
+					nbytes += got
+					wall_ns += t1 - t0
+					cpu_ns += c1 - c0
+	finally:
+		# the session has no further use for the stream
+		session.remove_stream(stream)
+
+	mb = nbytes / 1e6
+	result = {
+		'test': 'read',
+		'block': block,
+		'depth': depth,
+		'bytes_per_rep': total,
+		'reps': reps,
+		'bytes': nbytes,
+		'short_transfers': short,
+		'MB/s': mb / (wall_ns / 1e9) if wall_ns else 0.0,
+		'cpu_ms_per_MB': (cpu_ns / 1e6) / mb if mb else 0.0,
+	}
+	result.update(summarize(samples))
+	rates = sorted(total / (ns / 1e9) / 1e6 for ns in samples)
+	result['p50_MB/s'] = percentile(rates, 50)
+	result['p1_MB/s'] = percentile(rates, 1)
+	return result
+
+
+# ------------------------------------------------------------
+# Description: bench_write
+# ------------------------------------------------------------
+# Uploads 'total' bytes per repetition on BULK2 OUT with 'depth'
+# transfers of 'block' bytes in flight. The data is all zero so
+# the emulator treats it as no-op packets.
+# ------------------------------------------------------------
+def bench_write(session, block, depth, total=BENCH_TOTAL, reps=BENCH_REPS,
+				warmup=BENCH_WARMUP):
+	total = max(block, math.ceil(total / block) * block)
+	data = bytearray(total)
+
+	samples = []
+	nbytes = 0
+	wall_ns = 0
+	cpu_ns = 0
+
+	with BulkUpload(session.dev_handle, ctx=session.ctx, transfer_size=block,
+					num_transfers=depth) as up:
+		for rep in range(warmup + reps):
+			c0 = time.process_time_ns()
+			t0 = time.perf_counter_ns()
+			r = up.upload(data)
+			t1 = time.perf_counter_ns()
+			c1 = time.process_time_ns()
+			if r < 0:
+				raise RuntimeError(f'upload failure: {r} - {usb.strerror(r)}')
+
+			if rep >= warmup:
+				samples.append(t1 - t0)
+				nbytes += up.sent
+				wall_ns += t1 - t0
+				cpu_ns += c1 - c0
+
+	mb = nbytes / 1e6
+	result = {
+		'test': 'write',
+		'block': block,
+		'depth': depth,
+		'bytes_per_rep': total,
+		'reps': reps,
+		'bytes': nbytes,
+		'MB/s': mb / (wall_ns / 1e9) if wall_ns else 0.0,
+		'cpu_ms_per_MB': (cpu_ns / 1e6) / mb if mb else 0.0,
+	}
+	result.update(summarize(samples))
+	rates = sorted(total / (ns / 1e9) / 1e6 for ns in samples)
+	result['p50_MB/s'] = percentile(rates, 50)
+	result['p1_MB/s'] = percentile(rates, 1)
+	return result
+
+
+# ------------------------------------------------------------
+# Description: bench_echo
+# ------------------------------------------------------------
+# Round trip time of single 64 byte echo transactions.
+# ------------------------------------------------------------
+def bench_echo(session, reps=BENCH_REPS * 100, warmup=BENCH_WARMUP * 10):
+	out = (ct.c_ubyte*USB_PACKET_SIZE)()
+	rx = (ct.c_ubyte*USB_PACKET_SIZE)()
+	out[0] = OPCODE_ECHO
+	transferred = ct.c_int(0)
+
+	samples = []
+	c0 = 0
+	for rep in range(warmup + reps):
+		if rep == warmup:
+			c0 = time.process_time_ns()
+		t0 = time.perf_counter_ns()
+		r = usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, out, USB_PACKET_SIZE,
+								ct.byref(transferred), EP2OUT_TIMEOUT)
+		if r == 0:
+			r = usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, USB_PACKET_SIZE,
+									ct.byref(transferred), EP2IN_TIMEOUT)
+		t1 = time.perf_counter_ns()
+		if r < 0:
+			raise RuntimeError(f'echo failure: {r} - {usb.strerror(r)}')
+		if rep >= warmup:
+			samples.append(t1 - t0)
+	cpu_ns = time.process_time_ns() - c0
+
+	result = {
+		'test': 'echo',
+		'block': USB_PACKET_SIZE,
+		'depth': 1,
+		'reps': reps,
+		'transactions/s': reps / (sum(samples) / 1e9),
+		'cpu_us_per_transaction': cpu_ns / 1000 / reps,
+	}
+	result.update(summarize(samples))
+	return result
+
+
+def print_result(res):
+	if res['test'] in ('read', 'write'):
+		print(f"{res['test']:<6}block {res['block']:>8}  depth {res['depth']:>3}  "
+				f"{res['MB/s']:8.3f} MB/S  p50 {res['p50_us']:10.1f}uS  "
+				f"p99 {res['p99_us']:10.1f}uS  cpu {res['cpu_ms_per_MB']:8.2f}mS/MB")
+	else:
+		print(f"echo  {res['transactions/s']:10.1f} trans/S  p50 {res['p50_us']:8.1f}uS  "
+				f"p99 {res['p99_us']:8.1f}uS  cpu {res['cpu_us_per_transaction']:8.2f}uS/trans")
+
+
+def _int_list(text):
+	out = []
+	for item in text.split(','):
+		item = item.strip().upper()
+		scale = 1
+		if item.endswith('K'):
+			scale, item = 1024, item[:-1]
+		elif item.endswith('M'):
+			scale, item = 1024*1024, item[:-1]
+		out.append(int(item) * scale)
+	return out
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='USB bridge BULK2 benchmark')
+	parser.add_argument('--tests', default='read,echo', help='comma list of read, write, echo')
+	parser.add_argument('--blocks', type=_int_list, default=BENCH_BLOCKS,
+						help='transfer sizes in bytes (K/M suffixes allowed)')
+	parser.add_argument('--depths', type=_int_list, default=BENCH_DEPTHS,
+						help='transfers kept in flight')
+	parser.add_argument('--total', type=_int_list, default=[BENCH_TOTAL],
+						help='minimum bytes per repetition')
+	parser.add_argument('--reps', type=int, default=BENCH_REPS)
+	parser.add_argument('--warmup', type=int, default=BENCH_WARMUP)
+	parser.add_argument('--json', help='write results to this file')
+	args = parser.parse_args(argv)
+
+	for block in args.blocks:
+		if block % USB_PACKET_SIZE:
+			parser.error(f'block size {block} is not a multiple of {USB_PACKET_SIZE}')
+
+	tests = args.tests.split(',')
+	results = []
+	with BridgeSession() as session:
+		if 'read' in tests:
+			for block in args.blocks:
+				for depth in args.depths:
+					res = bench_read(session, block, depth, args.total[0], args.reps, args.warmup)
+					print_result(res)
+					results.append(res)
+		if 'write' in tests:
+			for block in args.blocks:
+				for depth in args.depths:
+					res = bench_write(session, block, depth, args.total[0], args.reps, args.warmup)
+					print_result(res)
+					results.append(res)
+		if 'echo' in tests:
+			res = bench_echo(session, args.reps * 100, args.warmup * 10)
+			print_result(res)
+			results.append(res)
+
+	if args.json:
+		report = {
+			'timestamp': time.time(),
+			'backend': BACKEND,
+			'python': sys.version.split()[0],
+			'platform': platform.platform(),
+			'results': results,
+		}
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent=2)
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,104 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - BULK2 buffer ring
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials allocate a new ctypes array for every 8k read and
+# copy it out to bytes before using it. Under sustained streaming
+# that is allocator churn plus an extra copy per read.
+#
+# BufferRing preallocates a fixed number of ctypes buffers up
+# front. The read path fills a slot in place, consumers look at
+# the filled region through a memoryview (or a NumPy view) and
+# hand the slot back when they are done with it. In steady state
+# no buffers are allocated or copied.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+
+# ------------------------------------------------------------
+# Description: BufferRing
+# ------------------------------------------------------------
+# Fixed capacity pool of 'num_slots' ctypes buffers, each
+# 'slot_size' bytes. A slot moves through three states:
+#
+#   free   --acquire()-->  filling  --commit(n)-->  filled
+#   filled --get()/release()-->  free
+#
+# Filled slots are handed out in commit order. Buffers never
+# move once allocated so their addresses can be given to libusb
+# for the life of the ring.
+# ------------------------------------------------------------
+class BufferRing:
+
+	def __init__(self, slot_size, num_slots):
+		self.slot_size = slot_size
+		self.num_slots = num_slots
+
+		self.buffers = [(ct.c_ubyte*(slot_size))() for i in range(num_slots)]
+		self.pointers = [ct.cast(b, ct.POINTER(ct.c_ubyte)) for b in self.buffers]
+		self.lengths = [0] * num_slots
+		self._views = [memoryview(b).cast('B') for b in self.buffers]
+
+		self._free = collections.deque(range(num_slots))
+		self._filled = collections.deque()
+
+	def __len__(self):
+		return len(self._filled)
+
+	# --------------------------------------
+	# producer side
+	# --------------------------------------
+	def acquire(self):
+		if not self._free:
+			return -1
+		return self._free.popleft()
+
+	def commit(self, slot, length):
+		self.lengths[slot] = length
+		self._filled.append(slot)
+
+	# --------------------------------------
+	# consumer side
+	# --------------------------------------
+	def get(self):
+		if not self._filled:
+			return None
+		slot = self._filled.popleft()
+		return (slot, self.view(slot))
+
+	def release(self, slot):
+		self.lengths[slot] = 0
+		self._free.append(slot)
+
+	def view(self, slot):
+		return self._views[slot][:self.lengths[slot]]
+
+	def array(self, slot):
+		# uint8 NumPy view over the filled region - no copy
+		if np is None:
+			raise RuntimeError('numpy is not installed')
+		return np.frombuffer(self.buffers[slot], dtype=np.uint8, count=self.lengths[slot])
+
+	def free_slots(self):
+		return len(self._free)
@@ -0,0 +1,351 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - BULK2 capture to memory mapped files
+#
+# Project Description:
+# ----------------------------------------------------------------
+# In the tutorials every BULK2 IN read lands in 'ep_data_in' and
+# is overwritten by the next one. Long acquisitions need the data
+# on disk, and at bus rate a Python copy per read is wasted work.
+#
+# BulkCapture keeps asynchronous transfers queued on BULK2 IN like
+# BulkStream does, but each transfer's buffer points straight into
+# a memory mapped segment file. libusb fills the mapped pages and
+# the kernel writes them back to disk, so captured data is never
+# copied in Python and memory use stays flat no matter how long
+# the capture runs.
+#
+# Segments are plain files of raw BULK2 data in arrival order:
+#
+#   capture_00000.bin, capture_00001.bin, ...
+#
+# Each segment is preallocated at 'segment_size' bytes and
+# truncated to the bytes actually captured when it is closed, so
+# concatenating the segments gives the exact byte stream and no
+# parsing is needed to read them back (e.g. numpy.memmap).
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import ctypes as ct
+import mmap
+import os
+import time
+from bridge_backend import usb
+
+from bridge_defs import ENDPOINT_BLK2_IN, EP2IN_TIMEOUT
+from bridge_stream import (STREAM_XFER_SIZE, STREAM_XFER_COUNT, STREAM_POLL_TIMEOUT,
+							STATUS_CODES)
+
+
+#
+# Definitions
+#
+CAPTURE_SEGMENT_SIZE = 64*1024*1024		# bytes per segment file
+CAPTURE_NAME = '{prefix}_{index:05d}.bin'
+
+
+# ------------------------------------------------------------
+# Description: _Segment
+# ------------------------------------------------------------
+# One memory mapped segment file. 'submit_pos' is where the next
+# transfer will be pointed, 'cursor' is the end of the data
+# captured so far.
+# ------------------------------------------------------------
+class _Segment:
+
+	def __init__(self, path, size):
+		self.path = path
+		self.size = size
+		self.submit_pos = 0
+		self.cursor = 0
+		self.in_flight = 0
+		self.sealed = False
+
+		self.file = open(path, 'w+b')
+		if hasattr(os, 'posix_fallocate'):
+			os.posix_fallocate(self.file.fileno(), 0, size)
+		else:
+			self.file.truncate(size)
+		self.mm = mmap.mmap(self.file.fileno(), size)
+		self.array = (ct.c_ubyte*size).from_buffer(self.mm)
+		self.address = ct.addressof(self.array)
+
+	def pointer(self, offset):
+		return ct.cast(self.address + offset, ct.POINTER(ct.c_ubyte))
+
+	def close(self):
+		self.mm.flush()
+		# the ctypes view must go before the map can be closed
+		self.array = None
+		self.mm.close()
+		self.file.truncate(self.cursor)
+		self.file.close()
+
+
+# ------------------------------------------------------------
+# Description: BulkCapture
+# ------------------------------------------------------------
+# Captures BULK2 IN data to segment files named from 'prefix'
+# (see CAPTURE_NAME) with 'num_transfers' reads of
+# 'transfer_size' bytes kept in flight:
+#
+#   with BulkCapture(dev_handle, 'run1', ctx=ctx) as cap:
+#       cap.run(seconds=60)
+#   print(cap.segments)
+#
+# Each transfer is pointed at the next free 'transfer_size'
+# bytes of the current segment. A transfer that ends short (a
+# timeout with partial data) leaves a gap ahead of the transfers
+# queued after it. Those are moved down over the gap as they
+# complete, which relies on libusb completing transfers on one
+# endpoint in submission order. The move is a C memmove inside
+# the mapping and only happens after a short transfer.
+#
+# When the next transfer does not fit, the segment is sealed
+# and a new one is opened. A sealed segment is closed (flushed,
+# unmapped and truncated) once its last transfer completes and
+# 'on_segment(path, length)' is called. Space skipped by short
+# transfers is not reused, so segments end up shorter than
+# 'segment_size' when reads time out, and segments that only
+# saw timeouts are deleted. 'segments' lists the (path, length)
+# of every closed segment.
+# ------------------------------------------------------------
+class BulkCapture:
+
+	def __init__(self, dev_handle, prefix, ctx=None, endpoint=ENDPOINT_BLK2_IN,
+					transfer_size=STREAM_XFER_SIZE, num_transfers=STREAM_XFER_COUNT,
+					timeout=EP2IN_TIMEOUT, segment_size=CAPTURE_SEGMENT_SIZE,
+					on_segment=None, metrics=None):
+		if segment_size < transfer_size:
+			raise ValueError('segment_size must hold at least one transfer')
+
+		self.dev_handle = dev_handle
+		self.prefix = prefix
+		self.ctx = ctx
+		self.endpoint = endpoint
+		self.transfer_size = transfer_size
+		self.num_transfers = num_transfers
+		self.timeout = timeout
+		self.segment_size = segment_size - segment_size % transfer_size
+		self.on_segment = on_segment
+		self.metrics = metrics
+
+		self.running = False
+		self.error = 0
+		self.segments = []				# (path, length) of closed segments
+
+		# statistics
+		self.bytes_captured = 0
+		self.transfers_completed = 0
+		self.timeouts = 0
+
+		self._segment = None
+		self._index = 0					# next segment number
+		self._transfers = []
+		self._xfer_index = {}			# transfer address -> transfer number
+		self._target = []				# (segment, offset) of each transfer
+		self._submitted = []			# perf_counter_ns at submission (metrics only)
+		self._in_flight = 0
+
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'capture start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	# --------------------------------------
+	# open the first segment and queue
+	# every transfer
+	# --------------------------------------
+	def start(self):
+		if self.running:
+			return 0
+
+		self.error = 0
+		for i in range(self.num_transfers):
+			xfer = usb.alloc_transfer(0)
+			if not xfer:
+				self._free_transfers()
+				return usb.LIBUSB_ERROR_NO_MEM
+			usb.fill_bulk_transfer(xfer, self.dev_handle, self.endpoint, None,
+								self.transfer_size, self._cb, None, self.timeout)
+			self._xfer_index[ct.addressof(xfer.contents)] = i
+			self._transfers.append(xfer)
+			self._target.append(None)
+			self._submitted.append(0)
+
+		self.running = True
+		for i in range(len(self._transfers)):
+			r = self._submit(i)
+			if r < 0:
+				self.stop()
+				return r
+
+		return 0
+
+	# --------------------------------------
+	# cancel outstanding transfers, keep any
+	# partial data and close the segment
+	# --------------------------------------
+	def stop(self):
+		self.running = False
+		for xfer in self._transfers:
+			usb.cancel_transfer(xfer)
+
+		while self._in_flight > 0:
+			r = self._handle_events(STREAM_POLL_TIMEOUT)
+			if r < 0:
+				break
+
+		self._free_transfers()
+		if self._segment is not None:
+			self._seal(self._segment)
+			self._segment = None
+
+	def poll(self, timeout_ms=STREAM_POLL_TIMEOUT):
+		return self._handle_events(timeout_ms)
+
+	# --------------------------------------
+	# handle events until 'nbytes' have been
+	# captured, 'seconds' have passed or the
+	# capture fails
+	# --------------------------------------
+	def run(self, nbytes=None, seconds=None):
+		end = time.perf_counter() + seconds if seconds is not None else None
+		while self.running:
+			if nbytes is not None and self.bytes_captured >= nbytes:
+				break
+			if end is not None and time.perf_counter() >= end:
+				break
+			self.poll()
+		return self.bytes_captured
+
+	def _handle_events(self, timeout_ms):
+		tv = usb.timeval(timeout_ms // 1000, (timeout_ms % 1000) * 1000)
+		r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+		if r < 0 and r != usb.LIBUSB_ERROR_INTERRUPTED:
+			self._fail(r)
+		return r
+
+	# --------------------------------------
+	# point a transfer at the next free area
+	# of the segment and queue it
+	# --------------------------------------
+	def _submit(self, i):
+		seg = self._segment
+		if seg is None or seg.submit_pos + self.transfer_size > seg.size:
+			if seg is not None:
+				self._seal(seg)
+			seg = self._segment = self._open_segment()
+
+		offset = seg.submit_pos
+		xfer = self._transfers[i]
+		xfer.contents.buffer = seg.pointer(offset)
+		self._target[i] = (seg, offset)
+		seg.submit_pos += self.transfer_size
+		seg.in_flight += 1
+
+		r = usb.submit_transfer(xfer)
+		if r < 0:
+			seg.submit_pos -= self.transfer_size
+			seg.in_flight -= 1
+			self._target[i] = None
+			self._fail(r)
+		else:
+			self._in_flight += 1
+			if self.metrics is not None:
+				self._submitted[i] = self.metrics.clock()
+		return r
+
+	def _open_segment(self):
+		path = CAPTURE_NAME.format(prefix=self.prefix, index=self._index)
+		self._index += 1
+		return _Segment(path, self.segment_size)
+
+	def _seal(self, seg):
+		seg.sealed = True
+		if seg.in_flight == 0:
+			self._close_segment(seg)
+
+	def _close_segment(self, seg):
+		seg.close()
+		if seg.cursor == 0:
+			# only timeouts landed here
+			os.remove(seg.path)
+			return
+		self.segments.append((seg.path, seg.cursor))
+		if self.on_segment is not None:
+			self.on_segment(seg.path, seg.cursor)
+
+	def _fail(self, r):
+		if self.error == 0:
+			self.error = r
+		self.running = False
+
+	def _free_transfers(self):
+		if self._in_flight > 0:
+			# libusb still owns these - leaking beats a use after free
+			return
+		for xfer in self._transfers:
+			usb.free_transfer(xfer)
+		self._transfers = []
+		self._xfer_index = {}
+		self._target = []
+		self._submitted = []
+
+	# --------------------------------------
+	# transfer completion callback
+	# --------------------------------------
+	def _on_complete(self, xfer):
+		self._in_flight -= 1
+		i = self._xfer_index[ct.addressof(xfer.contents)]
+		seg, offset = self._target[i]
+		self._target[i] = None
+		seg.in_flight -= 1
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+
+		if self.metrics is not None and status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self.metrics.record(self.endpoint, STATUS_CODES.get(status, usb.LIBUSB_ERROR_IO),
+								self.transfer_size, n, self.metrics.clock() - self._submitted[i])
+
+		if status == usb.LIBUSB_TRANSFER_COMPLETED:
+			self.transfers_completed += 1
+		elif status == usb.LIBUSB_TRANSFER_TIMED_OUT:
+			self.timeouts += 1
+		elif status == usb.LIBUSB_TRANSFER_NO_DEVICE:
+			self._fail(usb.LIBUSB_ERROR_NO_DEVICE)
+			n = 0
+		elif status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self._fail(usb.LIBUSB_ERROR_IO)
+			n = 0
+
+		if n > 0:
+			if offset != seg.cursor:
+				# close the gap left by an earlier short transfer
+				ct.memmove(seg.address + seg.cursor, seg.address + offset, n)
+			seg.cursor += n
+			self.bytes_captured += n
+
+		if seg.sealed and seg.in_flight == 0:
+			self._close_segment(seg)
+
+		if self.running:
+			self._submit(i)
@@ -0,0 +1,251 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Vectorized payload decoding
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Test case 1 checks its echo by indexing ep_data_in one byte at a
+# time. That is fine for five bytes, but checking every byte of a
+# 650kB/s stream that way takes more CPU than the transfers do.
+#
+# This module views received buffers (BufferRing slots, stream
+# memoryviews, capture files) as NumPy arrays without copying and
+# works on whole buffers at once:
+#  - BURST_DTYPE / packet_dtype(): structured views of 64 byte
+#    packets, records() for any user dtype
+#  - verify_burst() / BurstVerifier: opcode, sequence and counter
+#    pattern check of 8k burst (opcode 12d) data
+#  - crc16_packets(): CRC-16/CCITT of every packet, computed
+#    column by column so the Python loop runs 64 times per buffer
+#    whatever its size; crc32() for whole buffers
+#
+# NumPy is optional for the rest of the bridge modules; the
+# functions here raise RuntimeError without it (crc32 excepted).
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import zlib
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from bridge_defs import (USB_PACKET_SIZE, OPCODE_BURST_8K, BURST_SEQ_OFFSET,
+							BURST_DATA_OFFSET)
+
+
+#
+# Definitions
+#
+BURST_PATTERN_SIZE = USB_PACKET_SIZE - BURST_DATA_OFFSET
+CRC16_POLY = 0x1021				# CRC-16/CCITT-FALSE
+CRC16_INIT = 0xffff
+
+
+def _need_numpy():
+	if np is None:
+		raise RuntimeError('numpy is not installed')
+
+
+# ------------------------------------------------------------
+# Description: packet_dtype
+# ------------------------------------------------------------
+# Structured dtype describing one 64 byte packet from a list of
+# (name, format, offset) fields; bytes not covered are padding.
+# ------------------------------------------------------------
+def packet_dtype(fields, itemsize=USB_PACKET_SIZE):
+	_need_numpy()
+	return np.dtype({
+		'names': [f[0] for f in fields],
+		'formats': [f[1] for f in fields],
+		'offsets': [f[2] for f in fields],
+		'itemsize': itemsize,
+	})
+
+
+if np is not None:
+	BURST_DTYPE = packet_dtype([
+		('opcode', 'u1', 0),
+		('seq', '<u2', BURST_SEQ_OFFSET),
+		('data', ('u1', BURST_PATTERN_SIZE), BURST_DATA_OFFSET),
+	])
+	_PATTERN_STEP = np.arange(BURST_PATTERN_SIZE, dtype=np.uint16)
+else:
+	BURST_DTYPE = None
+
+
+# ------------------------------------------------------------
+# Description: as_array / packets / records
+# ------------------------------------------------------------
+# Zero copy views over any buffer protocol object. packets()
+# and records() ignore a trailing partial item.
+# ------------------------------------------------------------
+def as_array(data):
+	_need_numpy()
+	return np.frombuffer(data, dtype=np.uint8)
+
+def packets(data):
+	arr = as_array(data)
+	n = len(arr) // USB_PACKET_SIZE
+	return arr[:n * USB_PACKET_SIZE].reshape(n, USB_PACKET_SIZE)
+
+def records(data, dtype):
+	_need_numpy()
+	dtype = np.dtype(dtype)
+	return np.frombuffer(data, dtype=dtype, count=len(memoryview(data).cast('B')) // dtype.itemsize)
+
+
+# ------------------------------------------------------------
+# Description: verify_burst
+# ------------------------------------------------------------
+# Checks whole 64 byte packets of 8k burst data (see bridge_sim
+# for the layout). 'expected_seq' is the sequence number the
+# first packet should carry, None accepts any. Returns a dict:
+#
+#   packets       packets checked
+#   bad_opcode    packets whose byte[0] is not 12d
+#   bad_pattern   packets whose counter bytes do not match seq
+#   seq_errors    breaks in the sequence (gaps, repeats, reorder)
+#   first_bad     index of the first failing packet or -1
+#   next_seq      sequence expected after the last packet
+# ------------------------------------------------------------
+def verify_burst(data, expected_seq=None):
+	rec = records(data, BURST_DTYPE)
+	n = len(rec)
+	if n == 0:
+		return {'packets': 0, 'bad_opcode': 0, 'bad_pattern': 0, 'seq_errors': 0,
+				'first_bad': -1, 'next_seq': expected_seq}
+
+	seq = rec['seq']
+	bad_op = rec['opcode'] != OPCODE_BURST_8K
+	pattern = ((seq[:, None] + _PATTERN_STEP) & 0xff).astype(np.uint8)
+	bad_pat = (rec['data'] != pattern).any(axis=1)
+
+	# a packet breaks the sequence if it does not follow the one before
+	prev = np.empty(n, dtype=np.uint16)
+	prev[1:] = seq[:-1] + 1
+	prev[0] = seq[0] if expected_seq is None else expected_seq
+	bad_seq = seq != prev
+
+	bad = bad_op | bad_pat | bad_seq
+	first = int(np.argmax(bad)) if bad.any() else -1
+	return {
+		'packets': n,
+		'bad_opcode': int(bad_op.sum()),
+		'bad_pattern': int(bad_pat.sum()),
+		'seq_errors': int(bad_seq.sum()),
+		'first_bad': first,
+		'next_seq': (int(seq[-1]) + 1) & 0xffff,
+	}
+
+
+# ------------------------------------------------------------
+# Description: BurstVerifier
+# ------------------------------------------------------------
+# Running verify_burst() over consecutive buffers of a stream.
+# The sequence carries from one buffer to the next, and a
+# buffer ending part way through a packet (a timed out transfer
+# can) has its tail kept and joined to the next buffer.
+#
+#   verifier = BurstVerifier()
+#   for slot, data in stream:
+#       verifier.check(data)
+#       stream.release(slot)
+#   assert verifier.ok
+#
+# Subclasses replace _check_packets() to check the whole packets
+# of each buffer another way (see bridge_integrity).
+# ------------------------------------------------------------
+class BurstVerifier:
+
+	def __init__(self, expected_seq=None):
+		self.expected_seq = expected_seq
+		self.packets = 0
+		self.bad_opcode = 0
+		self.bad_pattern = 0
+		self.seq_errors = 0
+		self._tail = b''
+
+	@property
+	def ok(self):
+		return not (self.bad_opcode or self.bad_pattern or self.seq_errors)
+
+	def check(self, data):
+		if self._tail:
+			data = self._tail + bytes(data)
+		view = memoryview(data).cast('B')
+		whole = len(view) - len(view) % USB_PACKET_SIZE
+		self._tail = bytes(view[whole:])
+		return self._check_packets(view[:whole])
+
+	def _check_packets(self, view):
+		res = verify_burst(view, self.expected_seq)
+		self.packets += res['packets']
+		self.bad_opcode += res['bad_opcode']
+		self.bad_pattern += res['bad_pattern']
+		self.seq_errors += res['seq_errors']
+		self.expected_seq = res['next_seq']
+		return res
+
+	def stats(self):
+		return {
+			'packets': self.packets,
+			'bad_opcode': self.bad_opcode,
+			'bad_pattern': self.bad_pattern,
+			'seq_errors': self.seq_errors,
+			'pending_bytes': len(self._tail),
+		}
+
+
+# ------------------------------------------------------------
+# Description: crc16_packets
+# ------------------------------------------------------------
+# CRC-16/CCITT-FALSE of bytes [start, end) of every whole packet
+# in 'data', as a uint16 array. verify_crc16() compares them
+# with a CRC stored little endian at 'crc_offset' of each packet
+# and returns the indices of the packets that fail.
+# ------------------------------------------------------------
+def _crc16_table():
+	table = np.zeros(256, dtype=np.uint16)
+	for i in range(256):
+		crc = i << 8
+		for _ in range(8):
+			crc = ((crc << 1) ^ CRC16_POLY) if crc & 0x8000 else crc << 1
+		table[i] = crc & 0xffff
+	return table
+
+_CRC16_TABLE = _crc16_table() if np is not None else None
+
+def crc16_packets(data, start=0, end=USB_PACKET_SIZE):
+	rows = packets(data)
+	crc = np.full(len(rows), CRC16_INIT, dtype=np.uint16)
+	for col in range(start, end):
+		crc = (crc << 8) ^ _CRC16_TABLE[(crc >> 8) ^ rows[:, col]]
+	return crc
+
+def verify_crc16(data, crc_offset=USB_PACKET_SIZE - 2, start=0):
+	rows = packets(data)
+	stored = rows[:, crc_offset].astype(np.uint16) | (rows[:, crc_offset + 1].astype(np.uint16) << 8)
+	return np.nonzero(crc16_packets(data, start, crc_offset) != stored)[0]
+
+
+# ------------------------------------------------------------
+# Description: crc32
+# ------------------------------------------------------------
+# CRC-32 of a whole buffer without copying it (zlib, no NumPy
+# needed). Pass the previous value to continue across buffers.
+# ------------------------------------------------------------
+def crc32(data, value=0):
+	return zlib.crc32(memoryview(data).cast('B'), value)
@@ -0,0 +1,123 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Shared definitions
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Constants shared by the bridge support modules. The values match
+# the definitions block at the top of the tutorial scripts so the
+# library modules and the tutorials talk to the bridge the same way.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+
+#
+# Definitions
+#
+DEF_VID = 0x1cbf
+DEF_PID = 0x0007
+ENDPOINT_BLK2_OUT = 0x03
+ENDPOINT_BLK2_IN = 0x83
+
+# interfaces 0/1 follow the BULK2 numbering (interface n - endpoint n+1)
+ENDPOINT_INT0_OUT = 0x01
+ENDPOINT_INT0_IN = 0x81
+ENDPOINT_INT1_OUT = 0x02
+ENDPOINT_INT1_IN = 0x82
+
+INT0_INTERFACE = 0
+INT1_INTERFACE = 1
+BULK2_INTERFACE = 2
+
+USB_PACKET_SIZE = 64			# native USB 2.0 FS packet
+
+EP2IN_SIZE = 64*1
+EP2IN_TIMEOUT = 1000 	# mS
+
+EP2OUT_SIZE = 64*1
+EP2OUT_TIMEOUT = 250 	# mS
+
+#
+# Embedded emulator opcodes (byte[0] of a BULK2 OUT packet)
+#
+OPCODE_ECHO = 10				# echo packet back on BULK2 IN
+OPCODE_BURST_8K = 12			# respond with an 8k data burst
+OPCODE_THROTTLE = 13			# pause/resume the emulator, see below
+OPCODE_BATCH = 14				# several short commands in one packet, see below
+
+BURST_8K_SIZE = 64*128
+
+#
+# Throttle request. Not part of the published emulator, this
+# format is assumed by bridge_flow and implemented by bridge_sim:
+#
+#   [13][state]   state 1 = pause, 0 = resume
+#
+# A paused emulator holds the commands it receives and carries
+# them out in order once resumed; data already in the bridge FIFO
+# still drains.
+#
+THROTTLE_STATE_OFFSET = 1
+THROTTLE_PAUSE = 1
+THROTTLE_RESUME = 0
+
+#
+# Batch packet. Not part of the published emulator either; this
+# format is assumed by bridge_framing and implemented by
+# bridge_sim, and the embedded firmware has to learn it before
+# batched commands can be used on hardware:
+#
+#   [14][len][len bytes] [len][len bytes] ... [0 / end of packet]
+#
+# Each message is a command of its own (opcode first) and is
+# carried out as if it had arrived zero padded in a packet of
+# its own.
+#
+BATCH_HEADER = 1
+
+#
+# 8k burst packet layout (see bridge_sim for the full pattern)
+#
+BURST_SEQ_OFFSET = 1			# uint16 little endian packet counter
+BURST_DATA_OFFSET = 3			# counter pattern starts here
+
+#
+# Interface 0 register commands. The bridge register protocol is
+# not published, this format is assumed by bridge_regs and
+# implemented by bridge_sim:
+#
+#   request   [cmd][count][tag][0] + count entries
+#   response  [cmd][count][tag][status] + count values (reads)
+#
+# read entries are one address byte, write entries an address
+# byte followed by a uint32 little endian value. Every request
+# and response is one 64 byte packet.
+#
+REG_CMD_READ = 0x01
+REG_CMD_WRITE = 0x02
+REG_HEADER = 4
+REG_VALUE_SIZE = 4
+REG_READS_PER_PACKET = (USB_PACKET_SIZE - REG_HEADER) // REG_VALUE_SIZE
+REG_WRITES_PER_PACKET = (USB_PACKET_SIZE - REG_HEADER) // (1 + REG_VALUE_SIZE)
+
+REG_OK = 0
+REG_ERR_ADDRESS = 1
+REG_ERR_READ_ONLY = 2
+REG_ERR_COMMAND = 3
+
+REG_COUNT = 64					# registers 0x00 - 0x3f
+REG_ID = 0x00					# read only, bridge identifier
+REG_VERSION = 0x01				# read only, firmware version
+REG_STATUS = 0x02				# read only, changes on its own
+REG_CONFIG = 0x03				# first configuration register
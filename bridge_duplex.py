@@ -0,0 +1,420 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Full duplex BULK2 channel
+#
+# Project Description:
+# ----------------------------------------------------------------
+# testcase1_exe and testcase2_exe alternate strictly: write to
+# 0x03, then read from 0x83. While one direction is busy the
+# other endpoint idles, so commands going down and data coming up
+# share one direction's worth of bus time.
+#
+# DuplexChannel runs both directions of BULK2 independently:
+#  - OUT: send() queues messages that are packed into a pool of
+#    transfers, several in flight, and submitted as soon as a
+#    transfer is free. The queue is bounded in bytes; senders
+#    block (or get False back) once it is full.
+#  - IN: a BulkStream keeps reads queued into a BufferRing. Slots
+#    are handed to the consumer and come back with release();
+#    with every slot held the reads park and the device is
+#    throttled by the bus, without affecting OUT.
+# One event thread completes transfers of both directions, so a
+# slow consumer never holds up the sender or the other way round
+# and the combined rate approaches the sum of both directions.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_buffers import BufferRing
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, EP2OUT_TIMEOUT,
+							EP2IN_TIMEOUT, USB_PACKET_SIZE)
+from bridge_stream import (BulkStream, STREAM_XFER_SIZE, STREAM_XFER_COUNT,
+							STREAM_POLL_TIMEOUT, STATUS_CODES)
+
+
+#
+# Definitions
+#
+DUPLEX_OUT_SIZE = USB_PACKET_SIZE*64	# bytes per OUT transfer
+DUPLEX_OUT_DEPTH = 4					# OUT transfers in flight
+DUPLEX_OUT_LIMIT = 1024*1024			# bytes queued before send() blocks
+DUPLEX_POLL = STREAM_POLL_TIMEOUT		# mS per event thread pass
+DUPLEX_PAD = bytes(USB_PACKET_SIZE)		# zeros after a message's last byte
+
+
+# ------------------------------------------------------------
+# Description: DuplexChannel
+# ------------------------------------------------------------
+# Independent OUT and IN queues on BULK2 of an open handle:
+#
+#   with DuplexChannel(session.dev_handle, session.ctx) as chan:
+#       chan.send(commands, callback=done)    # returns at once
+#       for slot, data in chan:
+#           process(data)
+#           chan.release(slot)
+#
+# OUT - send(data, callback, block, timeout) copies 'data' into
+# the transfer pool as transfers free up; 'callback(r, n)' is
+# called from the event thread when the last byte has gone out
+# (r = 0) or the transfer carrying it failed. Messages are sent
+# in submission order and may share or span transfers. The
+# bridge takes byte 0 of every 64 byte packet as an opcode, so
+# each message starts a new packet: one that does not end on a
+# packet boundary is padded with zeros, i.e. a 3 byte command
+# costs a whole packet. 'out_transfer_size' must be a multiple
+# of 64. With the queue over 'out_limit' bytes send() waits for
+# room, or returns False at once when 'block' is False or
+# 'timeout' expires.
+#
+# IN - get(timeout) returns the next (slot, memoryview) or None;
+# iterating the channel does the same until it stops. Slots
+# must be handed back with release(). 'in_slots' sets the number
+# of ring slots (default 2 x 'in_depth'), i.e. how much data may
+# wait for the consumer before IN is throttled.
+#
+# start() returns a libusb code; 'error' holds the first fatal
+# one seen by either direction.
+# ------------------------------------------------------------
+class DuplexChannel:
+
+	def __init__(self, dev_handle, ctx=None, out_endpoint=ENDPOINT_BLK2_OUT,
+					in_endpoint=ENDPOINT_BLK2_IN, out_transfer_size=DUPLEX_OUT_SIZE,
+					out_depth=DUPLEX_OUT_DEPTH, out_limit=DUPLEX_OUT_LIMIT,
+					out_timeout=EP2OUT_TIMEOUT, in_transfer_size=STREAM_XFER_SIZE,
+					in_depth=STREAM_XFER_COUNT, in_slots=None, in_timeout=EP2IN_TIMEOUT,
+					metrics=None):
+		if out_transfer_size % USB_PACKET_SIZE:
+			raise ValueError(f'out transfer size must be a multiple of {USB_PACKET_SIZE}')
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.out_endpoint = out_endpoint
+		self.out_transfer_size = out_transfer_size
+		self.out_depth = out_depth
+		self.out_limit = out_limit
+		self.out_timeout = out_timeout
+		self.metrics = metrics
+		self.running = False
+		self.error = 0
+
+		ring = BufferRing(in_transfer_size, in_slots or 2 * in_depth)
+		self.stream = BulkStream(dev_handle, ctx=ctx, endpoint=in_endpoint,
+									transfer_size=in_transfer_size, num_transfers=in_depth,
+									timeout=in_timeout, ring=ring, metrics=metrics)
+		self.stream.after_poll = self._after_poll
+
+		# OUT side
+		self._out_lock = threading.Lock()
+		self._out_room = threading.Condition(self._out_lock)
+		self._queue = collections.deque()	# [view, offset, callback]
+		self._queued = 0					# bytes waiting for a transfer
+		self._transfers = []
+		self._buffers = []
+		self._views = []
+		self._index = {}
+		self._idle = []
+		self._done = []						# per transfer: [(callback, message size)]
+		self._submitted = []
+		self._out_in_flight = 0
+		self._cb = usb.transfer_cb_fn(self._on_out_complete)
+
+		# IN side
+		self._in_ready = threading.Condition()
+		self._released = collections.deque()
+
+		self._thread = None
+
+		# statistics
+		self.bytes_sent = 0
+		self.messages_sent = 0
+		self.out_errors = 0
+		self.out_waits = 0					# send() calls that hit backpressure
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'duplex start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		item = self.get()
+		if item is None:
+			raise StopIteration
+		return item
+
+	def start(self):
+		if self.running:
+			return 0
+		self.error = 0
+		for i in range(self.out_depth):
+			xfer = usb.alloc_transfer(0)
+			if not xfer:
+				self._free_out()
+				return usb.LIBUSB_ERROR_NO_MEM
+			self._index[ct.addressof(xfer.contents)] = i
+			self._transfers.append(xfer)
+			self._buffers.append((ct.c_ubyte*self.out_transfer_size)())
+			self._views.append(memoryview(self._buffers[-1]).cast('B'))
+			self._done.append([])
+			self._submitted.append(0)
+		self._idle = list(range(self.out_depth))
+
+		r = self.stream.start()
+		if r < 0:
+			self._free_out()
+			return r
+		self.running = True
+		self._thread = threading.Thread(target=self._run, name='bridge-duplex', daemon=True)
+		self._thread.start()
+		return 0
+
+	# --------------------------------------
+	# stop both directions, sending what is
+	# queued first unless 'drain' is False
+	# --------------------------------------
+	def stop(self, drain=True):
+		# a fatal error ends the event thread with running False,
+		# but the transfers still have to be handed back
+		if self._thread is None:
+			return
+		if drain and self.running:
+			self.flush()
+		self.running = False
+		usb.interrupt_event_handler(self.ctx)
+		self._thread.join()
+		self._thread = None
+
+		with self._out_lock:
+			failed = list(self._queue)
+			self._queue.clear()
+			self._queued = 0
+		for view, offset, callback in failed:
+			if callback is not None:
+				callback(usb.LIBUSB_ERROR_INTERRUPTED, offset)
+
+		for xfer in self._transfers:
+			usb.cancel_transfer(xfer)
+		self.stream.stop()				# handles events until both directions are idle
+		while self._out_in_flight > 0:
+			tv = usb.timeval(0, DUPLEX_POLL * 1000)
+			if usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None) < 0:
+				break
+		self._free_out()
+		with self._in_ready:
+			self._in_ready.notify_all()
+
+	def _free_out(self):
+		if self._out_in_flight > 0:
+			# libusb still owns these - leaking beats a use after free
+			return
+		for xfer in self._transfers:
+			usb.free_transfer(xfer)
+		self._transfers = []
+		self._buffers = []
+		self._views = []
+		self._index = {}
+		self._idle = []
+		self._done = []
+		self._submitted = []
+
+	# --------------------------------------
+	# OUT - queue a message
+	# --------------------------------------
+	def send(self, data, callback=None, block=True, timeout=None):
+		view = memoryview(data).cast('B')
+		n = len(view)
+		if not n:
+			raise ValueError('empty message')
+		end = None if timeout is None else time.perf_counter() + timeout
+		with self._out_room:
+			# one message larger than the limit may go into an empty queue
+			if self._queued and self._queued + n > self.out_limit:
+				self.out_waits += 1
+				if not block:
+					return False
+				while self.running and self._queued and self._queued + n > self.out_limit:
+					wait = None if end is None else end - time.perf_counter()
+					if wait is not None and wait <= 0:
+						return False
+					self._out_room.wait(wait)
+			if not self.running:
+				return False
+			self._queue.append([view, 0, callback])
+			self._queued += n
+			self._pump()
+		return True
+
+	def flush(self, timeout=None):
+		end = None if timeout is None else time.perf_counter() + timeout
+		with self._out_room:
+			while self.running and (self._queue or self._out_in_flight):
+				wait = None if end is None else end - time.perf_counter()
+				if wait is not None and wait <= 0:
+					return False
+				self._out_room.wait(wait)
+		return True
+
+	# --------------------------------------
+	# pack queued messages into idle
+	# transfers, each message starting a
+	# packet, and submit them - called with
+	# _out_lock held
+	# --------------------------------------
+	def _pump(self):
+		while self._idle and self._queue:
+			i = self._idle.pop()
+			buf = self._buffers[i]
+			packed = self._views[i]
+			done = self._done[i]
+			fill = 0
+			copied = 0
+			while self._queue and fill < self.out_transfer_size:
+				entry = self._queue[0]
+				view, offset, callback = entry
+				n = min(len(view) - offset, self.out_transfer_size - fill)
+				packed[fill:fill + n] = view[offset:offset + n]
+				fill += n
+				copied += n
+				entry[1] = offset + n
+				if entry[1] >= len(view):
+					self._queue.popleft()
+					done.append((callback, len(view)))
+					pad = -fill % USB_PACKET_SIZE
+					packed[fill:fill + pad] = DUPLEX_PAD[:pad]
+					fill += pad
+			self._queued -= copied
+
+			xfer = self._transfers[i]
+			usb.fill_bulk_transfer(xfer, self.dev_handle, self.out_endpoint, buf, fill,
+									self._cb, None, self.out_timeout)
+			r = usb.submit_transfer(xfer)
+			if r < 0:
+				self._idle.append(i)
+				self._fail_out(i, r)
+				continue
+			self._out_in_flight += 1
+			if self.metrics is not None:
+				self._submitted[i] = self.metrics.clock()
+		self._out_room.notify_all()
+
+	def _fail_out(self, i, r):
+		self.out_errors += 1
+		if self.error == 0:
+			self.error = r
+		done, self._done[i] = self._done[i], []
+		for callback, n in done:
+			if callback is not None:
+				callback(r, 0)
+
+	# --------------------------------------
+	# OUT completion - event thread
+	# --------------------------------------
+	def _on_out_complete(self, xfer):
+		i = self._index[ct.addressof(xfer.contents)]
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+		length = xfer.contents.length
+		code = STATUS_CODES.get(status, usb.LIBUSB_ERROR_IO)
+		if self.metrics is not None and self._submitted[i] and status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self.metrics.record(self.out_endpoint, code, length, n,
+								self.metrics.clock() - self._submitted[i])
+
+		with self._out_room:
+			self._out_in_flight -= 1
+			self.bytes_sent += n
+			done, self._done[i] = self._done[i], []
+			self._idle.append(i)
+			if self.running:
+				self._pump()
+			else:
+				self._out_room.notify_all()
+
+		ok = code == 0 and n >= length
+		if not ok:
+			if status == usb.LIBUSB_TRANSFER_CANCELLED:
+				code = usb.LIBUSB_ERROR_INTERRUPTED
+			elif code == 0:
+				code = usb.LIBUSB_ERROR_IO
+			self.out_errors += 1
+		for callback, size in done:
+			if ok:
+				self.messages_sent += 1
+			if callback is not None:
+				callback(0 if ok else code, size if ok else 0)
+
+	# --------------------------------------
+	# IN - consumer side
+	# --------------------------------------
+	def get(self, timeout=None):
+		ring = self.stream.ring
+		end = None if timeout is None else time.perf_counter() + timeout
+		with self._in_ready:
+			while not len(ring):
+				if not self.running:
+					return None
+				wait = None if end is None else end - time.perf_counter()
+				if wait is not None and wait <= 0:
+					return None
+				self._in_ready.wait(wait)
+			return ring.get()
+
+	def release(self, slot):
+		# the ring is only touched by the event thread - hand it over
+		self._released.append(slot)
+		if self.stream._parked:
+			usb.interrupt_event_handler(self.ctx)
+
+	# --------------------------------------
+	# event thread - completes OUT and IN
+	# --------------------------------------
+	def _run(self):
+		while self.running:
+			self.stream.poll(DUPLEX_POLL)
+			if self.stream.error and self.error == 0:
+				self.error = self.stream.error
+				self.running = False
+		with self._out_room:
+			self._out_room.notify_all()
+
+	def _after_poll(self):
+		while self._released:
+			self.stream.release(self._released.popleft())
+		if len(self.stream.ring):
+			with self._in_ready:
+				self._in_ready.notify_all()
+
+	def stats(self):
+		s = self.stream
+		return {
+			'out_bytes': self.bytes_sent,
+			'out_messages': self.messages_sent,
+			'out_queued': self._queued,
+			'out_errors': self.out_errors,
+			'out_waits': self.out_waits,
+			'in_bytes': s.bytes_received,
+			'in_transfers': s.transfers_completed,
+			'in_waiting': len(s.ring),
+			'in_parked': len(s._parked),
+		}
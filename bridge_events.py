@@ -0,0 +1,381 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Dedicated event handling thread
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Every usb.bulk_transfer() in the tutorials runs its own libusb
+# event handling on the calling thread. How quickly a completion
+# is noticed then depends on when that thread next gets the GIL
+# and the CPU, so latency jitter grows whenever the application
+# is busy.
+#
+# EventThread runs libusb event handling continuously on one
+# thread for a context, and therefore for every bridge opened on
+# it. The thread can be pinned to a set of CPUs and optionally
+# run under SCHED_FIFO (Linux, needs CAP_SYS_NICE or root), so it
+# is not migrated or preempted by ordinary threads.
+#
+# Transfers are submitted asynchronously from any thread with
+# submit(); their completions are handed to the application
+# through a CompletionQueue, a deque that the event thread only
+# appends to and the consumer only pops from, so neither side
+# takes a lock for an item. bulk_transfer() and
+# interrupt_transfer() keep the blocking usb call signature for
+# existing code while the transfer itself is completed by the
+# event thread.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import os
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_INT0_OUT, ENDPOINT_INT0_IN, ENDPOINT_INT1_OUT,
+							ENDPOINT_INT1_IN, EP2IN_TIMEOUT)
+from bridge_metrics import set_ref_value
+from bridge_stream import STATUS_CODES
+
+
+#
+# Definitions
+#
+EVENT_POLL = 100				# mS per event handling pass
+EVENT_STOP_TIMEOUT = 2.0		# S to wait for cancelled transfers on stop()
+EVENT_RT_PRIORITY = 10			# SCHED_FIFO priority used for priority=True
+
+INTERRUPT_ENDPOINTS = (ENDPOINT_INT0_OUT, ENDPOINT_INT0_IN, ENDPOINT_INT1_OUT, ENDPOINT_INT1_IN)
+
+Completion = collections.namedtuple('Completion', 'tag endpoint r data length ns')
+
+
+# ------------------------------------------------------------
+# Description: CompletionQueue
+# ------------------------------------------------------------
+# Single producer, single consumer queue. deque append() and
+# popleft() are atomic, so items move without a lock; the
+# consumer only sleeps on an Event when the queue is empty, and
+# the producer only sets it when a consumer is sleeping.
+# ------------------------------------------------------------
+class CompletionQueue:
+
+	def __init__(self):
+		self._items = collections.deque()
+		self._wake = threading.Event()
+		self._waiting = False
+
+	def __len__(self):
+		return len(self._items)
+
+	def put(self, item):
+		self._items.append(item)
+		if self._waiting:
+			self._wake.set()
+
+	def get(self, timeout=None):
+		try:
+			return self._items.popleft()
+		except IndexError:
+			pass
+		end = None if timeout is None else time.perf_counter() + timeout
+		self._waiting = True
+		try:
+			while True:
+				self._wake.clear()
+				# an item put before _waiting was seen is caught here
+				try:
+					return self._items.popleft()
+				except IndexError:
+					pass
+				wait = None if end is None else end - time.perf_counter()
+				if wait is not None and wait <= 0:
+					return None
+				self._wake.wait(wait)
+		finally:
+			self._waiting = False
+
+	def drain(self):
+		items = []
+		while True:
+			try:
+				items.append(self._items.popleft())
+			except IndexError:
+				return items
+
+
+# ------------------------------------------------------------
+# Description: EventThread
+# ------------------------------------------------------------
+# Handles libusb events for 'ctx' on its own thread:
+#
+#   with EventThread(session.ctx, cpu=3, priority=True) as ev:
+#       ev.submit(session.dev_handle, 0x03, packet, tag=1)
+#       ev.submit(session.dev_handle, 0x83, length=64, tag=2)
+#       c = ev.completions.get()    # Completion(tag=1, ...)
+#
+# 'cpu' is a CPU number or a set of them for the thread's
+# affinity. 'priority' is a SCHED_FIFO priority (1-99, True for
+# EVENT_RT_PRIORITY). Both are applied by the thread to itself
+# when it starts; where that is refused or not supported the
+# thread runs anyway and the reason is kept in 'sched_error'.
+#
+# submit() queues one transfer (interrupt on the INT endpoints,
+# bulk otherwise) and returns a libusb code: the error that
+# stopped the thread, or LIBUSB_ERROR_INTERRUPTED, when no event
+# thread is running to complete it. OUT data is copied;
+# IN transfers read 'length' bytes. Each completion is put on
+# 'completions' as Completion(tag, endpoint, r, data, length,
+# ns): 'r' a libusb code, 'data' the bytes read (None for OUT),
+# 'length' the bytes moved and 'ns' the time from submission to
+# completion. With 'metrics' (a bridge_metrics.BridgeMetrics)
+# every transfer is recorded there as well.
+#
+# bulk_transfer() and interrupt_transfer() take the same
+# arguments as the usb calls and block until the event thread
+# completes the transfer, which uses the caller's buffer
+# directly. Before start() they fall through to the usb calls.
+# ------------------------------------------------------------
+class EventThread:
+
+	def __init__(self, ctx=None, cpu=None, priority=None, poll_ms=EVENT_POLL,
+					metrics=None, name='bridge-events'):
+		self.ctx = ctx
+		self.cpu = {cpu} if isinstance(cpu, int) else cpu
+		self.priority = EVENT_RT_PRIORITY if priority is True else priority
+		self.poll_ms = poll_ms
+		self.metrics = metrics
+		self.name = name
+
+		self.running = False
+		self.error = 0					# libusb error that stopped the thread
+		self.sched_error = None			# why affinity/priority was not applied
+		self.completions = CompletionQueue()
+
+		self._thread = None
+		self._ready = threading.Event()
+		self._pending = {}				# transfer address -> [transfer, buffer, tag, waiter, t0]
+		self._free = []					# recycled libusb transfers
+		self._local = threading.local()	# per caller thread waiter
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+		# statistics
+		self.submitted = 0
+		self.completed = 0
+		self.passes = 0
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'event thread start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def start(self):
+		if self.running:
+			return 0
+		self.error = 0
+		self.running = True
+		self._ready.clear()
+		self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+		self._thread.start()
+		self._ready.wait()
+		return 0
+
+	# --------------------------------------
+	# cancel what is still in flight, let
+	# the thread complete it and stop
+	# --------------------------------------
+	def stop(self):
+		# an event handling error ends the thread with running
+		# False, but its transfers still have to be handed back
+		if self._thread is None:
+			return
+		for xfer, buf, tag, waiter, t0 in list(self._pending.values()):
+			usb.cancel_transfer(xfer)
+		end = time.perf_counter() + EVENT_STOP_TIMEOUT
+		tv = usb.timeval(0, EVENT_POLL * 1000)
+		while self._pending and time.perf_counter() < end:
+			if self._thread.is_alive():
+				time.sleep(0.001)
+			elif usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None) < 0:
+				break
+		self.running = False
+		usb.interrupt_event_handler(self.ctx)
+		self._thread.join()
+		self._thread = None
+
+		if self._pending:
+			# libusb still owns these - leaking beats a use after free
+			return
+		for xfer in self._free:
+			usb.free_transfer(xfer)
+		self._free = []
+
+	# --------------------------------------
+	# the thread itself
+	# --------------------------------------
+	def _run(self):
+		self._apply_scheduling()
+		self._ready.set()
+		tv = usb.timeval(self.poll_ms // 1000, (self.poll_ms % 1000) * 1000)
+		while self.running:
+			r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+			self.passes += 1
+			if r < 0 and r != usb.LIBUSB_ERROR_INTERRUPTED:
+				self.error = r
+				self.running = False
+		# wake anyone still blocked on a transfer
+		for xfer, buf, tag, waiter, t0 in list(self._pending.values()):
+			if waiter is not None:
+				waiter[1] = usb.LIBUSB_ERROR_INTERRUPTED
+				waiter[0].set()
+
+	def _apply_scheduling(self):
+		# pid 0 makes both calls act on the calling thread on Linux
+		errors = []
+		if self.cpu is not None:
+			if not hasattr(os, 'sched_setaffinity'):
+				errors.append('cpu affinity not supported')
+			else:
+				try:
+					os.sched_setaffinity(0, self.cpu)
+				except OSError as e:
+					errors.append(f'cpu affinity {sorted(self.cpu)}: {e.strerror}')
+		if self.priority is not None:
+			if not hasattr(os, 'SCHED_FIFO'):
+				errors.append('SCHED_FIFO not supported')
+			else:
+				try:
+					os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+				except OSError as e:
+					errors.append(f'SCHED_FIFO priority {self.priority}: {e.strerror}')
+		self.sched_error = '; '.join(errors) or None
+
+	# --------------------------------------
+	# asynchronous transfers
+	# --------------------------------------
+	def submit(self, dev_handle, endpoint, data=None, length=None, tag=None, timeout=EP2IN_TIMEOUT):
+		if endpoint & usb.LIBUSB_ENDPOINT_IN:
+			if length is None:
+				raise ValueError('IN transfer needs a length')
+			buf = (ct.c_ubyte*length)()
+		else:
+			data = memoryview(data).cast('B')
+			length = len(data)
+			buf = (ct.c_ubyte*length).from_buffer_copy(data)
+		return self._submit(dev_handle, endpoint, buf, length, tag, None, timeout)
+
+	def _submit(self, dev_handle, endpoint, buf, length, tag, waiter, timeout):
+		if not self.running:
+			return self.error or usb.LIBUSB_ERROR_INTERRUPTED
+		try:
+			xfer = self._free.pop()
+		except IndexError:
+			xfer = usb.alloc_transfer(0)
+			if not xfer:
+				return usb.LIBUSB_ERROR_NO_MEM
+
+		fill = usb.fill_interrupt_transfer if endpoint in INTERRUPT_ENDPOINTS else usb.fill_bulk_transfer
+		fill(xfer, dev_handle, endpoint, ct.cast(buf, ct.POINTER(ct.c_ubyte)), length,
+				self._cb, None, timeout)
+		key = ct.addressof(xfer.contents)
+		self._pending[key] = [xfer, buf, tag, waiter, time.perf_counter_ns()]
+		r = usb.submit_transfer(xfer)
+		if r < 0:
+			del self._pending[key]
+			self._free.append(xfer)
+		else:
+			self.submitted += 1
+		return r
+
+	# --------------------------------------
+	# transfer completion - runs on the
+	# event thread
+	# --------------------------------------
+	def _on_complete(self, xfer):
+		ns = time.perf_counter_ns()
+		key = ct.addressof(xfer.contents)
+		xfer, buf, tag, waiter, t0 = self._pending.pop(key)
+		x = xfer.contents
+		endpoint = x.endpoint
+		n = x.actual_length
+		length = x.length
+		if x.status == usb.LIBUSB_TRANSFER_CANCELLED:
+			r = usb.LIBUSB_ERROR_INTERRUPTED
+		else:
+			r = STATUS_CODES.get(x.status, usb.LIBUSB_ERROR_IO)
+		self._free.append(xfer)
+		self.completed += 1
+		ns -= t0
+		if self.metrics is not None and r != usb.LIBUSB_ERROR_INTERRUPTED:
+			self.metrics.record(endpoint, r, length, n, ns)
+
+		if waiter is not None:
+			waiter[1] = r
+			waiter[2] = n
+			waiter[0].set()
+			return
+		data = ct.string_at(buf, n) if endpoint & usb.LIBUSB_ENDPOINT_IN else None
+		self.completions.put(Completion(tag, endpoint, r, data, n, ns))
+
+	# --------------------------------------
+	# blocking calls completed by the event
+	# thread - same arguments as usb.*
+	# --------------------------------------
+	def bulk_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		if not self.running:
+			return usb.bulk_transfer(dev_handle, endpoint, data, length, transferred, timeout)
+		return self._wait(dev_handle, endpoint, data, length, transferred, timeout)
+
+	def interrupt_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		if not self.running:
+			return usb.interrupt_transfer(dev_handle, endpoint, data, length, transferred, timeout)
+		return self._wait(dev_handle, endpoint, data, length, transferred, timeout)
+
+	def _wait(self, dev_handle, endpoint, data, length, transferred, timeout):
+		waiter = getattr(self._local, 'waiter', None)
+		if waiter is None:
+			waiter = self._local.waiter = [threading.Event(), 0, 0]
+		waiter[0].clear()
+		waiter[1] = waiter[2] = 0
+		r = self._submit(dev_handle, endpoint, data, length, None, waiter, timeout)
+		if r < 0:
+			return r
+		while not waiter[0].wait(self.poll_ms / 1000):
+			if not self.running:
+				# the thread died after the submit, before it could
+				# wake this waiter - stop() completes the transfer
+				return self.error or usb.LIBUSB_ERROR_INTERRUPTED
+		if transferred is not None:
+			set_ref_value(transferred, waiter[2])
+		return waiter[1]
+
+	def stats(self):
+		return {
+			'running': self.running,
+			'cpu': sorted(self.cpu) if self.cpu is not None else None,
+			'priority': self.priority,
+			'sched_error': self.sched_error,
+			'submitted': self.submitted,
+			'completed': self.completed,
+			'in_flight': len(self._pending),
+			'queued': len(self.completions),
+			'passes': self.passes,
+		}
@@ -0,0 +1,565 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Flow control for slow consumers
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials read BULK2 IN into ep_data_in and print it before
+# the next read. A consumer that falls behind has nowhere to put
+# the data: the next read overwrites the buffer, and while nothing
+# reads, the emulator's bursts pile up in the bridge FIFO until
+# it overruns.
+#
+# FlowQueue is a bounded queue of received buffers with high and
+# low watermarks (in bytes). Once the backlog reaches the high
+# watermark one of three policies applies:
+#  - block: put() refuses data until the consumer has drained
+#    the queue down to the low watermark. FlowReader then stops
+#    taking transfers off the bus, the reads park and the bridge
+#    holds the data (USB flow control, nothing is lost).
+#  - drop_oldest: the oldest buffers are discarded to make room.
+#    Memory stays bounded and the newest data is kept; every
+#    drop is counted and reported to 'on_drop'.
+#  - spill: buffers past the high watermark go to a temporary
+#    file and are read back in order as the consumer catches up.
+#    Memory stays bounded, the backlog is limited by disk.
+#
+# Crossing the high watermark calls 'on_high', draining to the
+# low watermark calls 'on_low'. Throttle uses them to send the
+# (assumed, see bridge_defs) throttle opcode so the emulator
+# pauses while the host catches up.
+#
+# FlowReader puts the pieces together: a BulkStream on an event
+# thread feeding a FlowQueue, optionally with a Throttle.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import struct
+import tempfile
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, EP2OUT_TIMEOUT,
+							EP2IN_TIMEOUT, USB_PACKET_SIZE, OPCODE_THROTTLE,
+							THROTTLE_STATE_OFFSET, THROTTLE_PAUSE, THROTTLE_RESUME)
+from bridge_stream import BulkStream, STREAM_XFER_SIZE, STREAM_XFER_COUNT, STREAM_POLL_TIMEOUT
+
+
+#
+# Definitions
+#
+FLOW_BLOCK = 'block'
+FLOW_DROP_OLDEST = 'drop_oldest'
+FLOW_SPILL = 'spill'
+FLOW_POLICIES = (FLOW_BLOCK, FLOW_DROP_OLDEST, FLOW_SPILL)
+
+FLOW_HIGH = 4*1024*1024				# bytes queued before the policy applies
+FLOW_LOW = 1*1024*1024				# bytes the backlog has to drain to
+FLOW_POLL = STREAM_POLL_TIMEOUT		# mS per event thread pass
+
+SPILL_RECORD = struct.Struct('<I')	# length prefix of a spilled buffer
+
+
+# ------------------------------------------------------------
+# Description: FlowQueue
+# ------------------------------------------------------------
+# Thread safe FIFO of bytes buffers, bounded by watermarks:
+#
+#   q = FlowQueue(high=4<<20, low=1<<20, policy='spill')
+#   q.put(data)            # producer, copies 'data'
+#   data = q.get(timeout)  # consumer, None on timeout/close
+#
+# put() returns True once the data is queued. Under 'block' it
+# returns False while the queue is above the watermarks, after
+# waiting up to 'timeout' when 'block' is True. Under
+# 'drop_oldest' and 'spill' it never waits. A buffer larger than
+# 'high' is accepted into an empty queue so it cannot get stuck.
+#
+# 'backlog' counts memory and spilled bytes; the watermark
+# callbacks are called without the lock held, on the thread of
+# the put() or get() that crossed them. close() wakes waiters;
+# get() then returns what is left and None after that.
+# ------------------------------------------------------------
+class FlowQueue:
+
+	def __init__(self, high=FLOW_HIGH, low=FLOW_LOW, policy=FLOW_BLOCK, spill_dir=None,
+					on_high=None, on_low=None, on_drop=None):
+		if policy not in FLOW_POLICIES:
+			raise ValueError(f'unknown policy {policy!r}, expected one of {FLOW_POLICIES}')
+		if not 0 <= low < high:
+			raise ValueError(f'low watermark {low} must be below high watermark {high}')
+		self.high = high
+		self.low = low
+		self.policy = policy
+		self.spill_dir = spill_dir
+		self.on_high = on_high
+		self.on_low = on_low
+		self.on_drop = on_drop
+
+		self.closed = False
+		self.above = False				# between crossing high and draining to low
+
+		self._lock = threading.Lock()
+		self._ready = threading.Condition(self._lock)
+		self._room = threading.Condition(self._lock)
+		self._items = collections.deque()
+		self._bytes = 0					# bytes held in memory
+		self._spill = None				# temporary file, created on first use
+		self._spill_read = 0			# file offsets
+		self._spill_write = 0
+		self._spilled = 0				# bytes waiting in the file
+		self._spilled_items = 0
+
+		# statistics
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.dropped_bytes = 0
+		self.dropped_buffers = 0
+		self.spilled_bytes = 0			# total ever written to the spill file
+		self.refused = 0				# put() calls turned away under 'block'
+		self.high_events = 0
+		self.peak = 0					# largest backlog seen
+
+	def __len__(self):
+		with self._lock:
+			return len(self._items) + self._spilled_items
+
+	@property
+	def backlog(self):
+		return self._bytes + self._spilled
+
+	# --------------------------------------
+	# producer side
+	# --------------------------------------
+	def put(self, data, block=False, timeout=None):
+		data = bytes(data)
+		n = len(data)
+		end = None if timeout is None else time.perf_counter() + timeout
+		crossed = False
+		dropped = 0
+
+		with self._lock:
+			if self.closed:
+				return False
+			if self.policy == FLOW_BLOCK:
+				while self.above or (self._items and self._bytes + n > self.high):
+					if not block or self.closed:
+						self.refused += 1
+						return False
+					wait = None if end is None else end - time.perf_counter()
+					if wait is not None and wait <= 0:
+						self.refused += 1
+						return False
+					self._room.wait(wait)
+			elif self.policy == FLOW_DROP_OLDEST:
+				while self._items and self._bytes + n > self.high:
+					old = self._items.popleft()
+					self._bytes -= len(old)
+					self.dropped_bytes += len(old)
+					self.dropped_buffers += 1
+					dropped += len(old)
+
+			if self.policy == FLOW_SPILL and (self._spilled or (self._items and self._bytes + n > self.high)):
+				self._spill_out(data)
+			else:
+				self._items.append(data)
+				self._bytes += n
+			self.bytes_in += n
+
+			backlog = self._bytes + self._spilled
+			self.peak = max(self.peak, backlog)
+			if not self.above and (backlog >= self.high or dropped or self._spilled):
+				self.above = True
+				self.high_events += 1
+				crossed = True
+			self._ready.notify()
+
+		if dropped and self.on_drop is not None:
+			self.on_drop(dropped)
+		if crossed and self.on_high is not None:
+			self.on_high()
+		return True
+
+	# --------------------------------------
+	# consumer side
+	# --------------------------------------
+	def get(self, timeout=None):
+		end = None if timeout is None else time.perf_counter() + timeout
+		crossed = False
+
+		with self._lock:
+			while not self._items and not self._spilled:
+				if self.closed:
+					return None
+				wait = None if end is None else end - time.perf_counter()
+				if wait is not None and wait <= 0:
+					return None
+				self._ready.wait(wait)
+
+			if not self._items:
+				self._spill_in()
+			data = self._items.popleft()
+			self._bytes -= len(data)
+			self.bytes_out += len(data)
+			if self._spilled and self._bytes <= self.low:
+				self._spill_in()
+
+			if self.above and self._bytes + self._spilled <= self.low:
+				self.above = False
+				crossed = True
+				self._room.notify_all()
+
+		if crossed and self.on_low is not None:
+			self.on_low()
+		return data
+
+	def close(self):
+		with self._lock:
+			self.closed = True
+			self._ready.notify_all()
+			self._room.notify_all()
+
+	def discard(self):
+		# drop everything still queued and remove the spill file
+		with self._lock:
+			self._items.clear()
+			self._bytes = 0
+			self._spilled = 0
+			self._spilled_items = 0
+			if self._spill is not None:
+				self._spill.close()
+				self._spill = None
+			self.above = False
+			self._room.notify_all()
+
+	# --------------------------------------
+	# spill file - called with the lock held
+	# --------------------------------------
+	def _spill_out(self, data):
+		if self._spill is None:
+			self._spill = tempfile.TemporaryFile(prefix='bridge_flow_', dir=self.spill_dir)
+			self._spill_read = self._spill_write = 0
+		self._spill.seek(self._spill_write)
+		self._spill.write(SPILL_RECORD.pack(len(data)))
+		self._spill.write(data)
+		self._spill_write += SPILL_RECORD.size + len(data)
+		self._spilled += len(data)
+		self._spilled_items += 1
+		self.spilled_bytes += len(data)
+
+	def _spill_in(self):
+		# read spilled buffers back up to the high watermark
+		self._spill.seek(self._spill_read)
+		while self._spilled and (not self._items or self._bytes < self.high):
+			n, = SPILL_RECORD.unpack(self._spill.read(SPILL_RECORD.size))
+			data = self._spill.read(n)
+			self._spill_read += SPILL_RECORD.size + n
+			self._items.append(data)
+			self._bytes += n
+			self._spilled -= n
+			self._spilled_items -= 1
+		if not self._spilled:
+			# empty again - start over at the front of the file
+			self._spill.truncate(0)
+			self._spill_read = self._spill_write = 0
+
+	def stats(self):
+		return {
+			'policy': self.policy,
+			'queued': len(self._items) + self._spilled_items,
+			'backlog': self._bytes + self._spilled,
+			'memory': self._bytes,
+			'spilled': self._spilled,
+			'peak': self.peak,
+			'bytes_in': self.bytes_in,
+			'bytes_out': self.bytes_out,
+			'dropped_bytes': self.dropped_bytes,
+			'dropped_buffers': self.dropped_buffers,
+			'spilled_total': self.spilled_bytes,
+			'refused': self.refused,
+			'high_events': self.high_events,
+		}
+
+
+# ------------------------------------------------------------
+# Description: Throttle
+# ------------------------------------------------------------
+# Sends the throttle opcode on BULK2 OUT with one asynchronous
+# transfer, so pause() and resume() never block and are safe to
+# call from transfer callbacks and watermark hooks on any
+# thread. Only the latest requested state matters: a request
+# made while the previous packet is in flight is sent once that
+# packet completes. Someone has to be handling events on 'ctx'
+# (FlowReader's event thread does). 'pauses' and 'resumes' count
+# changes of the requested state, not calls.
+# ------------------------------------------------------------
+class Throttle:
+
+	def __init__(self, dev_handle, ctx=None, endpoint=ENDPOINT_BLK2_OUT, timeout=EP2OUT_TIMEOUT):
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.endpoint = endpoint
+		self.timeout = timeout
+
+		self.paused = False				# last state requested
+		self.error = 0					# last failed send
+
+		self._lock = threading.Lock()
+		self._sent = False				# state the device was last told
+		self._state = False				# state of the packet in flight
+		self._busy = False
+		self._xfer = None
+		self._buffer = (ct.c_ubyte*USB_PACKET_SIZE)()
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+		# statistics
+		self.pauses = 0
+		self.resumes = 0
+
+	def open(self):
+		if self._xfer is None:
+			self._xfer = usb.alloc_transfer(0)
+			if not self._xfer:
+				self._xfer = None
+				return usb.LIBUSB_ERROR_NO_MEM
+		return 0
+
+	def close(self):
+		if self._busy:
+			# libusb still owns it - leaking beats a use after free
+			return
+		if self._xfer is not None:
+			usb.free_transfer(self._xfer)
+			self._xfer = None
+
+	def pause(self):
+		self._request(True)
+
+	def resume(self):
+		self._request(False)
+
+	def _request(self, paused):
+		with self._lock:
+			if paused != self.paused:
+				self.paused = paused
+				if paused:
+					self.pauses += 1
+				else:
+					self.resumes += 1
+			# a repeat still retries a send that failed
+			if not self._busy:
+				self._send()
+
+	def _send(self):
+		# called with the lock held
+		if self._xfer is None or self.paused == self._sent:
+			return
+		self._buffer[0] = OPCODE_THROTTLE
+		self._buffer[THROTTLE_STATE_OFFSET] = THROTTLE_PAUSE if self.paused else THROTTLE_RESUME
+		usb.fill_bulk_transfer(self._xfer, self.dev_handle, self.endpoint,
+								ct.cast(self._buffer, ct.POINTER(ct.c_ubyte)), USB_PACKET_SIZE,
+								self._cb, None, self.timeout)
+		state = self.paused
+		r = usb.submit_transfer(self._xfer)
+		if r < 0:
+			self.error = r
+		else:
+			self._busy = True
+			self._state = state
+
+	def _on_complete(self, xfer):
+		with self._lock:
+			self._busy = False
+			if xfer.contents.status == usb.LIBUSB_TRANSFER_COMPLETED:
+				self._sent = self._state
+			elif xfer.contents.status != usb.LIBUSB_TRANSFER_CANCELLED:
+				self.error = usb.LIBUSB_ERROR_IO
+				return
+			self._send()
+
+
+# ------------------------------------------------------------
+# Description: FlowReader
+# ------------------------------------------------------------
+# BULK2 IN (0x83) into a FlowQueue on an event thread:
+#
+#   with FlowReader(session.dev_handle, session.ctx, policy='spill',
+#                   throttle=True) as reader:
+#       for data in reader:
+#           slow_consumer(data)
+#
+# The BulkStream runs in iterator mode. Each filled ring slot is
+# copied into the queue and released at once; under 'block' a
+# refused slot stays held, so as slots run out the reads park
+# and the bus stops moving data until get() drains the queue to
+# the low watermark. 'queue' may be a FlowQueue made by the
+# caller, otherwise one is made from 'high', 'low', 'policy' and
+# 'spill_dir'.
+#
+# With 'throttle' the emulator is paused at the high watermark
+# and resumed at the low one. Data already in flight or in the
+# bridge FIFO still arrives while paused, so 'high' should leave
+# room for it under 'drop_oldest'.
+#
+# start() returns a libusb code; 'error' holds the first fatal
+# one seen by the stream.
+# ------------------------------------------------------------
+class FlowReader:
+
+	def __init__(self, dev_handle, ctx=None, queue=None, high=FLOW_HIGH, low=FLOW_LOW,
+					policy=FLOW_BLOCK, spill_dir=None, throttle=False,
+					endpoint=ENDPOINT_BLK2_IN, transfer_size=STREAM_XFER_SIZE,
+					num_transfers=STREAM_XFER_COUNT, timeout=EP2IN_TIMEOUT, metrics=None):
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.running = False
+		self.error = 0
+
+		if queue is None:
+			queue = FlowQueue(high, low, policy, spill_dir)
+		self.queue = queue
+		self._on_high = queue.on_high
+		self._on_low = queue.on_low
+		queue.on_high = self._high
+		queue.on_low = self._low
+
+		self.throttle = Throttle(dev_handle, ctx) if throttle else None
+		self.stream = BulkStream(dev_handle, ctx=ctx, endpoint=endpoint,
+									transfer_size=transfer_size, num_transfers=num_transfers,
+									timeout=timeout, metrics=metrics)
+		self.stream.after_poll = self._after_poll
+		self._held = collections.deque()	# slots refused by a blocking queue
+		self._thread = None
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'flow start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		data = self.get()
+		if data is None:
+			raise StopIteration
+		return data
+
+	def start(self):
+		if self.running:
+			return 0
+		self.error = 0
+		if self.throttle is not None:
+			r = self.throttle.open()
+			if r < 0:
+				return r
+		r = self.stream.start()
+		if r < 0:
+			if self.throttle is not None:
+				self.throttle.close()
+			return r
+		self.running = True
+		self._thread = threading.Thread(target=self._run, name='bridge-flow', daemon=True)
+		self._thread.start()
+		return 0
+
+	# --------------------------------------
+	# stop reading; queued data stays
+	# available to get() until it is empty
+	# --------------------------------------
+	def stop(self):
+		# a stream error ends the event thread with running False,
+		# but the transfers still have to be handed back
+		if self._thread is None:
+			return
+		self.running = False
+		usb.interrupt_event_handler(self.ctx)
+		self._thread.join()
+		self._thread = None
+
+		while self._held:
+			self.stream.release(self._held.popleft()[0])
+		self.stream.stop()
+		if self.throttle is not None:
+			if self.throttle.paused:
+				self.throttle.resume()
+			while self.throttle._busy:
+				tv = usb.timeval(0, FLOW_POLL * 1000)
+				if usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None) < 0:
+					break
+			self.throttle.close()
+		self.queue.close()
+
+	def get(self, timeout=None):
+		return self.queue.get(timeout)
+
+	# --------------------------------------
+	# watermark hooks
+	# --------------------------------------
+	def _high(self):
+		if self.throttle is not None:
+			self.throttle.pause()
+		if self._on_high is not None:
+			self._on_high()
+
+	def _low(self):
+		if self.throttle is not None:
+			self.throttle.resume()
+		if self._on_low is not None:
+			self._on_low()
+		if self._held:
+			# the event thread is holding slots for room in the queue
+			usb.interrupt_event_handler(self.ctx)
+
+	# --------------------------------------
+	# event thread
+	# --------------------------------------
+	def _run(self):
+		while self.running:
+			self.stream.poll(FLOW_POLL)
+			if self.stream.error and self.error == 0:
+				self.error = self.stream.error
+				self.running = False
+		if self.error:
+			self.queue.close()
+
+	def _after_poll(self):
+		ring = self.stream.ring
+		while self._held or len(ring):
+			slot, data = self._held[0] if self._held else ring.get()
+			if not self.queue.put(data):
+				if not self._held:
+					self._held.append((slot, data))
+				return
+			if self._held:
+				self._held.popleft()
+			self.stream.release(slot)
+
+	def stats(self):
+		s = self.queue.stats()
+		s['in_bytes'] = self.stream.bytes_received
+		s['in_parked'] = len(self.stream._parked)
+		s['held_slots'] = len(self._held) + len(self.stream.ring)
+		if self.throttle is not None:
+			s['pauses'] = self.throttle.pauses
+			s['resumes'] = self.throttle.resumes
+		return s
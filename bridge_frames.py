@@ -0,0 +1,231 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - SSI frames and typed messages
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials build packets as raw c_ubyte arrays and write the
+# opcode (10d echo, 12d 8k burst) straight into ep_data_out[0].
+# Nothing describes the packet or the 68 byte SSI frame the bridge
+# turns it into, and picking packets apart a byte at a time in
+# Python does not keep up with the bus.
+#
+# SSI frame layout (see supplemental/BD2.png), little endian as
+# seen on MOSI (02h 00h 0Ah 01h ... for a test case 1 echo):
+#
+#   byte[0..1]    interface number (1 = INT1, 2 = BULK2)
+#   byte[2..65]   64 byte USB packet
+#   byte[66..67]  reserved
+#
+# Message is a small __slots__ class for one packet: opcode,
+# payload and the interface it travels on. The batch functions
+# convert whole transfer buffers at once:
+#  - encode_packets() / decode_packets(): messages <-> 64 byte
+#    packets with precompiled struct formats (pack_into,
+#    iter_unpack)
+#  - encode_frames() / decode_frames(): packets <-> 68 byte SSI
+#    frames, e.g. for an embedded side model or an SSI capture
+#  - FRAME_DTYPE / PACKET_DTYPE with frames_array(),
+#    packets_to_frames() and frames_to_packets() do the same as
+#    NumPy structured arrays, with no per packet Python work
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import struct
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from bridge_defs import (USB_PACKET_SIZE, INT1_INTERFACE, BULK2_INTERFACE, OPCODE_ECHO,
+							OPCODE_BURST_8K, OPCODE_THROTTLE, OPCODE_BATCH)
+
+
+#
+# Definitions
+#
+SSI_HEADER_SIZE = 2					# interface number
+SSI_FOOTER_SIZE = 2					# reserved
+SSI_FRAME_SIZE = SSI_HEADER_SIZE + USB_PACKET_SIZE + SSI_FOOTER_SIZE
+PAYLOAD_SIZE = USB_PACKET_SIZE - 1	# packet bytes after the opcode
+
+PACKET = struct.Struct(f'<B{PAYLOAD_SIZE}s')
+FRAME = struct.Struct(f'<H{USB_PACKET_SIZE}sH')
+
+OPCODE_NAMES = {
+	OPCODE_ECHO: 'echo',
+	OPCODE_BURST_8K: 'burst_8k',
+	OPCODE_THROTTLE: 'throttle',
+	OPCODE_BATCH: 'batch',
+}
+INTERFACE_NAMES = {
+	INT1_INTERFACE: 'INT1',
+	BULK2_INTERFACE: 'BULK2',
+}
+
+
+def _need_numpy():
+	if np is None:
+		raise RuntimeError('numpy is not installed')
+
+
+# ------------------------------------------------------------
+# Description: Message
+# ------------------------------------------------------------
+# One 64 byte packet: opcode byte plus up to 63 payload bytes.
+# Short payloads are zero padded on the wire; decoded messages
+# keep all 63 bytes.
+#
+#   Message(OPCODE_ECHO, b'\x01\x02\x03\x04\x05').packet()
+#   Message.from_frame(frame).opcode
+# ------------------------------------------------------------
+class Message:
+
+	__slots__ = ('opcode', 'payload', 'interface')
+
+	def __init__(self, opcode, payload=b'', interface=BULK2_INTERFACE):
+		if len(payload) > PAYLOAD_SIZE:
+			raise ValueError(f'payload of {len(payload)} bytes exceeds {PAYLOAD_SIZE}')
+		self.opcode = opcode
+		self.payload = payload
+		self.interface = interface
+
+	def __repr__(self):
+		name = OPCODE_NAMES.get(self.opcode, self.opcode)
+		iface = INTERFACE_NAMES.get(self.interface, self.interface)
+		return f'Message({name}, {bytes(self.payload[:8]).hex()}.., {iface})'
+
+	def __eq__(self, other):
+		if not isinstance(other, Message):
+			return NotImplemented
+		return (self.opcode == other.opcode and self.interface == other.interface
+				and bytes(self.payload).rstrip(b'\0') == bytes(other.payload).rstrip(b'\0'))
+
+	def packet(self):
+		return PACKET.pack(self.opcode, self.payload)
+
+	def frame(self):
+		return FRAME.pack(self.interface, self.packet(), 0)
+
+	@classmethod
+	def from_packet(cls, data, interface=BULK2_INTERFACE):
+		opcode, payload = PACKET.unpack_from(data)
+		return cls(opcode, payload, interface)
+
+	@classmethod
+	def from_frame(cls, data):
+		interface, packet, reserved = FRAME.unpack_from(data)
+		opcode, payload = PACKET.unpack(packet)
+		return cls(opcode, payload, interface)
+
+
+# ------------------------------------------------------------
+# Description: encode_packets / decode_packets
+# ------------------------------------------------------------
+# encode_packets() packs messages back to back into 'out' (a
+# writable buffer, created when None) and returns it, ready for
+# one multi packet transfer. decode_packets() turns the whole
+# packets of a received buffer into Messages; a trailing partial
+# packet is ignored.
+# ------------------------------------------------------------
+def encode_packets(messages, out=None):
+	messages = list(messages)
+	if out is None:
+		out = bytearray(len(messages) * USB_PACKET_SIZE)
+	pack_into = PACKET.pack_into
+	for i, m in enumerate(messages):
+		pack_into(out, i * USB_PACKET_SIZE, m.opcode, m.payload)
+	return out
+
+def decode_packets(data, interface=BULK2_INTERFACE):
+	view = memoryview(data).cast('B')
+	view = view[:len(view) - len(view) % USB_PACKET_SIZE]
+	return [Message(op, payload, interface) for op, payload in PACKET.iter_unpack(view)]
+
+
+# ------------------------------------------------------------
+# Description: encode_frames / decode_frames
+# ------------------------------------------------------------
+# Packets <-> SSI frames. encode_frames() wraps every whole
+# packet of 'data' in a frame for 'interface'. decode_frames()
+# returns (interface, packet bytes) pairs.
+# ------------------------------------------------------------
+def encode_frames(data, interface=BULK2_INTERFACE):
+	view = memoryview(data).cast('B')
+	npkts = len(view) // USB_PACKET_SIZE
+	out = bytearray(FRAME.pack(interface, b'', 0) * npkts)
+	frames = memoryview(out)
+	for i in range(npkts):
+		base = i * USB_PACKET_SIZE
+		start = i * SSI_FRAME_SIZE + SSI_HEADER_SIZE
+		frames[start:start + USB_PACKET_SIZE] = view[base:base + USB_PACKET_SIZE]
+	return out
+
+def decode_frames(data):
+	view = memoryview(data).cast('B')
+	view = view[:len(view) - len(view) % SSI_FRAME_SIZE]
+	return [(iface, packet) for iface, packet, reserved in FRAME.iter_unpack(view)]
+
+
+# ------------------------------------------------------------
+# Description: NumPy batch conversion
+# ------------------------------------------------------------
+# frames_array() views a buffer of SSI frames as a FRAME_DTYPE
+# array without copying. packets_to_frames() builds the frames
+# for a buffer of packets in one assignment per field.
+# frames_to_packets() returns the packets of the frames as one
+# contiguous uint8 array (n x 64), optionally only those for
+# 'interface'.
+# ------------------------------------------------------------
+if np is not None:
+	FRAME_DTYPE = np.dtype([
+		('interface', '<u2'),
+		('packet', 'u1', (USB_PACKET_SIZE,)),
+		('reserved', '<u2'),
+	])
+	PACKET_DTYPE = np.dtype([
+		('opcode', 'u1'),
+		('payload', 'u1', (PAYLOAD_SIZE,)),
+	])
+else:
+	FRAME_DTYPE = None
+	PACKET_DTYPE = None
+
+def frames_array(data):
+	_need_numpy()
+	n = len(memoryview(data).cast('B')) // SSI_FRAME_SIZE
+	return np.frombuffer(data, dtype=FRAME_DTYPE, count=n)
+
+def packets_array(data):
+	_need_numpy()
+	n = len(memoryview(data).cast('B')) // USB_PACKET_SIZE
+	return np.frombuffer(data, dtype=PACKET_DTYPE, count=n)
+
+def packets_to_frames(data, interface=BULK2_INTERFACE):
+	_need_numpy()
+	pkts = np.frombuffer(data, dtype=np.uint8)
+	n = len(pkts) // USB_PACKET_SIZE
+	frames = np.zeros(n, dtype=FRAME_DTYPE)
+	frames['interface'] = interface
+	frames['packet'] = pkts[:n * USB_PACKET_SIZE].reshape(n, USB_PACKET_SIZE)
+	return frames
+
+def frames_to_packets(frames, interface=None):
+	_need_numpy()
+	if not isinstance(frames, np.ndarray):
+		frames = frames_array(frames)
+	if interface is not None:
+		frames = frames[frames['interface'] == interface]
+	return np.ascontiguousarray(frames['packet'])
@@ -0,0 +1,197 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - BULK2 message batching
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Every bulk_transfer() to BULK2 OUT in the tutorials sends a full
+# 64 byte packet even when only a handful of bytes carry data.
+# Applications sending bursts of small commands pay a whole USB
+# packet and a Python to C call for each one.
+#
+# BatchWriter packs small messages back to back into 64 byte
+# packets and sends several packets per transfer. A batch goes out
+# once it is full or once its oldest message has waited for the
+# configured deadline. deframe() splits received packets back into
+# the individual messages.
+#
+# Packet layout - the batch opcode (14d) first, so byte[0] is an
+# opcode as the emulator expects, then each message prefixed by
+# its length:
+#
+#   [14][len][len bytes] [len][len bytes] ... [0 / end of packet]
+#
+# A zero length byte (or the end of the packet) ends the messages
+# in that packet. Messages never straddle packets so each 64 byte
+# packet can be decoded on its own by the embedded side.
+#
+# The batch opcode is not part of the published emulator. It is
+# assumed in bridge_defs and implemented by bridge_sim, which runs
+# every message as a command of its own; the embedded firmware
+# needs the same change before batches can be sent to hardware.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import ctypes as ct
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, EP2OUT_TIMEOUT, USB_PACKET_SIZE, OPCODE_BATCH,
+							BATCH_HEADER)
+
+
+#
+# Definitions
+#
+BATCH_PACKETS = 16				# packets per transfer at most
+BATCH_DELAY = 0.002				# S a message may wait for company
+MAX_MESSAGE = USB_PACKET_SIZE - BATCH_HEADER - 1
+
+
+# ------------------------------------------------------------
+# Description: bulk_sink
+# ------------------------------------------------------------
+# Returns a sink for BatchWriter that sends each batch with a
+# blocking usb.bulk_transfer() on BULK2 OUT. Returns the libusb
+# return code of the transfer. Passing a BridgeMetrics as
+# 'metrics' records every batch transfer.
+# ------------------------------------------------------------
+def bulk_sink(dev_handle, endpoint=ENDPOINT_BLK2_OUT, timeout=EP2OUT_TIMEOUT, metrics=None):
+	transferred = ct.c_int(0)
+	transfer = usb.bulk_transfer if metrics is None else metrics.bulk_transfer
+
+	def sink(buf, length):
+		return transfer(dev_handle, endpoint, buf, length,
+							ct.byref(transferred), timeout)
+
+	return sink
+
+
+# ------------------------------------------------------------
+# Description: BatchWriter
+# ------------------------------------------------------------
+# Coalesces messages of up to 62 bytes into 64 byte packets and
+# hands whole batches of up to 'max_packets' packets to
+# 'sink(buffer, length)'. A batch is flushed when:
+#  - it is full,
+#  - the oldest queued message is older than 'max_delay' when
+#    send() or poll() is called, or
+#  - flush() is called (also on leaving a with block).
+#
+# poll() should be called periodically by an idle application
+# so a lone message does not wait for the next send().
+# ------------------------------------------------------------
+class BatchWriter:
+
+	def __init__(self, sink, max_packets=BATCH_PACKETS, max_delay=BATCH_DELAY):
+		self.sink = sink
+		self.max_packets = max_packets
+		self.max_delay = max_delay
+
+		# statistics
+		self.messages = 0
+		self.batches = 0
+		self.packets = 0
+		self.error = 0
+
+		self._buf = (ct.c_ubyte*(max_packets * USB_PACKET_SIZE))()
+		self._view = memoryview(self._buf).cast('B')
+		self._pos = 0					# write offset into the batch
+		self._deadline = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.flush()
+		return False
+
+	# --------------------------------------
+	# queue one message
+	# --------------------------------------
+	def send(self, msg):
+		n = len(msg)
+		if n == 0 or n > MAX_MESSAGE:
+			raise ValueError(f'message length {n} outside 1..{MAX_MESSAGE}')
+
+		# move to the next packet if it does not fit in this one
+		room = USB_PACKET_SIZE - (self._pos % USB_PACKET_SIZE)
+		if n + 1 > room:
+			self._pos += room
+			if self._pos >= len(self._buf):
+				self.flush()
+		if self._pos % USB_PACKET_SIZE == 0:
+			self._view[self._pos] = OPCODE_BATCH
+			self._pos += BATCH_HEADER
+
+		if self._deadline is None:
+			self._deadline = time.perf_counter() + self.max_delay
+
+		self._view[self._pos] = n
+		self._view[self._pos + 1:self._pos + 1 + n] = msg
+		self._pos += n + 1
+		self.messages += 1
+
+		if self._pos >= len(self._buf):
+			self.flush()
+		else:
+			self.poll()
+
+	def poll(self):
+		if self._deadline is not None and time.perf_counter() >= self._deadline:
+			self.flush()
+
+	# --------------------------------------
+	# send whatever is queued
+	# --------------------------------------
+	def flush(self):
+		if self._pos == 0:
+			self._deadline = None
+			return 0
+
+		npkts = (self._pos + USB_PACKET_SIZE - 1) // USB_PACKET_SIZE
+		length = npkts * USB_PACKET_SIZE
+		r = self.sink(self._buf, length)
+		if r is not None and r < 0 and self.error == 0:
+			self.error = r
+
+		self.batches += 1
+		self.packets += npkts
+		ct.memset(self._buf, 0, length)
+		self._pos = 0
+		self._deadline = None
+		return r
+
+
+# ------------------------------------------------------------
+# Description: deframe
+# ------------------------------------------------------------
+# Generator yielding each message packed by BatchWriter in
+# 'data' (any number of whole 64 byte packets) as a memoryview
+# into 'data' - no copies are made. Packets that do not start
+# with the batch opcode are skipped.
+# ------------------------------------------------------------
+def deframe(data):
+	view = memoryview(data).cast('B')
+	for base in range(0, len(view), USB_PACKET_SIZE):
+		if view[base] != OPCODE_BATCH:
+			continue
+		pos = base + BATCH_HEADER
+		end = min(base + USB_PACKET_SIZE, len(view))
+		while pos < end:
+			n = view[pos]
+			if n == 0 or pos + 1 + n > end:
+				break
+			yield view[pos + 1:pos + 1 + n]
+			pos += n + 1
@@ -0,0 +1,198 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Streaming integrity checks
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Test case 2 only checks that bulk_transfer() returned without an
+# error. It never checks that all 8192 bytes of the burst arrived,
+# or that they arrived in order.
+#
+# IntegrityChecker follows the packet sequence numbers the embedded
+# emulator puts in every 8k burst packet (bytes 1-2, see
+# bridge_sim) across any number of buffers, and keeps running
+# counts of gaps (lost packets), duplicates, bad opcodes, short
+# transfers and partial packets. It is a bridge_decode.BurstVerifier,
+# which carries the sequence and any partial packet from one buffer
+# to the next, with its own packet check in place of the NumPy one.
+#
+# The common case, a buffer that continues the sequence
+# exactly, is confirmed with a handful of C level operations per
+# buffer: the opcode and sequence low bytes of every packet are
+# taken with strided memoryview slices and compared against
+# precomputed byte strings. Only a buffer that fails is walked
+# packet by packet to classify the error, so the checker can stay
+# on for every buffer in production. No NumPy is needed.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+
+from bridge_decode import BurstVerifier
+from bridge_defs import USB_PACKET_SIZE, OPCODE_BURST_8K, BURST_SEQ_OFFSET
+
+
+#
+# Definitions
+#
+SEQ_MASK = 0xffff
+SEQ_HALF = 0x8000				# further ahead than this counts as behind
+RAMP = bytes(range(256)) * 2	# sliced for the expected low byte sequence
+ERROR_LOG_SIZE = 64				# most recent errors kept
+
+
+# ------------------------------------------------------------
+# Description: IntegrityChecker
+# ------------------------------------------------------------
+# Feed every received buffer in order:
+#
+#   checker = IntegrityChecker()
+#   for slot, data in stream:
+#       checker.check(data, stream.transfer_size)
+#       stream.release(slot)
+#   print(checker.stats())
+#
+# Passing 'requested' counts transfers that returned fewer bytes
+# than asked for in 'short'. A streaming read can legitimately
+# end short on a timeout; lost data shows up as 'gaps'.
+#
+# Counters:
+#   packets      whole packets checked
+#   gaps         packets missing from the sequence
+#   gap_events   places where the sequence jumped ahead
+#   duplicates   packets at or behind the expected sequence
+#   bad_opcode   packets whose byte[0] is not 12d
+#   seq_errors   gap events plus duplicates
+#   short        transfers shorter than requested
+#   partial      buffers ending part way through a packet
+#
+# 'errors' keeps the last ERROR_LOG_SIZE (kind, packet number,
+# detail) tuples and 'on_error(kind, packet, detail)' is called
+# for each as it is found.
+# ------------------------------------------------------------
+class IntegrityChecker(BurstVerifier):
+
+	def __init__(self, expected_seq=None, on_error=None):
+		super().__init__(expected_seq)
+		self.on_error = on_error
+
+		self.bytes = 0
+		self.buffers = 0
+		self.gaps = 0
+		self.gap_events = 0
+		self.duplicates = 0
+		self.short = 0
+		self.partial = 0
+		self.errors = collections.deque(maxlen=ERROR_LOG_SIZE)
+
+		self._opcodes = b''
+
+	def check(self, data, requested=None):
+		n = len(data)
+		self.buffers += 1
+		self.bytes += n
+		if requested is not None and n < requested:
+			self.short += 1
+
+		super().check(data)
+		if self._tail:
+			self.partial += 1
+
+	def _check_packets(self, view):
+		npkts = len(view) // USB_PACKET_SIZE
+		if not npkts:
+			return
+		opcodes = view[0::USB_PACKET_SIZE]
+		lo = view[BURST_SEQ_OFFSET::USB_PACKET_SIZE]
+		first = lo[0] | (view[BURST_SEQ_OFFSET + 1] << 8)
+		last_base = (npkts - 1) * USB_PACKET_SIZE + BURST_SEQ_OFFSET
+		last = view[last_base] | (view[last_base + 1] << 8)
+
+		if len(self._opcodes) < npkts:
+			self._opcodes = bytes([OPCODE_BURST_8K]) * npkts
+
+		# fast path - right opcodes and an unbroken sequence
+		exp = first if self.expected_seq is None else self.expected_seq
+		if (first == exp and last == (exp + npkts - 1) & SEQ_MASK
+				and opcodes == self._opcodes[:npkts] and self._ramp(lo, exp & 0xff, npkts)):
+			self.packets += npkts
+			self.expected_seq = (last + 1) & SEQ_MASK
+			return
+
+		self._classify(view, npkts)
+
+	@staticmethod
+	def _ramp(lo, start, n):
+		if n <= 256:
+			return lo == RAMP[start:start + n]
+		for base in range(0, n, 256):
+			k = min(256, n - base)
+			if lo[base:base + k] != RAMP[start:start + k]:
+				return False
+		return True
+
+	# --------------------------------------
+	# slow path - walk the packets to find
+	# out what went wrong
+	# --------------------------------------
+	def _classify(self, view, npkts):
+		for i in range(npkts):
+			base = i * USB_PACKET_SIZE
+			number = self.packets
+			self.packets += 1
+
+			if view[base] != OPCODE_BURST_8K:
+				self._error('opcode', number, view[base])
+				self.bad_opcode += 1
+				# assume it took its place in the sequence
+				if self.expected_seq is not None:
+					self.expected_seq = (self.expected_seq + 1) & SEQ_MASK
+				continue
+
+			seq = view[base + BURST_SEQ_OFFSET] | (view[base + BURST_SEQ_OFFSET + 1] << 8)
+			exp = self.expected_seq
+			if exp is None or seq == exp:
+				self.expected_seq = (seq + 1) & SEQ_MASK
+				continue
+
+			ahead = (seq - exp) & SEQ_MASK
+			if ahead < SEQ_HALF:
+				self.gaps += ahead
+				self.gap_events += 1
+				self.seq_errors += 1
+				self._error('gap', number, (exp, seq))
+				self.expected_seq = (seq + 1) & SEQ_MASK
+			else:
+				self.duplicates += 1
+				self.seq_errors += 1
+				self._error('duplicate', number, (exp, seq))
+
+	def _error(self, kind, number, detail):
+		self.errors.append((kind, number, detail))
+		if self.on_error is not None:
+			self.on_error(kind, number, detail)
+
+	def stats(self):
+		out = super().stats()
+		out.update({
+			'buffers': self.buffers,
+			'bytes': self.bytes,
+			'gaps': self.gaps,
+			'gap_events': self.gap_events,
+			'duplicates': self.duplicates,
+			'short': self.short,
+			'partial': self.partial,
+			'next_seq': self.expected_seq,
+		})
+		return out
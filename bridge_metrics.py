@@ -0,0 +1,323 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Transfer instrumentation
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials only print the byte count and return code of each
+# usb.bulk_transfer(). That is not enough to tell a starved bus
+# from a stalled embedded emulator once an application runs for
+# hours.
+#
+# BridgeMetrics keeps, per endpoint:
+#  - counters for transfers, bytes, short transfers, timeouts,
+#    errors and retries
+#  - a latency histogram with log-linear (HDR style) buckets,
+#    16 per power of two, so any latency from 1nS to ~68S is
+#    held to within ~6% in a fixed 528 entry table
+#
+# Recording is a couple of integer operations and list increments
+# so it can stay enabled on the hot path. Blocking transfers are
+# instrumented by calling bulk_transfer()/interrupt_transfer() on
+# a BridgeMetrics object (same arguments as the usb functions),
+# streams by passing 'metrics' to BulkStream, and batches by
+# passing 'metrics' to bulk_sink().
+#
+# Trace hooks added with add_hook() are called after every
+# recorded transfer. Counters are read with snapshot() as a dict
+# or prometheus() in the Prometheus text exposition format.
+#
+# Updates are not locked. Python integer updates can at worst
+# lose a count when two threads record on the same endpoint at
+# the same instant, which is acceptable for statistics.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import time
+from bridge_backend import usb
+
+
+#
+# Definitions
+#
+HIST_SUB_BITS = 4					# 2^4 linear buckets per power of two
+HIST_SUB = 1 << HIST_SUB_BITS
+HIST_MAX_BITS = 36					# largest tracked latency 2^36 nS (~68S)
+HIST_SIZE = (HIST_MAX_BITS - HIST_SUB_BITS + 1) * HIST_SUB
+
+# Prometheus histogram bounds in seconds (1-2-5 series, 10uS - 10S)
+PROM_BOUNDS = [m * 10.0**e for e in range(-5, 1) for m in (1, 2, 5)] + [10.0]
+PROM_PREFIX = 'bridge'
+
+
+# ------------------------------------------------------------
+# Description: ref_value / set_ref_value
+# ------------------------------------------------------------
+# Read and write the int behind the 'transferred' argument of
+# the blocking usb calls, which may be ct.byref(c_int) or, as in
+# the tutorials, a POINTER(c_int).
+# ------------------------------------------------------------
+def ref_value(ref):
+	# byref() objects carry the referenced object in _obj
+	obj = getattr(ref, '_obj', ref)
+	return obj.contents.value if hasattr(obj, 'contents') else obj.value
+
+def set_ref_value(ref, value):
+	obj = getattr(ref, '_obj', ref)
+	if hasattr(obj, 'contents'):
+		obj = obj.contents
+	obj.value = value
+
+
+# ------------------------------------------------------------
+# Description: LatencyHistogram
+# ------------------------------------------------------------
+# Log-linear histogram of nS values. Values below 32 get a bucket
+# each, above that every power of two is split into 16 equal
+# buckets. Values past the top of the table land in the last
+# bucket. percentile() returns the upper edge of the bucket
+# holding the requested rank.
+# ------------------------------------------------------------
+class LatencyHistogram:
+
+	def __init__(self):
+		self.counts = [0] * HIST_SIZE
+		self.count = 0
+		self.total = 0
+		self.min = 0
+		self.max = 0
+
+	def record(self, ns):
+		if ns < 2 * HIST_SUB:
+			i = ns if ns > 0 else 0
+		else:
+			shift = ns.bit_length() - HIST_SUB_BITS - 1
+			i = (shift + 1) * HIST_SUB + (ns >> shift) - HIST_SUB
+			if i >= HIST_SIZE:
+				i = HIST_SIZE - 1
+		self.counts[i] += 1
+		if self.count == 0 or ns < self.min:
+			self.min = ns
+		if ns > self.max:
+			self.max = ns
+		self.count += 1
+		self.total += ns
+
+	@staticmethod
+	def upper_bound(i):
+		if i < 2 * HIST_SUB:
+			return i
+		shift = i // HIST_SUB - 1
+		return ((i % HIST_SUB + HIST_SUB + 1) << shift) - 1
+
+	def percentile(self, p):
+		if self.count == 0:
+			return 0
+		rank = max(1, -(-self.count * p // 100))
+		seen = 0
+		for i, n in enumerate(self.counts):
+			seen += n
+			if seen >= rank:
+				return min(self.upper_bound(i), self.max)
+		return self.max
+
+	def count_at_or_below(self, ns):
+		seen = 0
+		for i, n in enumerate(self.counts):
+			if n and self.upper_bound(i) > ns:
+				break
+			seen += n
+		return seen
+
+	def mean(self):
+		return self.total / self.count if self.count else 0
+
+	def merge(self, other):
+		for i, n in enumerate(other.counts):
+			if n:
+				self.counts[i] += n
+		if other.count:
+			if self.count == 0 or other.min < self.min:
+				self.min = other.min
+			self.max = max(self.max, other.max)
+		self.count += other.count
+		self.total += other.total
+
+	def reset(self):
+		self.__init__()
+
+
+# ------------------------------------------------------------
+# Description: EndpointMetrics
+# ------------------------------------------------------------
+# Counters and latency histogram for one endpoint.
+# 'short' counts transfers that completed without error but
+# moved less than requested.
+# ------------------------------------------------------------
+class EndpointMetrics:
+
+	def __init__(self, endpoint):
+		self.endpoint = endpoint
+		self.transfers = 0
+		self.bytes = 0
+		self.short = 0
+		self.timeouts = 0
+		self.errors = 0
+		self.retries = 0
+		self.latency = LatencyHistogram()
+
+	def snapshot(self):
+		hist = self.latency
+		return {
+			'endpoint': self.endpoint,
+			'transfers': self.transfers,
+			'bytes': self.bytes,
+			'short': self.short,
+			'timeouts': self.timeouts,
+			'errors': self.errors,
+			'retries': self.retries,
+			'latency_us': {
+				'count': hist.count,
+				'min': hist.min / 1000,
+				'mean': hist.mean() / 1000,
+				'p50': hist.percentile(50) / 1000,
+				'p90': hist.percentile(90) / 1000,
+				'p99': hist.percentile(99) / 1000,
+				'p999': hist.percentile(99.9) / 1000,
+				'max': hist.max / 1000,
+			},
+		}
+
+
+# ------------------------------------------------------------
+# Description: BridgeMetrics
+# ------------------------------------------------------------
+# Per endpoint transfer metrics with optional trace hooks:
+#
+#   metrics = BridgeMetrics()
+#   r = metrics.bulk_transfer(dev_handle, 0x83, rx, 8192, ct.byref(n), 1000)
+#   print(metrics.snapshot())
+#
+# Hooks are called as hook(endpoint, r, requested, transferred,
+# latency_ns) where 'r' is the libusb return code of the transfer.
+# ------------------------------------------------------------
+class BridgeMetrics:
+
+	def __init__(self):
+		self.endpoints = {}				# endpoint address -> EndpointMetrics
+		self.hooks = []
+		self.clock = time.perf_counter_ns
+
+	def endpoint(self, endpoint):
+		ep = self.endpoints.get(endpoint)
+		if ep is None:
+			ep = self.endpoints[endpoint] = EndpointMetrics(endpoint)
+		return ep
+
+	def add_hook(self, hook):
+		self.hooks.append(hook)
+
+	def remove_hook(self, hook):
+		self.hooks.remove(hook)
+
+	def reset(self):
+		self.endpoints = {}
+
+	# --------------------------------------
+	# record one finished transfer
+	# --------------------------------------
+	def record(self, endpoint, r, requested, transferred, ns):
+		ep = self.endpoints.get(endpoint)
+		if ep is None:
+			ep = self.endpoint(endpoint)
+		ep.transfers += 1
+		ep.bytes += transferred
+		ep.latency.record(ns)
+		if r == 0:
+			if transferred < requested:
+				ep.short += 1
+		elif r == usb.LIBUSB_ERROR_TIMEOUT:
+			ep.timeouts += 1
+		else:
+			ep.errors += 1
+		if self.hooks:
+			for hook in self.hooks:
+				hook(endpoint, r, requested, transferred, ns)
+
+	def retry(self, endpoint):
+		self.endpoint(endpoint).retries += 1
+
+	# --------------------------------------
+	# instrumented blocking transfers - same
+	# arguments as the usb functions, plus
+	# retries of transfers that timed out
+	# without moving any data
+	# --------------------------------------
+	def bulk_transfer(self, dev_handle, endpoint, data, length, transferred, timeout, retries=0):
+		return self._transfer(usb.bulk_transfer, dev_handle, endpoint, data, length,
+								transferred, timeout, retries)
+
+	def interrupt_transfer(self, dev_handle, endpoint, data, length, transferred, timeout, retries=0):
+		return self._transfer(usb.interrupt_transfer, dev_handle, endpoint, data, length,
+								transferred, timeout, retries)
+
+	def _transfer(self, fn, dev_handle, endpoint, data, length, transferred, timeout, retries):
+		clock = self.clock
+		while True:
+			t0 = clock()
+			r = fn(dev_handle, endpoint, data, length, transferred, timeout)
+			ns = clock() - t0
+			n = ref_value(transferred)
+			self.record(endpoint, r, length, n, ns)
+			if r != usb.LIBUSB_ERROR_TIMEOUT or n or retries <= 0:
+				return r
+			retries -= 1
+			self.retry(endpoint)
+
+	# --------------------------------------
+	# export
+	# --------------------------------------
+	def snapshot(self):
+		return {f'0x{ep:02x}': m.snapshot() for ep, m in sorted(self.endpoints.items())}
+
+	def prometheus(self, prefix=PROM_PREFIX):
+		counters = [
+			('transfers_total', 'transfers', 'Transfers finished per endpoint.'),
+			('bytes_total', 'bytes', 'Bytes moved per endpoint.'),
+			('short_transfers_total', 'short', 'Transfers that moved less than requested.'),
+			('timeouts_total', 'timeouts', 'Transfers that timed out.'),
+			('errors_total', 'errors', 'Transfers that failed with an error.'),
+			('retries_total', 'retries', 'Transfers retried after a timeout.'),
+		]
+		eps = sorted(self.endpoints.items())
+		lines = []
+		for name, attr, text in counters:
+			lines.append(f'# HELP {prefix}_{name} {text}')
+			lines.append(f'# TYPE {prefix}_{name} counter')
+			for ep, m in eps:
+				lines.append(f'{prefix}_{name}{{endpoint="0x{ep:02x}"}} {getattr(m, attr)}')
+
+		name = f'{prefix}_transfer_latency_seconds'
+		lines.append(f'# HELP {name} Transfer latency per endpoint.')
+		lines.append(f'# TYPE {name} histogram')
+		for ep, m in eps:
+			label = f'endpoint="0x{ep:02x}"'
+			hist = m.latency
+			for bound in PROM_BOUNDS:
+				n = hist.count_at_or_below(int(bound * 1e9))
+				lines.append(f'{name}_bucket{{{label},le="{bound:g}"}} {n}')
+			lines.append(f'{name}_bucket{{{label},le="+Inf"}} {hist.count}')
+			lines.append(f'{name}_sum{{{label}}} {hist.total / 1e9}')
+			lines.append(f'{name}_count{{{label}}} {hist.count}')
+		return '\n'.join(lines) + '\n'
@@ -0,0 +1,436 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Multi-process pipeline
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials transfer, print and compute on one Python thread,
+# and even with BulkStream the consumer runs on the thread that
+# handles libusb events. Heavy per buffer work therefore delays
+# the resubmission of transfers and throughput drops.
+#
+# BridgePipeline splits acquisition and processing into separate
+# processes:
+#  - one reader process opens the bridge, owns the libusb handle
+#    and runs a BulkStream whose ring slots live in a
+#    multiprocessing.shared_memory block
+#  - N worker processes map the same block and run a user
+#    function over each filled slot
+# Only slot numbers travel through the queues between them; the
+# data itself is never pickled or copied. A worker hands its slot
+# back to the reader as soon as the function returns, so
+# consumers scale across cores while the reader does nothing but
+# keep transfers queued.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import gc
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+from bridge_buffers import BufferRing
+from bridge_defs import BURST_8K_SIZE
+
+
+#
+# Definitions
+#
+MP_SLOT_SIZE = BURST_8K_SIZE		# bytes per shared slot
+MP_NUM_SLOTS = 64
+MP_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MP_START_TIMEOUT = 10				# S to wait for the reader to open the bridge
+MP_JOIN_TIMEOUT = 5					# S to wait for each process on stop()
+MP_CONTEXT = 'spawn'				# children must not inherit a libusb context
+
+
+# ------------------------------------------------------------
+# Description: SharedRing
+# ------------------------------------------------------------
+# Layout of the shared memory block: a header of one length and
+# one sequence number per slot, followed by the slots.
+#
+#   lengths   uint32 * num_slots
+#   seqs      uint64 * num_slots
+#   data      slot_size * num_slots
+#
+# The reader writes a slot's length and sequence number before
+# passing the slot number on, so a worker learns everything
+# about a buffer from the shared block. close() must be called
+# in every process that opened the block; the creator also calls
+# unlink().
+# ------------------------------------------------------------
+class SharedRing:
+
+	def __init__(self, slot_size=MP_SLOT_SIZE, num_slots=MP_NUM_SLOTS, name=None):
+		self.slot_size = slot_size
+		self.num_slots = num_slots
+		header = num_slots * (ct.sizeof(ct.c_uint32) + ct.sizeof(ct.c_uint64))
+		self.data_offset = header
+		size = header + slot_size * num_slots
+
+		if name is None:
+			self.shm = shared_memory.SharedMemory(create=True, size=size)
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+		self.name = self.shm.name
+
+		buf = self.shm.buf
+		self.lengths = (ct.c_uint32*num_slots).from_buffer(buf, 0)
+		self.seqs = (ct.c_uint64*num_slots).from_buffer(buf, num_slots * ct.sizeof(ct.c_uint32))
+		self._data = buf[header:]
+
+	def offset(self, slot):
+		return slot * self.slot_size
+
+	def buffer(self, slot):
+		# ctypes array over a slot - for libusb
+		return (ct.c_ubyte*self.slot_size).from_buffer(self.shm.buf, self.data_offset + self.offset(slot))
+
+	def view(self, slot):
+		base = self.offset(slot)
+		return self._data[base:base + self.lengths[slot]]
+
+	def close(self):
+		# every export of the block has to be gone before it can be closed
+		self.lengths = None
+		self.seqs = None
+		if self._data is not None:
+			self._data.release()
+			self._data = None
+		self.shm.close()
+
+	def unlink(self):
+		self.shm.unlink()
+
+
+# ------------------------------------------------------------
+# Description: SharedBufferRing
+# ------------------------------------------------------------
+# BufferRing whose slots are those of a SharedRing, so a
+# BulkStream in the reader process fills shared memory directly.
+# commit() also publishes the length and a running sequence
+# number in the shared header.
+# ------------------------------------------------------------
+class SharedBufferRing(BufferRing):
+
+	def __init__(self, shared):
+		self.shared = shared
+		self.slot_size = shared.slot_size
+		self.num_slots = shared.num_slots
+
+		self.buffers = [shared.buffer(i) for i in range(self.num_slots)]
+		self.pointers = [ct.cast(b, ct.POINTER(ct.c_ubyte)) for b in self.buffers]
+		self.lengths = [0] * self.num_slots
+		self._views = [memoryview(b).cast('B') for b in self.buffers]
+
+		self._free = collections.deque(range(self.num_slots))
+		self._filled = collections.deque()
+		self.seq = 0
+
+	def commit(self, slot, length):
+		self.shared.lengths[slot] = length
+		self.shared.seqs[slot] = self.seq
+		self.seq += 1
+		BufferRing.commit(self, slot, length)
+
+	def close(self):
+		for v in self._views:
+			v.release()
+		self._views = []
+		self.pointers = []
+		self.buffers = []
+
+
+# ------------------------------------------------------------
+# Description: _reader_main
+# ------------------------------------------------------------
+# Reader process. Opens the bridge, calls on_start(session) (e.g.
+# to ask the embedded system to start sending), then streams
+# BULK2 IN into the shared slots and queues each filled slot
+# number for the workers. Slots coming back from the workers
+# are released between event handling passes.
+# ------------------------------------------------------------
+def _reader_main(name, slot_size, num_slots, work_q, free_q, status_q, stop,
+					num_workers, session_kwargs, stream_kwargs, on_start):
+	shared = SharedRing(slot_size, num_slots, name=name)
+	ring = SharedBufferRing(shared)
+	stats = {'buffers': 0, 'bytes': 0, 'transfers': 0, 'timeouts': 0, 'error': 0,
+				'max_outstanding': 0}
+	try:
+		_read(ring, work_q, free_q, status_q, stop, stats, session_kwargs, stream_kwargs,
+				on_start)
+	except RuntimeError as e:
+		status_q.put(('ready', str(e)))
+	finally:
+		for i in range(num_workers):
+			work_q.put(None)
+		status_q.put(('reader', stats))
+		# the stream's C callback and ctypes.cast() both leave reference
+		# cycles - collect them so nothing still exports the block
+		ring.close()
+		gc.collect()
+		shared.close()
+
+def _read(ring, work_q, free_q, status_q, stop, stats, session_kwargs, stream_kwargs,
+			on_start):
+	# imported here so the backend is chosen in this process
+	from bridge_session import BridgeSession
+
+	outstanding = 0
+	with BridgeSession(**session_kwargs) as session:
+		if on_start is not None:
+			on_start(session)
+		stream = session.stream(ring=ring, **stream_kwargs)
+		service = stream.after_poll
+
+		def drain():
+			nonlocal outstanding
+			if service is not None:
+				service()
+			while True:
+				try:
+					slot = free_q.get_nowait()
+				except queue.Empty:
+					break
+				outstanding -= 1
+				stream.release(slot)
+			if stop.is_set() and stream.running:
+				stream.stop()
+
+		stream.after_poll = drain
+		r = stream.start()
+		status_q.put(('ready', r))
+		if r < 0:
+			return
+
+		for slot, data in stream:
+			stats['buffers'] += 1
+			stats['bytes'] += len(data)
+			outstanding += 1
+			stats['max_outstanding'] = max(stats['max_outstanding'], outstanding)
+			work_q.put(slot)
+			drain()
+
+		stats['transfers'] = stream.transfers_completed
+		stats['timeouts'] = stream.timeouts
+		stats['error'] = stream.error
+
+
+# ------------------------------------------------------------
+# Description: _worker_main
+# ------------------------------------------------------------
+# Worker process. Runs func(data) over every slot it is handed,
+# returns the slot and queues (seq, result) for results that are
+# not None.
+# ------------------------------------------------------------
+def _worker_main(index, name, slot_size, num_slots, work_q, free_q, result_q, status_q,
+					func):
+	shared = SharedRing(slot_size, num_slots, name=name)
+	stats = {'buffers': 0, 'bytes': 0, 'busy_s': 0.0}
+	try:
+		while True:
+			slot = work_q.get()
+			if slot is None:
+				break
+			seq = shared.seqs[slot]
+			data = shared.view(slot)
+			start = time.perf_counter()
+			try:
+				result = func(data)
+			finally:
+				stats['busy_s'] += time.perf_counter() - start
+				stats['buffers'] += 1
+				stats['bytes'] += len(data)
+				data.release()
+				free_q.put(slot)
+			if result is not None:
+				result_q.put((seq, result))
+	finally:
+		status_q.put(('worker', index, stats))
+		shared.close()
+
+
+# ------------------------------------------------------------
+# Description: BridgePipeline
+# ------------------------------------------------------------
+# Reader process plus 'workers' processing processes:
+#
+#   def checksum(data):                 # runs in a worker
+#       return zlib.crc32(data)
+#
+#   if __name__ == '__main__':
+#       with BridgePipeline(checksum, workers=4) as pipe:
+#           for seq, crc in pipe.results(timeout=1.0):
+#               ...
+#
+# 'func' gets a memoryview of a filled slot. The view is only
+# valid until func returns - copy anything that must be kept and
+# do not leave a NumPy array or other export of it alive. Its
+# return value, unless None, comes back from results() tagged
+# with the buffer sequence number; results from different
+# workers arrive out of order.
+#
+# Processes are started with the 'spawn' method, so func and
+# on_start(session) must be module level functions, and the
+# calling script needs the usual __main__ guard.
+# 'session_kwargs' and 'stream_kwargs' are passed to
+# BridgeSession() and BridgeSession.stream() in the reader.
+#
+# start() returns the reader's libusb code (or -1 if it could not
+# open the bridge). stats() has the reader and worker counts
+# once stop() has returned.
+# ------------------------------------------------------------
+class BridgePipeline:
+
+	def __init__(self, func, workers=MP_WORKERS, slot_size=MP_SLOT_SIZE,
+					num_slots=MP_NUM_SLOTS, session_kwargs=None, stream_kwargs=None,
+					on_start=None):
+		self.func = func
+		self.workers = workers
+		self.slot_size = slot_size
+		self.num_slots = num_slots
+		self.session_kwargs = session_kwargs or {}
+		self.stream_kwargs = dict(stream_kwargs or {})
+		self.stream_kwargs.setdefault('transfer_size', slot_size)
+		self.stream_kwargs.setdefault('num_transfers', max(1, num_slots // 4))
+		self.on_start = on_start
+		self.running = False
+		self.error = None
+
+		self.shared = None
+		self._mp = multiprocessing.get_context(MP_CONTEXT)
+		self._reader = None
+		self._workers = []
+		self._stats = {}
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'pipeline start failure: {r} - {self.error}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def start(self):
+		if self.running:
+			return 0
+		mp = self._mp
+		self.shared = SharedRing(self.slot_size, self.num_slots)
+		self._work_q = mp.Queue()
+		self._free_q = mp.Queue()
+		self._result_q = mp.Queue()
+		self._status_q = mp.Queue()
+		self._stop = mp.Event()
+		self._stats = {}
+
+		args = (self.shared.name, self.slot_size, self.num_slots)
+		for i in range(self.workers):
+			p = mp.Process(target=_worker_main, name=f'bridge-worker-{i}', daemon=True,
+							args=(i,) + args + (self._work_q, self._free_q, self._result_q,
+												self._status_q, self.func))
+			p.start()
+			self._workers.append(p)
+		self._reader = mp.Process(target=_reader_main, name='bridge-reader', daemon=True,
+									args=args + (self._work_q, self._free_q, self._status_q,
+												self._stop, self.workers, self.session_kwargs,
+												self.stream_kwargs, self.on_start))
+		self._reader.start()
+		self.running = True
+
+		r = self._wait_ready()
+		if r < 0:
+			self.stop()
+		return r
+
+	def _wait_ready(self):
+		end = time.monotonic() + MP_START_TIMEOUT
+		while True:
+			try:
+				msg = self._status_q.get(timeout=max(0.0, end - time.monotonic()))
+			except queue.Empty:
+				self.error = 'reader did not start'
+				return -1
+			if msg[0] != 'ready':
+				self._collect(msg)
+				continue
+			if isinstance(msg[1], str):
+				self.error = msg[1]
+				return -1
+			if msg[1] < 0:
+				self.error = f'stream start returned {msg[1]}'
+			return msg[1]
+
+	# --------------------------------------
+	# stop the reader, let the workers finish
+	# what was queued and free the block
+	# --------------------------------------
+	def stop(self):
+		if not self.running:
+			return
+		self._stop.set()
+		procs = [self._reader] + self._workers
+		end = time.monotonic() + MP_JOIN_TIMEOUT * len(procs)
+		while any(p.is_alive() for p in procs) and time.monotonic() < end:
+			self._poll_status(0.05)
+		for p in procs:
+			if p.is_alive():
+				p.terminate()
+			p.join()
+		self._poll_status(0)
+
+		self._reader = None
+		self._workers = []
+		self.shared.close()
+		self.shared.unlink()
+		self.shared = None
+		self.running = False
+
+	def _poll_status(self, timeout):
+		try:
+			while True:
+				self._collect(self._status_q.get(timeout=timeout))
+		except queue.Empty:
+			pass
+
+	def _collect(self, msg):
+		if msg[0] == 'reader':
+			self._stats['reader'] = msg[1]
+		elif msg[0] == 'worker':
+			self._stats.setdefault('workers', {})[msg[1]] = msg[2]
+
+	# --------------------------------------
+	# (seq, result) pairs from the workers
+	# --------------------------------------
+	def get(self, timeout=None):
+		try:
+			return self._result_q.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+	def results(self, timeout=None):
+		while True:
+			item = self.get(timeout)
+			if item is None:
+				return
+			yield item
+
+	def stats(self):
+		return dict(self._stats)
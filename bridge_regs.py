@@ -0,0 +1,237 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Interface 0 register access
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Interface 0 carries commands to the bridge's own register space
+# and is never forwarded to the embedded system. Reading a
+# register costs a USB round trip, which is too slow for code
+# that checks the bridge configuration on every pass.
+#
+# RegisterBank keeps a shadow copy of every register it has read
+# or written. Reads are served from the shadow unless the
+# register is volatile or the caller asks for the bus. Misses are
+# fetched in batches: up to 15 reads or 12 writes share one 64
+# byte request packet. All request packets of a batch go out in
+# a single interrupt transfer and all responses come back in
+# another, so a batch costs one round trip whatever its size.
+#
+# The command format is an assumption (see bridge_defs) since the
+# bridge register protocol is not published. bridge_sim
+# implements the same format.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import ctypes as ct
+import struct
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_INT0_OUT, ENDPOINT_INT0_IN, INT0_INTERFACE,
+							USB_PACKET_SIZE, REG_CMD_READ, REG_CMD_WRITE, REG_HEADER,
+							REG_VALUE_SIZE, REG_READS_PER_PACKET, REG_WRITES_PER_PACKET,
+							REG_OK, REG_STATUS)
+
+
+#
+# Definitions
+#
+REG_TIMEOUT = 250				# mS per batch transfer
+REG_VOLATILE = (REG_STATUS,)	# never served from the shadow
+REG_WRITE_ENTRY = struct.Struct('<BI')
+REG_VALUE = struct.Struct('<I')
+
+
+# ------------------------------------------------------------
+# Description: RegisterBank
+# ------------------------------------------------------------
+# Register access on interface 0 of an open bridge handle:
+#
+#   with RegisterBank(session.dev_handle) as regs:
+#       regs.read_many(range(0x03, 0x10))     # one round trip
+#       if regs.read(0x05) & 1:                # from the shadow
+#           ...
+#       regs.write_many({0x03: 1, 0x04: 0x200})
+#
+# Reads of registers listed in 'volatile' always go to the bus.
+# Writes are written through and update the shadow once the
+# bridge accepts them. stage() collects writes that commit()
+# sends as one batch. invalidate() drops shadow entries so the
+# next read fetches them again, e.g. after the bridge was reset.
+#
+# Transfer failures and rejected commands raise RuntimeError.
+# 'metrics' (a bridge_metrics.BridgeMetrics) records each batch
+# transfer.
+# ------------------------------------------------------------
+class RegisterBank:
+
+	def __init__(self, dev_handle, volatile=REG_VOLATILE, timeout=REG_TIMEOUT,
+					interface=INT0_INTERFACE, metrics=None):
+		self.dev_handle = dev_handle
+		self.volatile = frozenset(volatile)
+		self.timeout = timeout
+		self.interface = interface
+		self.metrics = metrics
+		self.claimed = False
+
+		self.shadow = {}				# address -> last known value
+		self._staged = {}
+		self._tag = 0
+		self._transferred = ct.c_int(0)
+		self._transfer = usb.interrupt_transfer if metrics is None else metrics.interrupt_transfer
+
+		# statistics
+		self.hits = 0
+		self.misses = 0
+		self.round_trips = 0
+
+	def __enter__(self):
+		self.open()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	def open(self):
+		r = usb.claim_interface(self.dev_handle, self.interface)
+		if r < 0:
+			raise RuntimeError(f'usb claim failure: {r} - {usb.strerror(r)}')
+		self.claimed = True
+
+	def close(self):
+		if self.claimed:
+			usb.release_interface(self.dev_handle, self.interface)
+			self.claimed = False
+
+	# --------------------------------------
+	# shadow only - never touches the bus
+	# --------------------------------------
+	def cached(self, addr, default=None):
+		return self.shadow.get(addr, default)
+
+	def invalidate(self, addrs=None):
+		if addrs is None:
+			self.shadow.clear()
+		else:
+			for addr in addrs:
+				self.shadow.pop(addr, None)
+
+	# --------------------------------------
+	# reads
+	# --------------------------------------
+	def read(self, addr, bus=False):
+		if not bus and addr not in self.volatile:
+			value = self.shadow.get(addr)
+			if value is not None:
+				self.hits += 1
+				return value
+		return self.read_many((addr,), bus=True)[addr]
+
+	def read_many(self, addrs, bus=False):
+		addrs = list(dict.fromkeys(addrs))
+		if bus:
+			misses = addrs
+		else:
+			misses = [a for a in addrs if a in self.volatile or a not in self.shadow]
+			self.hits += len(addrs) - len(misses)
+
+		if misses:
+			self.misses += len(misses)
+			packets = []
+			for i in range(0, len(misses), REG_READS_PER_PACKET):
+				chunk = misses[i:i + REG_READS_PER_PACKET]
+				packets.append((REG_CMD_READ, chunk, bytes(chunk)))
+			for chunk, resp in zip((p[1] for p in packets), self._exchange(packets)):
+				for j, addr in enumerate(chunk):
+					self.shadow[addr] = REG_VALUE.unpack_from(resp, REG_HEADER + j * REG_VALUE_SIZE)[0]
+
+		return {a: self.shadow[a] for a in addrs}
+
+	def refresh(self):
+		return self.read_many(list(self.shadow), bus=True)
+
+	# --------------------------------------
+	# writes
+	# --------------------------------------
+	def write(self, addr, value):
+		self.write_many({addr: value})
+
+	def write_many(self, values):
+		values = {a: v & 0xffffffff for a, v in dict(values).items()}
+		if not values:
+			return
+		items = list(values.items())
+		packets = []
+		for i in range(0, len(items), REG_WRITES_PER_PACKET):
+			chunk = items[i:i + REG_WRITES_PER_PACKET]
+			body = b''.join(REG_WRITE_ENTRY.pack(a, v) for a, v in chunk)
+			packets.append((REG_CMD_WRITE, chunk, body))
+		try:
+			self._exchange(packets)
+		except RuntimeError:
+			# some batches may have landed - the shadow can't be trusted for these
+			self.invalidate(values)
+			raise
+		self.shadow.update(values)
+
+	def stage(self, addr, value):
+		self._staged[addr] = value
+
+	def commit(self):
+		staged, self._staged = self._staged, {}
+		self.write_many(staged)
+
+	# --------------------------------------
+	# send a batch of command packets in one
+	# transfer and collect the responses in
+	# another - returns the responses in
+	# request order
+	# --------------------------------------
+	def _exchange(self, packets):
+		n = len(packets)
+		out = (ct.c_ubyte*(n * USB_PACKET_SIZE))()
+		tags = []
+		for i, (cmd, chunk, body) in enumerate(packets):
+			tag = self._tag
+			self._tag = (self._tag + 1) & 0xff
+			tags.append(tag)
+			base = i * USB_PACKET_SIZE
+			out[base:base + REG_HEADER] = (cmd, len(chunk), tag, 0)
+			out[base + REG_HEADER:base + REG_HEADER + len(body)] = body
+
+		self.round_trips += 1
+		r = self._transfer(self.dev_handle, ENDPOINT_INT0_OUT, out, len(out),
+							ct.byref(self._transferred), self.timeout)
+		if r < 0:
+			raise RuntimeError(f'register command failure: {r} - {usb.strerror(r)}')
+
+		rx = (ct.c_ubyte*(n * USB_PACKET_SIZE))()
+		r = self._transfer(self.dev_handle, ENDPOINT_INT0_IN, rx, len(rx),
+							ct.byref(self._transferred), self.timeout)
+		if r < 0:
+			raise RuntimeError(f'register response failure: {r} - {usb.strerror(r)}')
+		if self._transferred.value < len(rx):
+			raise RuntimeError(f'register response short: {self._transferred.value} of {len(rx)} bytes')
+
+		responses = []
+		data = bytes(rx)
+		for i, (cmd, chunk, body) in enumerate(packets):
+			resp = data[i * USB_PACKET_SIZE:(i + 1) * USB_PACKET_SIZE]
+			if resp[0] != cmd or resp[2] != tags[i]:
+				raise RuntimeError(f'register response out of sequence: tag {resp[2]} expected {tags[i]}')
+			if resp[3] != REG_OK:
+				raise RuntimeError(f'register command rejected: status {resp[3]}')
+			responses.append(resp)
+		return responses
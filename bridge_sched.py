@@ -0,0 +1,345 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Traffic class scheduler
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The bridge merges INT1 and BULK2 OUT packets into one stream of
+# 68 byte SSI frames to the embedded system. On the host side
+# whichever usb call runs first goes first, so a short command
+# issued during a multi megabyte upload waits for the whole
+# upload.
+#
+# TrafficScheduler owns all OUT traffic for a bridge handle. Data
+# is queued per traffic class and sent by one worker thread in
+# chunks of at most a few packets, so a queued command never waits
+# behind more than one chunk of another class. Each time a chunk
+# goes out the next class is picked by either:
+#  - strict priority: the lowest 'priority' value with data waiting
+#  - weighted: deficit round robin, each class getting bandwidth
+#    in proportion to its 'weight'
+# A class may also be capped to 'rate' bytes/S with a token
+# bucket of 'burst' bytes.
+#
+# The default classes are:
+#
+#   control    INT1 OUT   priority 0  weight 4  chunk 64
+#   telemetry  INT1 OUT   priority 1  weight 2  chunk 64
+#   bulk       BULK2 OUT  priority 2  weight 1  chunk 1024
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_INT1_OUT, EP2OUT_TIMEOUT,
+							INT1_INTERFACE, USB_PACKET_SIZE)
+from bridge_metrics import LatencyHistogram
+from bridge_telemetry import INT1_OUT_TIMEOUT
+
+
+#
+# Definitions
+#
+SCHED_STRICT = 'strict'
+SCHED_WEIGHTED = 'weighted'
+
+SCHED_BULK_CHUNK = USB_PACKET_SIZE*16	# bytes per BULK2 transfer (~1.6mS)
+SCHED_INT_CHUNK = USB_PACKET_SIZE		# bytes per INT1 transfer
+SCHED_IDLE_WAIT = 0.1					# S the worker sleeps with nothing queued
+
+
+# ------------------------------------------------------------
+# Description: TrafficClass
+# ------------------------------------------------------------
+# One queue of outgoing messages. 'endpoint' selects INT1 OUT
+# (interrupt transfers) or BULK2 OUT (bulk transfers). 'rate'
+# caps the class to that many bytes/S with bursts of up to
+# 'burst' bytes; None leaves it uncapped.
+#
+# Per class statistics: messages, bytes, chunks and errors, and
+# 'delay' - a LatencyHistogram of the time from submit() until
+# the last byte of each message was sent.
+# ------------------------------------------------------------
+class TrafficClass:
+
+	def __init__(self, name, endpoint, priority=0, weight=1, rate=None, burst=None,
+					chunk=None):
+		self.name = name
+		self.endpoint = endpoint
+		self.priority = priority
+		self.weight = weight
+		self.rate = rate
+		self.interrupt = endpoint == ENDPOINT_INT1_OUT
+		if weight <= 0:
+			raise ValueError(f'{name}: weight must be positive')
+
+		if chunk is None:
+			chunk = SCHED_INT_CHUNK if self.interrupt else SCHED_BULK_CHUNK
+		self.chunk = chunk
+		self.burst = burst if burst is not None else chunk
+		if self.burst < chunk:
+			raise ValueError('burst must hold at least one chunk')
+		self.timeout = INT1_OUT_TIMEOUT if self.interrupt else EP2OUT_TIMEOUT
+
+		self.queue = collections.deque()	# [view, offset, submit_ns, callback]
+		self.tokens = self.burst
+		self.stamp = time.perf_counter()
+		self.deficit = 0
+
+		# statistics
+		self.messages = 0
+		self.bytes = 0
+		self.chunks = 0
+		self.errors = 0
+		self.delay = LatencyHistogram()
+
+	# --------------------------------------
+	# token bucket - seconds until 'n' more
+	# bytes may be sent
+	# --------------------------------------
+	def wait_for(self, n, now):
+		if self.rate is None:
+			return 0.0
+		self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+		self.stamp = now
+		if self.tokens >= n:
+			return 0.0
+		return (n - self.tokens) / self.rate
+
+	def next_size(self):
+		view, offset = self.queue[0][0], self.queue[0][1]
+		return min(self.chunk, len(view) - offset)
+
+
+# ------------------------------------------------------------
+# Description: default_classes
+# ------------------------------------------------------------
+def default_classes():
+	return [
+		TrafficClass('control', ENDPOINT_INT1_OUT, priority=0, weight=4),
+		TrafficClass('telemetry', ENDPOINT_INT1_OUT, priority=1, weight=2),
+		TrafficClass('bulk', ENDPOINT_BLK2_OUT, priority=2, weight=1),
+	]
+
+
+# ------------------------------------------------------------
+# Description: TrafficScheduler
+# ------------------------------------------------------------
+# Arbitrates all OUT traffic on 'dev_handle' between traffic
+# classes:
+#
+#   with TrafficScheduler(session.dev_handle) as sched:
+#       sched.submit('bulk', image)
+#       sched.submit('control', bytes([10, 1, 2]), callback=done)
+#
+# submit() only queues and returns at once. 'callback(r, n)' is
+# called from the worker thread once the message has been sent
+# (r = 0) or has failed (r = libusb error, n = bytes sent before
+# it failed). Interface 1 is claimed on start() so INT1 classes
+# can be used, and released again on stop().
+# ------------------------------------------------------------
+class TrafficScheduler:
+
+	def __init__(self, dev_handle, classes=None, policy=SCHED_STRICT):
+		if policy not in (SCHED_STRICT, SCHED_WEIGHTED):
+			raise ValueError(f'unknown policy {policy}')
+
+		self.dev_handle = dev_handle
+		self.classes = {c.name: c for c in (classes or default_classes())}
+		self.policy = policy
+		self.running = False
+		self.claimed = False
+
+		self._order = sorted(self.classes.values(), key=lambda c: c.priority)
+		self._rr = 0					# weighted - class being visited
+		self._credited = False			# weighted - visit credit given
+		self._cond = threading.Condition()
+		self._thread = None
+		self._busy = False
+		self._transferred = ct.c_int(0)
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'scheduler start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def start(self):
+		if self.running:
+			return 0
+		if any(c.interrupt for c in self._order):
+			r = usb.claim_interface(self.dev_handle, INT1_INTERFACE)
+			if r < 0:
+				return r
+			self.claimed = True
+		self.running = True
+		self._thread = threading.Thread(target=self._run, name='bridge-sched', daemon=True)
+		self._thread.start()
+		return 0
+
+	# --------------------------------------
+	# stop the worker, sending what is queued
+	# first unless 'drain' is False
+	# --------------------------------------
+	def stop(self, drain=True):
+		if drain:
+			self.flush()
+		with self._cond:
+			self.running = False
+			self._cond.notify_all()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		if self.claimed:
+			usb.release_interface(self.dev_handle, INT1_INTERFACE)
+			self.claimed = False
+
+	# --------------------------------------
+	# queue a message on a traffic class
+	# --------------------------------------
+	def submit(self, name, data, callback=None):
+		cls = self.classes[name]
+		view = memoryview(data).cast('B')
+		if not len(view):
+			raise ValueError('empty message')
+		with self._cond:
+			cls.queue.append([view, 0, time.perf_counter_ns(), callback])
+			self._cond.notify()
+
+	def pending(self):
+		with self._cond:
+			return sum(len(c.queue) for c in self._order) + self._busy
+
+	# --------------------------------------
+	# wait for every queue to empty
+	# --------------------------------------
+	def flush(self, timeout=None):
+		end = time.perf_counter() + timeout if timeout is not None else None
+		with self._cond:
+			while self.running and (self._busy or any(c.queue for c in self._order)):
+				wait = None if end is None else end - time.perf_counter()
+				if wait is not None and wait <= 0:
+					return False
+				self._cond.wait(wait)
+		return True
+
+	def stats(self):
+		out = {}
+		for c in self._order:
+			out[c.name] = {
+				'queued': len(c.queue),
+				'messages': c.messages,
+				'bytes': c.bytes,
+				'chunks': c.chunks,
+				'errors': c.errors,
+				'delay_p50_us': c.delay.percentile(50) / 1000,
+				'delay_p99_us': c.delay.percentile(99) / 1000,
+				'delay_max_us': c.delay.max / 1000,
+			}
+		return out
+
+	# --------------------------------------
+	# pick the class to send next - returns
+	# (class, 0) or (None, seconds to wait)
+	# --------------------------------------
+	def _pick(self, now):
+		wait = None
+		if self.policy == SCHED_STRICT:
+			for c in self._order:
+				if not c.queue:
+					continue
+				w = c.wait_for(c.next_size(), now)
+				if w == 0.0:
+					return c, 0.0
+				wait = w if wait is None else min(wait, w)
+			return None, wait
+
+		# deficit round robin - each visit gives a class
+		# weight * chunk bytes of credit to send while it lasts
+		n = len(self._order)
+		for k in range(2 * n):
+			c = self._order[self._rr]
+			if c.queue:
+				size = c.next_size()
+				if not self._credited:
+					quantum = c.weight * c.chunk
+					c.deficit = min(c.deficit + quantum, quantum + c.chunk)
+					self._credited = True
+				if c.deficit >= size:
+					w = c.wait_for(size, now)
+					if w == 0.0:
+						return c, 0.0
+					wait = w if wait is None else min(wait, w)
+			else:
+				c.deficit = 0
+			self._rr = (self._rr + 1) % n
+			self._credited = False
+		return None, wait
+
+	def _run(self):
+		while True:
+			with self._cond:
+				while True:
+					if not self.running:
+						return
+					cls, wait = self._pick(time.perf_counter())
+					if cls is not None:
+						break
+					self._cond.wait(SCHED_IDLE_WAIT if wait is None else wait)
+				entry = cls.queue[0]
+				self._busy = True
+
+			self._send(cls, entry)
+
+			with self._cond:
+				self._busy = False
+				self._cond.notify_all()
+
+	# --------------------------------------
+	# send one chunk of the message at the
+	# head of 'cls' - worker thread only
+	# --------------------------------------
+	def _send(self, cls, entry):
+		view, offset, submitted, callback = entry
+		n = min(cls.chunk, len(view) - offset)
+		buf = (ct.c_ubyte*n).from_buffer_copy(view[offset:offset + n])
+		transfer = usb.interrupt_transfer if cls.interrupt else usb.bulk_transfer
+		r = transfer(self.dev_handle, cls.endpoint, buf, n, ct.byref(self._transferred),
+						cls.timeout)
+
+		sent = self._transferred.value
+		cls.tokens -= sent
+		cls.deficit -= sent
+		cls.chunks += 1
+		cls.bytes += sent
+		entry[1] = offset = offset + sent
+
+		done = r < 0 or offset >= len(view)
+		if r < 0:
+			cls.errors += 1
+		if done:
+			with self._cond:
+				cls.queue.popleft()
+			cls.messages += 1
+			cls.delay.record(time.perf_counter_ns() - submitted)
+			if callback is not None:
+				callback(min(r, 0), offset)
@@ -0,0 +1,564 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Bridge session
+#
+# Project Description:
+# ----------------------------------------------------------------
+# find_bridge() in the tutorials initializes libusb, walks every
+# device on the host reading descriptors, opens the first bridge
+# it finds and then leaves the device list and libusb context
+# alive. Each test case claims interface 2 again.
+#
+# BridgeSession owns the whole connection instead. It creates its
+# own libusb context, remembers the bus/port path of the bridge it
+# opened so a reconnect only has to look at one device, claims the
+# BULK2 interface once and releases everything when it is closed.
+#
+# With hotplug enabled the session also follows the bridge being
+# unplugged and plugged back in. libusb reports both events, the
+# session reopens the bridge, claims the interface again and
+# restarts any streams that were running.
+#
+# Rigs with several bridges on one host use find_bridges() to
+# list every matching bridge and BridgeGroup to stream from all
+# of them at once from a single event handling thread.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import DEF_VID, DEF_PID, BULK2_INTERFACE
+from bridge_stream import BulkStream
+
+
+#
+# Definitions
+#
+MAX_PORT_DEPTH = 7				# USB 3.0 spec limit on hub tiers
+HOTPLUG_RETRY = 0.25			# S between reopen attempts
+SESSION_POLL_TIMEOUT = 100		# mS per event handling pass
+SERIAL_MAX_LEN = 128
+
+# (vid, pid, serial) -> (bus, port numbers) of the last bridge opened
+_path_cache = {}
+
+
+# ------------------------------------------------------------
+# Description: device_path
+# ------------------------------------------------------------
+# Returns the (bus, (port, port, ...)) location of a libusb
+# device. The path is stable for as long as the bridge stays
+# plugged into the same physical port.
+# ------------------------------------------------------------
+def device_path(dev):
+	ports = (ct.c_uint8*MAX_PORT_DEPTH)()
+	n = usb.get_port_numbers(dev, ports, MAX_PORT_DEPTH)
+	if n < 0:
+		n = 0
+	return (usb.get_bus_number(dev), tuple(ports[:n]))
+
+
+# ------------------------------------------------------------
+# Description: device_serial
+# ------------------------------------------------------------
+# Reads the serial number string of a libusb device. The device
+# is opened briefly to do so; None is returned if it cannot be
+# opened or has no serial number.
+# ------------------------------------------------------------
+def device_serial(dev):
+	desc = usb.device_descriptor()
+	r = usb.get_device_descriptor(dev, ct.byref(desc))
+	if r < 0 or desc.iSerialNumber == 0:
+		return None
+
+	dev_handle = ct.POINTER(usb.device_handle)()
+	r = usb.open(dev, ct.byref(dev_handle))
+	if r < 0:
+		return None
+	buf = (ct.c_ubyte*SERIAL_MAX_LEN)()
+	n = usb.get_string_descriptor_ascii(dev_handle, desc.iSerialNumber, buf, SERIAL_MAX_LEN)
+	usb.close(dev_handle)
+	if n < 0:
+		return None
+	return bytes(buf[:n]).decode('ascii', 'replace')
+
+
+# ------------------------------------------------------------
+# Description: find_bridges
+# ------------------------------------------------------------
+# Lists every attached device matching VID/PID as a list of
+# (path, serial) tuples, in bus/port order. Either value can be
+# given to BridgeSession to open that particular bridge.
+# ------------------------------------------------------------
+def find_bridges(ctx=None, vid=DEF_VID, pid=DEF_PID):
+	devs = ct.POINTER(ct.POINTER(usb.device))()
+	cnt = usb.get_device_list(ctx, ct.byref(devs))
+	if cnt < 0:
+		raise RuntimeError(f'get device list failure: {cnt} - {usb.strerror(cnt)}')
+
+	bridges = []
+	try:
+		for i in range(cnt):
+			dev = devs[i]
+			desc = usb.device_descriptor()
+			r = usb.get_device_descriptor(dev, ct.byref(desc))
+			if r < 0:
+				continue
+			if(desc.idVendor == vid) and (desc.idProduct == pid):
+				bridges.append((device_path(dev), device_serial(dev)))
+	finally:
+		usb.free_device_list(devs, 1)
+
+	bridges.sort()
+	return bridges
+
+
+# ------------------------------------------------------------
+# Description: BridgeSession
+# ------------------------------------------------------------
+# Context manager owning a libusb context and an open bridge
+# handle with the BULK2 interface claimed.
+#
+#   with BridgeSession() as bridge:
+#       usb.bulk_transfer(bridge.dev_handle, ...)
+#
+# open() first tries the bus/port path cached by an earlier
+# session for the same VID/PID and only falls back to a full
+# descriptor scan when the bridge is no longer there.
+#
+# With several bridges attached, 'serial' or 'port_path' selects
+# which one to open. A session given an existing libusb 'ctx'
+# shares it and leaves it alive on close().
+#
+# Streams made by stream() are stopped on close();
+# remove_stream() stops one and detaches it earlier.
+#
+# enable_hotplug() registers libusb hotplug callbacks for the
+# session VID/PID. The callbacks only record the event since
+# libusb is in the middle of event handling when it calls them;
+# the reconnect itself happens in handle_events() (or in the
+# poll of any stream created through stream()). Where libusb
+# has no hotplug support (Windows) a lost device is noticed
+# through failed transfers and the bridge is reopened every
+# HOTPLUG_RETRY seconds instead.
+# ------------------------------------------------------------
+class BridgeSession:
+
+	def __init__(self, vid=DEF_VID, pid=DEF_PID, interface=BULK2_INTERFACE,
+					serial=None, port_path=None, ctx=None):
+		self.vid = vid
+		self.pid = pid
+		self.interface = interface
+		self.serial = serial
+		self.port_path = port_path
+
+		self.ctx = ctx
+		self._own_ctx = ctx is None
+		self.dev_handle = None
+		self.path = None
+		self.claimed = False
+
+		self.hotplug = False
+		self.on_change = None			# on_change(connected) callback
+		self._hotplug_handle = None
+		self._hotplug_cb = usb.hotplug_callback_fn(self._on_hotplug)
+		self._events = collections.deque()
+		self._streams = []
+		self._pending_attach = False
+		self._retry_at = 0.0
+		self._servicing = False
+
+	def __enter__(self):
+		self.open()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	# --------------------------------------
+	# init libusb, find/open the bridge and
+	# claim the interface
+	# --------------------------------------
+	def open(self):
+		created = False
+		if self.ctx is None:
+			ctx = ct.POINTER(usb.context)()
+			r = usb.init(ct.byref(ctx))
+			if r < 0:
+				raise RuntimeError(f'usb init failure: {r} - {usb.strerror(r)}')
+			self.ctx = ctx
+			created = True
+
+		try:
+			self._connect()
+		except Exception:
+			self.disconnect()
+			if created:
+				usb.exit(self.ctx)
+				self.ctx = None
+			raise
+
+	# --------------------------------------
+	# drop the handle but keep the context so
+	# the next open() can reuse it
+	# --------------------------------------
+	def disconnect(self):
+		if self.dev_handle is not None:
+			if self.claimed:
+				usb.release_interface(self.dev_handle, self.interface)
+				self.claimed = False
+			usb.close(self.dev_handle)
+			self.dev_handle = None
+
+	def reconnect(self):
+		self.disconnect()
+		self.open()
+
+	def close(self):
+		for stream in self._streams:
+			stream.stop()
+		self._streams = []
+		self.disconnect()
+		if self.ctx is not None:
+			if self._hotplug_handle is not None:
+				usb.hotplug_deregister_callback(self.ctx, self._hotplug_handle)
+				self._hotplug_handle = None
+			if self._own_ctx:
+				usb.exit(self.ctx)
+				self.ctx = None
+		self.hotplug = False
+
+	# --------------------------------------
+	# BULK2 IN stream bound to this session
+	# --------------------------------------
+	def stream(self, **kwargs):
+		stream = BulkStream(self.dev_handle, ctx=self.ctx, **kwargs)
+		stream.after_poll = self._service
+		stream.resumable = self.hotplug
+		self._streams.append(stream)
+		return stream
+
+	def remove_stream(self, stream):
+		# stop a stream from stream() and forget it
+		stream.stop()
+		if stream in self._streams:
+			self._streams.remove(stream)
+
+	# --------------------------------------
+	# follow unplug/replug of the bridge
+	# --------------------------------------
+	def enable_hotplug(self, on_change=None):
+		self.on_change = on_change
+		if self.hotplug:
+			return 0
+
+		if usb.has_capability(usb.LIBUSB_CAP_HAS_HOTPLUG):
+			handle = usb.hotplug_callback_handle()
+			r = usb.hotplug_register_callback(self.ctx,
+						usb.LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED | usb.LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT,
+						usb.LIBUSB_HOTPLUG_NO_FLAGS, self.vid, self.pid,
+						usb.LIBUSB_HOTPLUG_MATCH_ANY, self._hotplug_cb, None,
+						ct.byref(handle))
+			if r < 0:
+				return r
+			self._hotplug_handle = handle
+
+		self.hotplug = True
+		for stream in self._streams:
+			stream.resumable = True
+		return 0
+
+	# --------------------------------------
+	# run libusb events for the session and
+	# act on any hotplug events seen
+	# --------------------------------------
+	def handle_events(self, timeout_ms=SESSION_POLL_TIMEOUT):
+		tv = usb.timeval(timeout_ms // 1000, (timeout_ms % 1000) * 1000)
+		r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+		self._service()
+		return r
+
+	def _on_hotplug(self, ctx, dev, event, user_data):
+		# called from inside libusb event handling - record only
+		self._events.append((event, device_path(dev)))
+		return 0
+
+	def _service(self):
+		if not self.hotplug or self._servicing:
+			return
+		self._servicing = True
+		try:
+			left = False
+			if self.dev_handle is not None:
+				for stream in self._streams:
+					if stream.suspended:
+						left = True
+
+			while self._events:
+				event, path = self._events.popleft()
+				if event == usb.LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT:
+					if path == self.path:
+						left = True
+				elif self.port_path is None:
+					# reopen wherever the bridge showed up
+					_path_cache[self._key()] = path
+					self._pending_attach = True
+					self._retry_at = 0.0
+				elif path == self.port_path:
+					self._pending_attach = True
+					self._retry_at = 0.0
+
+			if left:
+				self._detach()
+
+			if self.dev_handle is None:
+				if self._hotplug_handle is None:
+					self._pending_attach = True
+				if self._pending_attach and time.monotonic() >= self._retry_at:
+					self._attach()
+		finally:
+			self._servicing = False
+
+	def _detach(self):
+		for stream in self._streams:
+			stream.suspend()
+		self.disconnect()
+		if self.on_change is not None:
+			self.on_change(False)
+
+	def _attach(self):
+		try:
+			self.open()
+		except RuntimeError:
+			# not ready yet (still enumerating, busy) - try again shortly
+			self._retry_at = time.monotonic() + HOTPLUG_RETRY
+			return
+
+		self._pending_attach = False
+		for stream in self._streams:
+			if stream.suspended:
+				stream.resume(self.dev_handle)
+		if self.on_change is not None:
+			self.on_change(True)
+
+	def _connect(self):
+		devs = ct.POINTER(ct.POINTER(usb.device))()
+		cnt = usb.get_device_list(self.ctx, ct.byref(devs))
+		if cnt < 0:
+			raise RuntimeError(f'get device list failure: {cnt} - {usb.strerror(cnt)}')
+
+		try:
+			dev = None
+			if self.port_path is not None:
+				dev = self._find_by_path(devs, cnt, self.port_path)
+			else:
+				cached = _path_cache.get(self._key())
+				if cached is not None:
+					dev = self._find_by_path(devs, cnt, cached)
+				if dev is None:
+					dev = self._find_by_id(devs, cnt)
+			if dev is None:
+				raise RuntimeError(f'bridge {self.vid:04x}:{self.pid:04x} not found')
+
+			dev_handle = ct.POINTER(usb.device_handle)()
+			r = usb.open(dev, ct.byref(dev_handle))
+			if r < 0:
+				raise RuntimeError(f'failed to open device: {r} - {usb.strerror(r)}')
+			self.dev_handle = dev_handle
+			self.path = device_path(dev)
+			if self.port_path is None:
+				_path_cache[self._key()] = self.path
+		finally:
+			# the open handle keeps its own reference to the device
+			usb.free_device_list(devs, 1)
+
+		r = usb.claim_interface(self.dev_handle, self.interface)
+		if r != 0:
+			raise RuntimeError(f'failed to claim interface: {r} - {usb.strerror(r)}')
+		self.claimed = True
+
+	def _matches(self, dev):
+		desc = usb.device_descriptor()
+		r = usb.get_device_descriptor(dev, ct.byref(desc))
+		if r < 0:
+			return False
+		if(desc.idVendor != self.vid) or (desc.idProduct != self.pid):
+			return False
+		if self.serial is not None:
+			return device_serial(dev) == self.serial
+		return True
+
+	def _key(self):
+		return (self.vid, self.pid, self.serial)
+
+	def _find_by_path(self, devs, cnt, path):
+		bus, ports = path
+		for i in range(cnt):
+			dev = devs[i]
+			if usb.get_bus_number(dev) != bus:
+				continue
+			if device_path(dev) == path and self._matches(dev):
+				return dev
+		return None
+
+	def _find_by_id(self, devs, cnt):
+		for i in range(cnt):
+			if self._matches(devs[i]):
+				return devs[i]
+		return None
+
+
+# ------------------------------------------------------------
+# Description: BridgeGroup
+# ------------------------------------------------------------
+# Opens every bridge matching VID/PID and runs a BULK2 IN stream
+# on each of them concurrently. All bridges share one libusb
+# context and a single event thread handles completions for all
+# of them; the transfers themselves run in parallel on the bus,
+# so aggregate throughput scales with the number of bridges.
+#
+# 'callback(session, data)' receives each completed buffer with
+# the session it came from (see BulkStream for the lifetime of
+# 'data'). Without a callback the data is only counted. stats()
+# reports per bridge and total counters and rates.
+# ------------------------------------------------------------
+class BridgeGroup:
+
+	def __init__(self, vid=DEF_VID, pid=DEF_PID, callback=None, **stream_kwargs):
+		self.vid = vid
+		self.pid = pid
+		self.callback = callback
+		self.stream_kwargs = stream_kwargs
+
+		self.ctx = None
+		self.sessions = []
+		self.streams = []
+
+		self._thread = None
+		self._running = False
+		self._start_time = 0.0
+
+	def __enter__(self):
+		self.open()
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	# --------------------------------------
+	# open a session on every matching bridge
+	# --------------------------------------
+	def open(self):
+		ctx = ct.POINTER(usb.context)()
+		r = usb.init(ct.byref(ctx))
+		if r < 0:
+			raise RuntimeError(f'usb init failure: {r} - {usb.strerror(r)}')
+		self.ctx = ctx
+
+		try:
+			for path, serial in find_bridges(self.ctx, self.vid, self.pid):
+				session = BridgeSession(self.vid, self.pid, serial=serial,
+										port_path=path, ctx=self.ctx)
+				session.open()
+				self.sessions.append(session)
+		except Exception:
+			self.close()
+			raise
+
+		return len(self.sessions)
+
+	def close(self):
+		self.stop()
+		for session in self.sessions:
+			session.close()
+		self.sessions = []
+		if self.ctx is not None:
+			usb.exit(self.ctx)
+			self.ctx = None
+
+	# --------------------------------------
+	# start a stream per bridge and the
+	# shared event thread
+	# --------------------------------------
+	def start(self):
+		if self._running:
+			return 0
+
+		self.streams = []
+		for session in self.sessions:
+			stream = session.stream(callback=self._deliver(session), **self.stream_kwargs)
+			self.streams.append(stream)
+			r = stream.start()
+			if r < 0:
+				self.stop()
+				return r
+
+		self._running = True
+		self._start_time = time.perf_counter()
+		self._thread = threading.Thread(target=self._event_loop, name='bridge-events',
+										daemon=True)
+		self._thread.start()
+		return 0
+
+	def stop(self):
+		if self._thread is not None:
+			self._running = False
+			self._thread.join()
+			self._thread = None
+		for stream in self.streams:
+			stream.stop()
+
+	# --------------------------------------
+	# per bridge and aggregate statistics
+	# --------------------------------------
+	def stats(self):
+		elapsed = time.perf_counter() - self._start_time if self._start_time else 0.0
+		devices = []
+		total = 0
+		for session, stream in zip(self.sessions, self.streams):
+			total += stream.bytes_received
+			devices.append({
+				'path': session.path,
+				'serial': session.serial,
+				'bytes': stream.bytes_received,
+				'transfers': stream.transfers_completed,
+				'timeouts': stream.timeouts,
+				'error': stream.error,
+				'kB/s': round(stream.bytes_received / elapsed / 1000, 2) if elapsed else 0.0,
+			})
+		return {
+			'elapsed': elapsed,
+			'bytes': total,
+			'kB/s': round(total / elapsed / 1000, 2) if elapsed else 0.0,
+			'devices': devices,
+		}
+
+	def _deliver(self, session):
+		callback = self.callback
+		if callback is None:
+			return lambda data: None
+		return lambda data: callback(session, data)
+
+	def _event_loop(self):
+		tv = usb.timeval(0, SESSION_POLL_TIMEOUT * 1000)
+		while self._running:
+			usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+			for session in self.sessions:
+				session._service()
@@ -0,0 +1,1075 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Simulated bridge backend
+#
+# Project Description:
+# ----------------------------------------------------------------
+# In-process stand-in for the subset of the libusb module used by
+# the tutorials and the bridge_* modules. It models one or more
+# USB2F-SSI bridges with the embedded emulator attached, so host
+# side code can be exercised and benchmarked without hardware:
+#
+#  - interfaces 0/1/2 with their OUT/IN endpoints
+#  - 64 byte USB packets
+#  - BULK2 (~650kB/s) and INT1 (64kB/s, one packet per mS)
+#    bandwidth limits
+#  - configurable emulator latency and jitter
+#  - transfer timeouts, cancellation and unplug/replug
+#  - the emulator opcodes: 10d echo and 12d 8k burst, plus the
+#    assumed 13d throttle and 14d batch packets (see bridge_defs)
+#  - optionally a bounded bridge FIFO that drops (and counts)
+#    emulator data arriving while it is full
+#  - the interface 0 register space, using the command format
+#    assumed in bridge_defs
+#
+# Select it for every module (tutorials included) by setting
+# BRIDGE_BACKEND=sim in the environment, see bridge_backend.
+#
+# Transfers are completed from inside the event handling calls
+# (handle_events*, bulk_transfer, interrupt_transfer) just like
+# libusb, so the same threading rules apply.
+#
+# 8k burst payload produced by the emulator model - 128 packets:
+#
+#   byte[0]      opcode (12d)
+#   byte[1..2]   packet sequence number, little endian, counting
+#                up across bursts
+#   byte[3..63]  (sequence + i) & 0xff for i = 0..60
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import random
+import struct
+import threading
+import time
+
+from bridge_defs import (DEF_VID, DEF_PID, ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN,
+							ENDPOINT_INT0_OUT, ENDPOINT_INT0_IN,
+							ENDPOINT_INT1_OUT, ENDPOINT_INT1_IN, USB_PACKET_SIZE,
+							OPCODE_ECHO, OPCODE_BURST_8K, OPCODE_THROTTLE, OPCODE_BATCH,
+							BATCH_HEADER, BURST_8K_SIZE,
+							THROTTLE_STATE_OFFSET, THROTTLE_PAUSE,
+							REG_CMD_READ, REG_CMD_WRITE, REG_HEADER, REG_VALUE_SIZE,
+							REG_READS_PER_PACKET, REG_WRITES_PER_PACKET, REG_OK,
+							REG_ERR_ADDRESS, REG_ERR_READ_ONLY, REG_ERR_COMMAND,
+							REG_COUNT, REG_ID, REG_VERSION, REG_STATUS)
+
+
+#
+# libusb constants (same values as libusb.h)
+#
+LIBUSB_SUCCESS = 0
+LIBUSB_ERROR_IO = -1
+LIBUSB_ERROR_INVALID_PARAM = -2
+LIBUSB_ERROR_ACCESS = -3
+LIBUSB_ERROR_NO_DEVICE = -4
+LIBUSB_ERROR_NOT_FOUND = -5
+LIBUSB_ERROR_BUSY = -6
+LIBUSB_ERROR_TIMEOUT = -7
+LIBUSB_ERROR_OVERFLOW = -8
+LIBUSB_ERROR_PIPE = -9
+LIBUSB_ERROR_INTERRUPTED = -10
+LIBUSB_ERROR_NO_MEM = -11
+LIBUSB_ERROR_NOT_SUPPORTED = -12
+LIBUSB_ERROR_OTHER = -99
+
+LIBUSB_TRANSFER_COMPLETED = 0
+LIBUSB_TRANSFER_ERROR = 1
+LIBUSB_TRANSFER_TIMED_OUT = 2
+LIBUSB_TRANSFER_CANCELLED = 3
+LIBUSB_TRANSFER_STALL = 4
+LIBUSB_TRANSFER_NO_DEVICE = 5
+LIBUSB_TRANSFER_OVERFLOW = 6
+
+LIBUSB_TRANSFER_TYPE_CONTROL = 0
+LIBUSB_TRANSFER_TYPE_ISOCHRONOUS = 1
+LIBUSB_TRANSFER_TYPE_BULK = 2
+LIBUSB_TRANSFER_TYPE_INTERRUPT = 3
+
+LIBUSB_TRANSFER_SHORT_NOT_OK = 1 << 0
+LIBUSB_TRANSFER_FREE_BUFFER = 1 << 1
+LIBUSB_TRANSFER_FREE_TRANSFER = 1 << 2
+LIBUSB_TRANSFER_ADD_ZERO_PACKET = 1 << 3
+
+LIBUSB_ENDPOINT_IN = 0x80
+LIBUSB_ENDPOINT_OUT = 0x00
+
+LIBUSB_CAP_HAS_CAPABILITY = 0x0000
+LIBUSB_CAP_HAS_HOTPLUG = 0x0001
+
+LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED = 1 << 0
+LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT = 1 << 1
+LIBUSB_HOTPLUG_ENUMERATE = 1 << 0
+LIBUSB_HOTPLUG_NO_FLAGS = 0
+LIBUSB_HOTPLUG_MATCH_ANY = ct.c_int(-1)
+
+_error_names = {
+	LIBUSB_SUCCESS: b'Success',
+	LIBUSB_ERROR_IO: b'Input/Output Error',
+	LIBUSB_ERROR_INVALID_PARAM: b'Invalid parameter',
+	LIBUSB_ERROR_ACCESS: b'Access denied (insufficient permissions)',
+	LIBUSB_ERROR_NO_DEVICE: b'No such device (it may have been disconnected)',
+	LIBUSB_ERROR_NOT_FOUND: b'Entity not found',
+	LIBUSB_ERROR_BUSY: b'Resource busy',
+	LIBUSB_ERROR_TIMEOUT: b'Operation timed out',
+	LIBUSB_ERROR_OVERFLOW: b'Overflow',
+	LIBUSB_ERROR_PIPE: b'Pipe error',
+	LIBUSB_ERROR_INTERRUPTED: b'System call interrupted (perhaps due to signal)',
+	LIBUSB_ERROR_NO_MEM: b'Insufficient memory',
+	LIBUSB_ERROR_NOT_SUPPORTED: b'Operation not supported or unimplemented on this platform',
+	LIBUSB_ERROR_OTHER: b'Other error',
+}
+
+
+#
+# Simulation defaults
+#
+SIM_BULK_RATE = 650000			# B/S BULK2 bandwidth
+SIM_INT_RATE = 64000			# B/S INT1 bandwidth (64B per 1mS frame)
+SIM_LATENCY = 0.0005			# S emulator + SSI turnaround
+SIM_JITTER = 0.0001				# S uniform jitter added to the latency
+
+SIM_REG_ID = 0x52454931			# 'REI1'
+SIM_REG_VERSION = 0x00010000
+SIM_REG_READ_ONLY = (REG_ID, REG_VERSION, REG_STATUS)
+
+
+#
+# libusb data structures
+#
+class context(ct.Structure):
+	_fields_ = [('id', ct.c_int)]
+
+class device(ct.Structure):
+	_fields_ = [('id', ct.c_int)]
+
+class device_handle(ct.Structure):
+	_fields_ = [('id', ct.c_int)]
+
+class device_descriptor(ct.Structure):
+	_fields_ = [
+		('bLength', ct.c_uint8),
+		('bDescriptorType', ct.c_uint8),
+		('bcdUSB', ct.c_uint16),
+		('bDeviceClass', ct.c_uint8),
+		('bDeviceSubClass', ct.c_uint8),
+		('bDeviceProtocol', ct.c_uint8),
+		('bMaxPacketSize0', ct.c_uint8),
+		('idVendor', ct.c_uint16),
+		('idProduct', ct.c_uint16),
+		('bcdDevice', ct.c_uint16),
+		('iManufacturer', ct.c_uint8),
+		('iProduct', ct.c_uint8),
+		('iSerialNumber', ct.c_uint8),
+		('bNumConfigurations', ct.c_uint8),
+	]
+
+class timeval(ct.Structure):
+	_fields_ = [('tv_sec', ct.c_long), ('tv_usec', ct.c_long)]
+
+class pollfd(ct.Structure):
+	_fields_ = [('fd', ct.c_int), ('events', ct.c_short)]
+
+class transfer(ct.Structure):
+	pass
+
+transfer_cb_fn = ct.CFUNCTYPE(None, ct.POINTER(transfer))
+
+transfer._fields_ = [
+	('dev_handle', ct.POINTER(device_handle)),
+	('flags', ct.c_uint8),
+	('endpoint', ct.c_ubyte),
+	('type', ct.c_ubyte),
+	('timeout', ct.c_uint),
+	('status', ct.c_int),
+	('length', ct.c_int),
+	('actual_length', ct.c_int),
+	('callback', transfer_cb_fn),
+	('user_data', ct.c_void_p),
+	('buffer', ct.POINTER(ct.c_ubyte)),
+	('num_iso_packets', ct.c_int),
+]
+
+hotplug_callback_handle = ct.c_int
+hotplug_callback_fn = ct.CFUNCTYPE(ct.c_int, ct.POINTER(context), ct.POINTER(device),
+									ct.c_int, ct.c_void_p)
+pollfd_added_cb = ct.CFUNCTYPE(None, ct.c_int, ct.c_short, ct.c_void_p)
+pollfd_removed_cb = ct.CFUNCTYPE(None, ct.c_int, ct.c_void_p)
+
+
+# ------------------------------------------------------------
+# Description: SimEndpoint
+# ------------------------------------------------------------
+# IN endpoint of the bridge. Data the emulator sends waits in
+# the bridge FIFO as segments of packets. Packets only cross the
+# bus while the host has an IN transfer queued, at the endpoint
+# rate, so a host that leaves the endpoint idle between reads
+# loses that bus time just as it does on real hardware.
+#
+# With 'fifo_size' set the FIFO holds at most that many bytes;
+# data arriving while it is full is dropped and counted in
+# 'overruns' (bytes), as the SSI side has no way to wait.
+# ------------------------------------------------------------
+class SimEndpoint:
+
+	def __init__(self, rate, fifo_size=None):
+		self.rate = rate
+		self.fifo_size = fifo_size
+		self.segments = collections.deque()	# [t0, data, pos]
+		self.clock = 0.0					# end of the last packet moved
+		self.overruns = 0
+
+	def packet_time(self):
+		return USB_PACKET_SIZE / self.rate
+
+	def pending(self):
+		return sum(len(seg[1]) - seg[2] for seg in self.segments)
+
+	def queue(self, data, start):
+		if self.fifo_size is not None:
+			room = max(0, self.fifo_size - self.pending())
+			if len(data) > room:
+				self.overruns += len(data) - room
+				data = data[:room]
+			if not data:
+				return
+		self.segments.append([start, bytes(data), 0])
+
+	def next_time(self, started):
+		# when the next packet reaches a transfer queued at 'started'
+		if not self.segments:
+			return None
+		return max(self.segments[0][0], started, self.clock) + self.packet_time()
+
+	def clear(self):
+		self.segments.clear()
+
+
+# ------------------------------------------------------------
+# Description: SimBridge
+# ------------------------------------------------------------
+# One simulated bridge plus embedded emulator. Rates, latency
+# and jitter can be changed at any time. unplug()/plug() model
+# the bridge being disconnected and reconnected (optionally at a
+# different bus/port). 'fifo_size' bounds the BULK2 IN FIFO (see
+# SimEndpoint), None leaves it unbounded.
+# ------------------------------------------------------------
+class SimBridge:
+
+	def __init__(self, serial='SIM0000', bus=1, ports=(1,), vid=DEF_VID, pid=DEF_PID,
+					bulk_rate=SIM_BULK_RATE, int_rate=SIM_INT_RATE,
+					latency=SIM_LATENCY, jitter=SIM_JITTER, fifo_size=None):
+		self.serial = serial
+		self.bus = bus
+		self.ports = tuple(ports)
+		self.vid = vid
+		self.pid = pid
+		self.latency = latency
+		self.jitter = jitter
+
+		self.attached = True
+		self.generation = 0				# bumped on every replug
+		self.burst_seq = 0
+		self.paused = False				# throttled by the host
+		self.held = collections.deque()	# (endpoint, in_ep, packet) while paused
+
+		self.endpoints_in = {
+			ENDPOINT_BLK2_IN: SimEndpoint(bulk_rate, fifo_size),
+			ENDPOINT_INT0_IN: SimEndpoint(int_rate),
+			ENDPOINT_INT1_IN: SimEndpoint(int_rate),
+		}
+		self.out_rate = {
+			ENDPOINT_BLK2_OUT: bulk_rate,
+			ENDPOINT_INT0_OUT: int_rate,
+			ENDPOINT_INT1_OUT: int_rate,
+		}
+		self.out_free = {ENDPOINT_BLK2_OUT: 0.0, ENDPOINT_INT0_OUT: 0.0, ENDPOINT_INT1_OUT: 0.0}
+		self.registers = []
+		self.reset_registers()
+
+		# statistics
+		self.packets_out = 0
+		self.bytes_in = 0
+
+	def set_rates(self, bulk_rate=None, int_rate=None):
+		if bulk_rate is not None:
+			self.endpoints_in[ENDPOINT_BLK2_IN].rate = bulk_rate
+			self.out_rate[ENDPOINT_BLK2_OUT] = bulk_rate
+		if int_rate is not None:
+			for ep in (ENDPOINT_INT0_IN, ENDPOINT_INT1_IN):
+				self.endpoints_in[ep].rate = int_rate
+			for ep in (ENDPOINT_INT0_OUT, ENDPOINT_INT1_OUT):
+				self.out_rate[ep] = int_rate
+
+	def reset_registers(self):
+		self.registers = [0] * REG_COUNT
+		self.registers[REG_ID] = SIM_REG_ID
+		self.registers[REG_VERSION] = SIM_REG_VERSION
+
+	def unplug(self):
+		with _lock:
+			if not self.attached:
+				return
+			self.attached = False
+			for ep in self.endpoints_in.values():
+				ep.clear()
+			for c in _contexts.values():
+				c.device_event(self, LIBUSB_HOTPLUG_EVENT_DEVICE_LEFT)
+
+	def plug(self, bus=None, ports=None):
+		with _lock:
+			if self.attached:
+				return
+			if bus is not None:
+				self.bus = bus
+			if ports is not None:
+				self.ports = tuple(ports)
+			self.attached = True
+			self.generation += 1
+			# configuration is lost with power
+			self.reset_registers()
+			self.paused = False
+			self.held.clear()
+			for c in _contexts.values():
+				c.device_event(self, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED)
+
+	# --------------------------------------
+	# embedded emulator - called with the
+	# payload of every completed OUT transfer
+	# --------------------------------------
+	def receive(self, endpoint, data, now):
+		in_ep = ENDPOINT_BLK2_IN if endpoint == ENDPOINT_BLK2_OUT else ENDPOINT_INT1_IN
+		for base in range(0, len(data), USB_PACKET_SIZE):
+			pkt = data[base:base + USB_PACKET_SIZE]
+			self.packets_out += 1
+			if endpoint == ENDPOINT_INT0_OUT:
+				# register commands stay in the bridge
+				self.send(ENDPOINT_INT0_IN, self.register_command(pkt), now)
+			else:
+				self.emulate(endpoint, in_ep, pkt, now)
+
+	def emulate(self, endpoint, in_ep, pkt, now):
+		if pkt[0] == OPCODE_BATCH:
+			for msg in self.unbatch(pkt):
+				self.emulate(endpoint, in_ep, msg, now)
+			return
+		if pkt[0] == OPCODE_THROTTLE:
+			self.throttle(pkt[THROTTLE_STATE_OFFSET] == THROTTLE_PAUSE, now)
+			return
+		if self.paused or self.held:
+			# keep commands in order behind the held ones
+			self.held.append((endpoint, in_ep, bytes(pkt)))
+			self.release_held(now)
+		else:
+			self._emulate(endpoint, in_ep, pkt, now)
+
+	def _emulate(self, endpoint, in_ep, pkt, now):
+		start = now + self.latency + random.uniform(0.0, self.jitter)
+		if pkt[0] == OPCODE_ECHO:
+			self.send(in_ep, pkt, start)
+		elif pkt[0] == OPCODE_BURST_8K and endpoint == ENDPOINT_BLK2_OUT:
+			self.send(ENDPOINT_BLK2_IN, self.burst(), start)
+
+	def unbatch(self, pkt):
+		pkt = bytes(pkt)
+		pos = BATCH_HEADER
+		while pos < len(pkt):
+			n = pkt[pos]
+			if n == 0 or pos + 1 + n > len(pkt):
+				break
+			yield pkt[pos + 1:pos + 1 + n].ljust(USB_PACKET_SIZE, b'\0')
+			pos += n + 1
+
+	# --------------------------------------
+	# a resumed emulator works through the
+	# held commands as the FIFO has room
+	# --------------------------------------
+	def throttle(self, pause, now):
+		self.paused = pause
+		self.release_held(now)
+
+	def release_held(self, now):
+		fifo = self.endpoints_in[ENDPOINT_BLK2_IN]
+		while self.held and not self.paused:
+			if fifo.fifo_size is not None and fifo.pending() + BURST_8K_SIZE > fifo.fifo_size:
+				break
+			endpoint, in_ep, pkt = self.held.popleft()
+			self._emulate(endpoint, in_ep, pkt, now)
+
+	# --------------------------------------
+	# interface 0 register access
+	# --------------------------------------
+	def register_command(self, pkt):
+		pkt = bytes(pkt).ljust(USB_PACKET_SIZE, b'\0')
+		cmd, count, tag = pkt[0], pkt[1], pkt[2]
+		resp = bytearray(USB_PACKET_SIZE)
+		resp[0:3] = pkt[0:3]
+		status = REG_OK
+
+		if cmd == REG_CMD_READ and count <= REG_READS_PER_PACKET:
+			addrs = pkt[REG_HEADER:REG_HEADER + count]
+			if any(a >= REG_COUNT for a in addrs):
+				status = REG_ERR_ADDRESS
+			else:
+				self.registers[REG_STATUS] = self.packets_out & 0xffffffff
+				for i, a in enumerate(addrs):
+					struct.pack_into('<I', resp, REG_HEADER + i * REG_VALUE_SIZE,
+										self.registers[a])
+		elif cmd == REG_CMD_WRITE and count <= REG_WRITES_PER_PACKET:
+			entries = [struct.unpack_from('<BI', pkt, REG_HEADER + i * (1 + REG_VALUE_SIZE))
+						for i in range(count)]
+			if any(a >= REG_COUNT for a, v in entries):
+				status = REG_ERR_ADDRESS
+			elif any(a in SIM_REG_READ_ONLY for a, v in entries):
+				status = REG_ERR_READ_ONLY
+			else:
+				for a, v in entries:
+					self.registers[a] = v
+		else:
+			status = REG_ERR_COMMAND
+
+		resp[3] = status
+		return resp
+
+	def send(self, in_ep, data, start):
+		self.endpoints_in[in_ep].queue(data, start)
+		self.bytes_in += len(data)
+
+	def burst(self):
+		npkts = BURST_8K_SIZE // USB_PACKET_SIZE
+		out = bytearray(BURST_8K_SIZE)
+		fill = bytes(range(256)) * 2
+		for i in range(npkts):
+			seq = (self.burst_seq + i) & 0xffff
+			base = i * USB_PACKET_SIZE
+			out[base] = OPCODE_BURST_8K
+			out[base + 1] = seq & 0xff
+			out[base + 2] = seq >> 8
+			start = seq & 0xff
+			out[base + 3:base + USB_PACKET_SIZE] = fill[start:start + USB_PACKET_SIZE - 3]
+		self.burst_seq = (self.burst_seq + npkts) & 0xffff
+		return out
+
+
+# ------------------------------------------------------------
+# Description: SimContext
+# ------------------------------------------------------------
+# Per libusb context state: submitted transfers, hotplug
+# callbacks and the events waiting to be delivered.
+# ------------------------------------------------------------
+class SimContext:
+
+	def __init__(self, cid):
+		self.id = cid
+		self.struct = context(cid)
+		self.pointer = ct.pointer(self.struct) if cid else None
+		self.pending = []					# submitted transfers, submit order
+		self.devices = {}					# id(bridge) -> device struct
+		self.hotplug = {}					# handle -> (events, vid, pid, fn)
+		self.hotplug_events = collections.deque()
+		self.cond = threading.Condition(_lock)
+		self.events_lock = threading.Lock()
+
+	def device(self, bridge):
+		# libusb devices belong to a context and are replaced when
+		# the bridge re-enumerates
+		dev = self.devices.get(id(bridge))
+		if dev is None or _devices[dev.id][1] != bridge.generation:
+			dev = device(_new_id())
+			_devices[dev.id] = (bridge, bridge.generation, self)
+			self.devices[id(bridge)] = dev
+		return dev
+
+	def device_event(self, bridge, event):
+		for handle, (events, vid, pid, fn) in self.hotplug.items():
+			if not (events & event):
+				continue
+			if vid not in (-1, bridge.vid) or pid not in (-1, bridge.pid):
+				continue
+			self.hotplug_events.append((handle, fn, ct.pointer(self.device(bridge)), event))
+		self.cond.notify_all()
+
+	# --------------------------------------
+	# move finished transfers out of the
+	# pending list - called with _lock held
+	# --------------------------------------
+	def collect(self, now):
+		done = []
+		busy_in = set()
+		for p in list(self.pending):
+			xfer = p.xfer.contents
+			bridge = p.bridge
+			status = None
+
+			if p.cancelled:
+				status = LIBUSB_TRANSFER_CANCELLED
+			elif not bridge.attached or bridge.generation != p.generation:
+				status = LIBUSB_TRANSFER_NO_DEVICE
+			elif xfer.endpoint & LIBUSB_ENDPOINT_IN:
+				key = (id(bridge), xfer.endpoint)
+				if key not in busy_in:
+					busy_in.add(key)
+					if self.fill(p, bridge.endpoints_in[xfer.endpoint], now):
+						status = LIBUSB_TRANSFER_COMPLETED
+					if bridge.held and not bridge.paused:
+						bridge.release_held(now)
+			elif now >= p.done_at:
+				bridge.receive(xfer.endpoint, ct.string_at(_address(xfer.buffer), xfer.length), now)
+				xfer.actual_length = xfer.length
+				status = LIBUSB_TRANSFER_COMPLETED
+
+			if status is None and p.deadline is not None and now >= p.deadline:
+				status = LIBUSB_TRANSFER_TIMED_OUT
+
+			if status is not None:
+				xfer.status = status
+				self.pending.remove(p)
+				_in_flight.discard(ct.addressof(xfer))
+				done.append(p)
+		return done
+
+	def fill(self, p, ep, now):
+		# move the packets that crossed the bus into an IN transfer,
+		# True once the transfer is complete
+		xfer = p.xfer.contents
+		pkt_time = ep.packet_time()
+		while ep.segments:
+			seg = ep.segments[0]
+			start = max(seg[0], p.started, ep.clock)
+			npkts = int((now - start) / pkt_time)
+			if npkts <= 0:
+				return False
+
+			remaining = len(seg[1]) - seg[2]
+			room = xfer.length - xfer.actual_length
+			n = min(npkts * USB_PACKET_SIZE, remaining, room)
+			ct.memmove(_address(xfer.buffer) + xfer.actual_length, seg[1][seg[2]:seg[2] + n], n)
+			xfer.actual_length += n
+			seg[2] += n
+			ep.clock = start + ((n + USB_PACKET_SIZE - 1) // USB_PACKET_SIZE) * pkt_time
+
+			if seg[2] >= len(seg[1]):
+				ep.segments.popleft()
+				if len(seg[1]) % USB_PACKET_SIZE:
+					return True				# short packet ends the transfer
+			if xfer.actual_length >= xfer.length:
+				return True
+			if n < min(remaining, room):
+				return False				# waiting on the next packet
+		return False
+
+	def next_event(self, now):
+		t = None
+		for p in self.pending:
+			xfer = p.xfer.contents
+			if p.cancelled or not p.bridge.attached:
+				return now
+			if xfer.endpoint & LIBUSB_ENDPOINT_IN:
+				te = p.bridge.endpoints_in[xfer.endpoint].next_time(p.started)
+			else:
+				te = p.done_at
+			if p.deadline is not None:
+				te = p.deadline if te is None else min(te, p.deadline)
+			if te is not None:
+				t = te if t is None else min(t, te)
+		return t
+
+
+class _Pending:
+
+	def __init__(self, xfer, bridge, now):
+		self.xfer = xfer
+		self.bridge = bridge
+		self.generation = bridge.generation
+		self.cancelled = False
+		self.started = now
+		x = xfer.contents
+		self.deadline = now + x.timeout / 1000 if x.timeout else None
+		self.done_at = now
+		if not (x.endpoint & LIBUSB_ENDPOINT_IN):
+			rate = bridge.out_rate.get(x.endpoint, SIM_BULK_RATE)
+			npkts = max(1, (x.length + USB_PACKET_SIZE - 1) // USB_PACKET_SIZE)
+			start = max(now, bridge.out_free.get(x.endpoint, 0.0))
+			self.done_at = start + npkts * USB_PACKET_SIZE / rate
+			bridge.out_free[x.endpoint] = self.done_at
+
+
+#
+# Simulator state
+#
+_lock = threading.RLock()
+_ids = [0]
+_bridges = []
+_contexts = {}
+_devices = {}						# device id -> (bridge, generation, context)
+_handles = {}						# handle id -> (struct, bridge, context, generation)
+_transfers = {}						# transfer address -> transfer struct
+_in_flight = set()					# addresses of submitted transfers
+_claims = {}						# (bridge id, interface) -> handle id
+
+
+def _new_id():
+	_ids[0] += 1
+	return _ids[0]
+
+def _address(ptr):
+	return ct.cast(ptr, ct.c_void_p).value
+
+def _target(ref):
+	# byref() objects carry the referenced object in _obj
+	return getattr(ref, '_obj', ref)
+
+def _value(v):
+	return getattr(v, 'value', v)
+
+def _context(ctx):
+	with _lock:
+		if not ctx:
+			if 0 not in _contexts:
+				_contexts[0] = SimContext(0)
+			return _contexts[0]
+		return _contexts.get(ctx.contents.id)
+
+def _bridge_of(dev):
+	entry = _devices.get(dev.contents.id) if dev else None
+	return entry[0] if entry else None
+
+def _handle(dev_handle):
+	if not dev_handle:
+		return None
+	return _handles.get(dev_handle.contents.id)
+
+
+# ------------------------------------------------------------
+# Description: add_bridge / bridges / reset
+# ------------------------------------------------------------
+# Configure the simulated bridges. When none have been added
+# by the first init() a single default bridge is created.
+# ------------------------------------------------------------
+def add_bridge(**kwargs):
+	with _lock:
+		if 'serial' not in kwargs:
+			kwargs['serial'] = f'SIM{len(_bridges):04d}'
+		if 'ports' not in kwargs:
+			kwargs['ports'] = (len(_bridges) + 1,)
+		bridge = SimBridge(**kwargs)
+		_bridges.append(bridge)
+		for c in _contexts.values():
+			c.device_event(bridge, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED)
+		return bridge
+
+def bridges():
+	return list(_bridges)
+
+def reset():
+	with _lock:
+		_bridges.clear()
+		_contexts.clear()
+		_devices.clear()
+		_handles.clear()
+		_transfers.clear()
+		_in_flight.clear()
+		_claims.clear()
+
+
+#
+# Library / context
+#
+def init(ctx):
+	with _lock:
+		if not _bridges:
+			add_bridge()
+		if ctx is None:
+			_context(None)
+			return LIBUSB_SUCCESS
+		c = SimContext(_new_id())
+		_contexts[c.id] = c
+		_target(ctx).contents = c.struct
+		return LIBUSB_SUCCESS
+
+def exit(ctx):
+	with _lock:
+		if ctx:
+			_contexts.pop(ctx.contents.id, None)
+
+def strerror(errcode):
+	return _error_names.get(errcode, b'Unknown error')
+
+def error_name(errcode):
+	return strerror(errcode)
+
+def has_capability(capability):
+	return 1 if capability in (LIBUSB_CAP_HAS_CAPABILITY, LIBUSB_CAP_HAS_HOTPLUG) else 0
+
+def set_debug(ctx, level):
+	pass
+
+
+#
+# Device enumeration
+#
+_device_lists = {}
+
+def get_device_list(ctx, list_ref):
+	with _lock:
+		c = _context(ctx)
+		attached = [b for b in _bridges if b.attached]
+		arr = (ct.POINTER(device)*(len(attached) + 1))()
+		for i, bridge in enumerate(attached):
+			arr[i] = ct.pointer(c.device(bridge))
+		_device_lists[ct.addressof(arr)] = arr
+		ct.cast(ct.pointer(_target(list_ref)), ct.POINTER(ct.c_void_p))[0] = ct.addressof(arr)
+		return len(attached)
+
+def free_device_list(devs, unref_devices):
+	with _lock:
+		_device_lists.pop(_address(devs), None)
+
+def ref_device(dev):
+	return dev
+
+def unref_device(dev):
+	pass
+
+def get_device_descriptor(dev, desc_ref):
+	bridge = _bridge_of(dev)
+	if bridge is None:
+		return LIBUSB_ERROR_NO_DEVICE
+	desc = _target(desc_ref)
+	desc.bLength = 18
+	desc.bDescriptorType = 1
+	desc.bcdUSB = 0x0200
+	desc.bMaxPacketSize0 = USB_PACKET_SIZE
+	desc.idVendor = bridge.vid
+	desc.idProduct = bridge.pid
+	desc.bcdDevice = 0x0100
+	desc.iManufacturer = 1
+	desc.iProduct = 2
+	desc.iSerialNumber = 3
+	desc.bNumConfigurations = 1
+	return LIBUSB_SUCCESS
+
+def get_bus_number(dev):
+	bridge = _bridge_of(dev)
+	return bridge.bus if bridge else 0
+
+def get_port_numbers(dev, port_numbers, port_numbers_len):
+	bridge = _bridge_of(dev)
+	if bridge is None:
+		return LIBUSB_ERROR_NO_DEVICE
+	if len(bridge.ports) > port_numbers_len:
+		return LIBUSB_ERROR_OVERFLOW
+	for i, port in enumerate(bridge.ports):
+		port_numbers[i] = port
+	return len(bridge.ports)
+
+def get_device_address(dev):
+	return dev.contents.id & 0x7f if _bridge_of(dev) else 0
+
+
+#
+# Device handles
+#
+def open(dev, handle_ref):
+	with _lock:
+		entry = _devices.get(dev.contents.id) if dev else None
+		if entry is None:
+			return LIBUSB_ERROR_NO_DEVICE
+		bridge, generation, c = entry
+		if not bridge.attached or bridge.generation != generation:
+			return LIBUSB_ERROR_NO_DEVICE
+		h = device_handle(_new_id())
+		_handles[h.id] = (h, bridge, c, generation)
+		_target(handle_ref).contents = h
+		return LIBUSB_SUCCESS
+
+def close(dev_handle):
+	with _lock:
+		entry = _handle(dev_handle)
+		if entry is None:
+			return
+		for key, owner in list(_claims.items()):
+			if owner == entry[0].id:
+				del _claims[key]
+		del _handles[entry[0].id]
+
+def get_device(dev_handle):
+	entry = _handle(dev_handle)
+	return ct.pointer(entry[2].device(entry[1])) if entry else None
+
+def claim_interface(dev_handle, interface_number):
+	with _lock:
+		entry = _handle(dev_handle)
+		if entry is None:
+			return LIBUSB_ERROR_NOT_FOUND
+		h, bridge, c, generation = entry
+		if not bridge.attached or bridge.generation != generation:
+			return LIBUSB_ERROR_NO_DEVICE
+		if interface_number not in (0, 1, 2):
+			return LIBUSB_ERROR_NOT_FOUND
+		owner = _claims.get((id(bridge), interface_number))
+		if owner is not None and owner != h.id:
+			return LIBUSB_ERROR_BUSY
+		_claims[(id(bridge), interface_number)] = h.id
+		return LIBUSB_SUCCESS
+
+def release_interface(dev_handle, interface_number):
+	with _lock:
+		entry = _handle(dev_handle)
+		if entry is None:
+			return LIBUSB_ERROR_NOT_FOUND
+		if _claims.get((id(entry[1]), interface_number)) != entry[0].id:
+			return LIBUSB_ERROR_NOT_FOUND
+		del _claims[(id(entry[1]), interface_number)]
+		return LIBUSB_SUCCESS
+
+def get_string_descriptor_ascii(dev_handle, desc_index, data, length):
+	entry = _handle(dev_handle)
+	if entry is None:
+		return LIBUSB_ERROR_NO_DEVICE
+	bridge = entry[1]
+	strings = {1: 'RisingEdgeIndustries', 2: 'USB2F-SSI (simulated)', 3: bridge.serial}
+	if desc_index not in strings:
+		return LIBUSB_ERROR_INVALID_PARAM
+	raw = strings[desc_index].encode('ascii')[:length]
+	ct.memmove(data, raw, len(raw))
+	return len(raw)
+
+
+#
+# Asynchronous transfers
+#
+def alloc_transfer(iso_packets):
+	with _lock:
+		xfer = transfer()
+		_transfers[ct.addressof(xfer)] = xfer
+		return ct.pointer(xfer)
+
+def free_transfer(xfer):
+	with _lock:
+		if xfer:
+			_transfers.pop(ct.addressof(xfer.contents), None)
+
+def fill_bulk_transfer(xfer, dev_handle, endpoint, buffer, length, callback, user_data, timeout):
+	x = xfer.contents
+	x.dev_handle = dev_handle
+	x.endpoint = endpoint
+	x.type = LIBUSB_TRANSFER_TYPE_BULK
+	x.timeout = timeout
+	x.buffer = ct.cast(buffer, ct.POINTER(ct.c_ubyte)) if buffer is not None else None
+	x.length = length
+	x.user_data = user_data
+	x.callback = callback
+
+def fill_interrupt_transfer(xfer, dev_handle, endpoint, buffer, length, callback, user_data, timeout):
+	fill_bulk_transfer(xfer, dev_handle, endpoint, buffer, length, callback, user_data, timeout)
+	xfer.contents.type = LIBUSB_TRANSFER_TYPE_INTERRUPT
+
+def submit_transfer(xfer):
+	with _lock:
+		x = xfer.contents
+		entry = _handle(x.dev_handle)
+		if entry is None:
+			return LIBUSB_ERROR_NOT_FOUND
+		h, bridge, c, generation = entry
+		if not bridge.attached or bridge.generation != generation:
+			return LIBUSB_ERROR_NO_DEVICE
+		if x.endpoint & LIBUSB_ENDPOINT_IN and x.endpoint not in bridge.endpoints_in:
+			return LIBUSB_ERROR_PIPE
+		if not x.endpoint & LIBUSB_ENDPOINT_IN and x.endpoint not in bridge.out_rate:
+			return LIBUSB_ERROR_PIPE
+		if ct.addressof(x) in _in_flight:
+			return LIBUSB_ERROR_BUSY
+
+		_in_flight.add(ct.addressof(x))
+		x.actual_length = 0
+		x.status = LIBUSB_TRANSFER_COMPLETED
+		c.pending.append(_Pending(ct.pointer(x), bridge, time.perf_counter()))
+		c.cond.notify_all()
+		return LIBUSB_SUCCESS
+
+def cancel_transfer(xfer):
+	with _lock:
+		addr = ct.addressof(xfer.contents)
+		for ctx in _contexts.values():
+			for p in ctx.pending:
+				if ct.addressof(p.xfer.contents) == addr:
+					if p.cancelled:
+						return LIBUSB_ERROR_NOT_FOUND
+					p.cancelled = True
+					ctx.cond.notify_all()
+					return LIBUSB_SUCCESS
+		return LIBUSB_ERROR_NOT_FOUND
+
+
+#
+# Event handling
+#
+def handle_events_timeout_completed(ctx, tv, completed):
+	c = _context(ctx)
+	if c is None:
+		return LIBUSB_ERROR_INVALID_PARAM
+	tv = _target(tv)
+	timeout = tv.tv_sec + tv.tv_usec / 1e6 if tv else 60.0
+	end = time.perf_counter() + timeout
+
+	if not c.events_lock.acquire(timeout=max(timeout, 0.0)):
+		return LIBUSB_SUCCESS
+	try:
+		while True:
+			with _lock:
+				now = time.perf_counter()
+				done = c.collect(now)
+				hot = list(c.hotplug_events)
+				c.hotplug_events.clear()
+				if not done and not hot:
+					if completed and _target(completed).value:
+						return LIBUSB_SUCCESS
+					t = c.next_event(now)
+					wait = end - now if t is None else min(t, end) - now
+					if wait <= 0 and now >= end:
+						return LIBUSB_SUCCESS
+					c.cond.wait(max(wait, 0.0))
+					continue
+
+			for handle, fn, dev, event in hot:
+				if fn(c.pointer, dev, event, None):
+					hotplug_deregister_callback(ctx, handle)
+			for p in done:
+				cb = p.xfer.contents.callback
+				if cb:
+					cb(p.xfer)
+			return LIBUSB_SUCCESS
+	finally:
+		c.events_lock.release()
+
+def handle_events_timeout(ctx, tv):
+	return handle_events_timeout_completed(ctx, tv, None)
+
+def handle_events_completed(ctx, completed):
+	return handle_events_timeout_completed(ctx, timeval(60, 0), completed)
+
+def handle_events(ctx):
+	return handle_events_timeout_completed(ctx, timeval(60, 0), None)
+
+def interrupt_event_handler(ctx):
+	c = _context(ctx)
+	with _lock:
+		c.cond.notify_all()
+
+def get_next_timeout(ctx, tv):
+	c = _context(ctx)
+	with _lock:
+		now = time.perf_counter()
+		t = c.next_event(now)
+	if t is None:
+		return 0
+	dt = max(t - now, 0.0)
+	out = _target(tv)
+	out.tv_sec = int(dt)
+	out.tv_usec = int((dt - int(dt)) * 1e6)
+	return 1
+
+def get_pollfds(ctx):
+	# no pollable descriptors - callers fall back to event threads
+	return None
+
+def free_pollfds(pollfds):
+	pass
+
+def set_pollfd_notifiers(ctx, added_cb, removed_cb, user_data):
+	pass
+
+def pollfds_handle_timeouts(ctx):
+	return 0
+
+
+#
+# Synchronous transfers - run an async transfer to completion
+# the same way libusb's sync API does
+#
+def _sync_transfer(dev_handle, endpoint, data, length, transferred, timeout, fill):
+	entry = _handle(dev_handle)
+	if entry is None:
+		return LIBUSB_ERROR_NOT_FOUND
+	c = entry[2]
+
+	state = {'done': ct.c_int(0)}
+
+	def on_done(xfer):
+		state['done'].value = 1
+
+	cb = transfer_cb_fn(on_done)
+	xfer = alloc_transfer(0)
+	fill(xfer, dev_handle, endpoint, data, length, cb, None, timeout)
+	r = submit_transfer(xfer)
+	if r < 0:
+		free_transfer(xfer)
+		return r
+
+	while not state['done'].value:
+		handle_events_timeout_completed(c.pointer, ct.byref(timeval(1, 0)), ct.byref(state['done']))
+
+	x = xfer.contents
+	n = x.actual_length
+	status = x.status
+	free_transfer(xfer)
+
+	if transferred is not None:
+		t = _target(transferred)
+		if isinstance(t, ct.c_int):
+			t.value = n
+		else:
+			t[0] = n
+
+	return {
+		LIBUSB_TRANSFER_COMPLETED: LIBUSB_SUCCESS,
+		LIBUSB_TRANSFER_TIMED_OUT: LIBUSB_ERROR_TIMEOUT,
+		LIBUSB_TRANSFER_NO_DEVICE: LIBUSB_ERROR_NO_DEVICE,
+		LIBUSB_TRANSFER_OVERFLOW: LIBUSB_ERROR_OVERFLOW,
+		LIBUSB_TRANSFER_STALL: LIBUSB_ERROR_PIPE,
+	}.get(status, LIBUSB_ERROR_IO)
+
+def bulk_transfer(dev_handle, endpoint, data, length, transferred, timeout):
+	return _sync_transfer(dev_handle, endpoint, data, length, transferred, timeout,
+							fill_bulk_transfer)
+
+def interrupt_transfer(dev_handle, endpoint, data, length, transferred, timeout):
+	return _sync_transfer(dev_handle, endpoint, data, length, transferred, timeout,
+							fill_interrupt_transfer)
+
+
+#
+# Hotplug
+#
+def hotplug_register_callback(ctx, events, flags, vendor_id, product_id, dev_class,
+								cb_fn, user_data, callback_handle):
+	c = _context(ctx)
+	with _lock:
+		handle = _new_id()
+		c.hotplug[handle] = (events, _value(vendor_id), _value(product_id), cb_fn)
+		if flags & LIBUSB_HOTPLUG_ENUMERATE:
+			for bridge in _bridges:
+				if bridge.attached:
+					c.device_event(bridge, LIBUSB_HOTPLUG_EVENT_DEVICE_ARRIVED)
+		if callback_handle is not None:
+			_target(callback_handle).value = handle
+		return LIBUSB_SUCCESS
+
+def hotplug_deregister_callback(ctx, callback_handle):
+	c = _context(ctx)
+	with _lock:
+		c.hotplug.pop(_value(callback_handle), None)
@@ -0,0 +1,369 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - BULK2 streaming engine
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials read BULK2 IN data with a single blocking
+# usb.bulk_transfer() call. While that call is outstanding nothing
+# else is queued on the endpoint, so the host controller idles
+# between reads and the bridge never reaches its ~650kB/s limit.
+#
+# BulkStream keeps several asynchronous libusb transfers queued on
+# the BULK2 IN endpoint at all times. Each transfer is resubmitted
+# as soon as it completes so the bus always has a pending request
+# to fill. Completed data is handed to the application either
+# through a callback or by iterating over the stream.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+from bridge_backend import usb
+
+from bridge_buffers import BufferRing
+from bridge_defs import ENDPOINT_BLK2_IN, EP2IN_TIMEOUT, BURST_8K_SIZE
+
+
+#
+# Definitions
+#
+STREAM_XFER_SIZE = BURST_8K_SIZE	# bytes per queued transfer
+STREAM_XFER_COUNT = 8				# transfers kept in flight
+STREAM_POLL_TIMEOUT = 100			# mS per event handling pass
+
+# transfer status -> libusb return code, for metrics
+STATUS_CODES = {
+	usb.LIBUSB_TRANSFER_COMPLETED: 0,
+	usb.LIBUSB_TRANSFER_TIMED_OUT: usb.LIBUSB_ERROR_TIMEOUT,
+	usb.LIBUSB_TRANSFER_NO_DEVICE: usb.LIBUSB_ERROR_NO_DEVICE,
+	usb.LIBUSB_TRANSFER_OVERFLOW: usb.LIBUSB_ERROR_OVERFLOW,
+	usb.LIBUSB_TRANSFER_STALL: usb.LIBUSB_ERROR_PIPE,
+}
+
+
+# ------------------------------------------------------------
+# Description: BulkStream
+# ------------------------------------------------------------
+# Keeps 'num_transfers' asynchronous reads of 'transfer_size'
+# bytes queued on the BULK2 IN endpoint (0x83). Every completed
+# transfer is delivered and immediately resubmitted.
+#
+# Transfers read straight into the slots of a BufferRing
+# (one is created with 2x 'num_transfers' slots when none is
+# given) so no data is copied or allocated per read. Two
+# delivery modes are supported:
+#  - callback: callback(data) is called from inside event
+#    handling with a memoryview of the filled slot. The view
+#    is only valid until the callback returns since the slot
+#    is reused right after.
+#  - iterator: without a callback, iterating the stream yields
+#    (slot, memoryview) pairs. The caller must hand the slot
+#    back with release(slot) once done with the data.
+#
+# When every slot is held by the consumer, completed transfers
+# are parked and resubmitted as slots are released.
+#
+# Events are handled on the thread calling poll() or iterating
+# the stream, the same way usb.bulk_transfer() handles events
+# on the calling thread.
+#
+# A 'resumable' stream (see BridgeSession.enable_hotplug) treats
+# a lost device as a suspension rather than the end of the
+# stream: iteration keeps waiting until resume() is called with
+# the handle of the reconnected bridge. 'after_poll' is called
+# after every event handling pass so the owner can act on
+# events recorded during it.
+#
+# With 'metrics' (a bridge_metrics.BridgeMetrics) the time from
+# submission to completion of every transfer is recorded.
+#
+# resize() changes the transfer size, number of transfers in
+# flight and timeout of a running stream (see bridge_tune). New
+# sizes apply as transfers are resubmitted and may not exceed the
+# ring slot size.
+# ------------------------------------------------------------
+class BulkStream:
+
+	def __init__(self, dev_handle, ctx=None, endpoint=ENDPOINT_BLK2_IN,
+					transfer_size=STREAM_XFER_SIZE, num_transfers=STREAM_XFER_COUNT,
+					timeout=EP2IN_TIMEOUT, callback=None, ring=None, metrics=None):
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.endpoint = endpoint
+		self.transfer_size = transfer_size
+		self.num_transfers = num_transfers
+		self.timeout = timeout
+		self.callback = callback
+		self.metrics = metrics
+
+		if ring is None:
+			ring = BufferRing(transfer_size, 2 * num_transfers)
+		self.ring = ring
+
+		self.running = False
+		self.suspended = False
+		self.resumable = False
+		self.after_poll = None
+		self.error = 0					# first fatal libusb error seen
+
+		# statistics
+		self.bytes_received = 0
+		self.transfers_completed = 0
+		self.timeouts = 0
+
+		self._transfers = []			# transfer pointers
+		self._index = {}				# transfer address -> transfer number
+		self._slot = []					# ring slot bound to each transfer
+		self._submitted = []			# perf_counter_ns at submission (metrics only)
+		self._parked = collections.deque()
+		self._idle = []					# transfers retired by resize()
+		self._active = 0				# transfers in flight or parked
+		self._in_flight = 0
+
+		# keep a reference to the C callback for the life of the stream
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'stream start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		while not len(self.ring):
+			if not self.running and not self.suspended:
+				raise StopIteration
+			self.poll()
+		return self.ring.get()
+
+	# --------------------------------------
+	# hand a slot yielded by the iterator
+	# back so it can be refilled
+	# --------------------------------------
+	def release(self, slot):
+		self.ring.release(slot)
+		if self._parked and self.running:
+			self._resubmit(self._parked.popleft())
+
+	# --------------------------------------
+	# allocate transfers and queue them all
+	# --------------------------------------
+	def start(self):
+		if self.running:
+			return 0
+
+		self.error = 0
+		for i in range(self.num_transfers):
+			if self._alloc() < 0:
+				self._free_transfers()
+				return usb.LIBUSB_ERROR_NO_MEM
+
+		self.running = True
+		self._active = len(self._transfers)
+		for i in range(len(self._transfers)):
+			r = self._submit(i)
+			if r < 0:
+				self.stop()
+				return r
+
+		return 0
+
+	# --------------------------------------
+	# change transfer size, depth and
+	# timeout while streaming
+	# --------------------------------------
+	def resize(self, transfer_size=None, num_transfers=None, timeout=None):
+		if transfer_size is not None:
+			if transfer_size > self.ring.slot_size:
+				raise ValueError(f'transfer size {transfer_size} exceeds ring slot size {self.ring.slot_size}')
+			self.transfer_size = transfer_size
+		if timeout is not None:
+			self.timeout = timeout
+		if num_transfers is None:
+			return 0
+
+		# shrinking happens as surplus transfers complete
+		self.num_transfers = num_transfers
+		while self.running and self._active < num_transfers:
+			i = self._idle.pop() if self._idle else self._alloc()
+			if i < 0:
+				return usb.LIBUSB_ERROR_NO_MEM
+			self._active += 1
+			r = self._submit(i)
+			if r < 0:
+				return r
+		return 0
+
+	# --------------------------------------
+	# cancel outstanding transfers and wait
+	# for libusb to hand them back
+	# --------------------------------------
+	def stop(self):
+		self.running = False
+		for xfer in self._transfers:
+			usb.cancel_transfer(xfer)
+
+		while self._in_flight > 0:
+			r = self._handle_events(STREAM_POLL_TIMEOUT)
+			if r < 0:
+				break
+
+		self._free_transfers()
+
+	# --------------------------------------
+	# park the stream while the bridge is
+	# gone, then restart it on a new handle
+	# --------------------------------------
+	def suspend(self):
+		self.suspended = True
+		self.stop()
+
+	def resume(self, dev_handle):
+		self.dev_handle = dev_handle
+		self.suspended = False
+		return self.start()
+
+	# --------------------------------------
+	# run one pass of libusb event handling,
+	# completions are dispatched from here
+	# --------------------------------------
+	def poll(self, timeout_ms=STREAM_POLL_TIMEOUT):
+		r = self._handle_events(timeout_ms)
+		if self.after_poll is not None:
+			self.after_poll()
+		return r
+
+	def _handle_events(self, timeout_ms):
+		tv = usb.timeval(timeout_ms // 1000, (timeout_ms % 1000) * 1000)
+		r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+		if r < 0 and r != usb.LIBUSB_ERROR_INTERRUPTED:
+			self._fail(r)
+		return r
+
+	def _alloc(self):
+		xfer = usb.alloc_transfer(0)
+		if not xfer:
+			return -1
+		i = len(self._transfers)
+		usb.fill_bulk_transfer(xfer, self.dev_handle, self.endpoint, None,
+							self.transfer_size, self._cb, None, self.timeout)
+		self._index[ct.addressof(xfer.contents)] = i
+		self._transfers.append(xfer)
+		self._slot.append(-1)
+		self._submitted.append(0)
+		return i
+
+	# --------------------------------------
+	# bind a free ring slot to a transfer and
+	# queue it, parking it if none is free
+	# --------------------------------------
+	def _submit(self, i):
+		slot = self.ring.acquire()
+		if slot < 0:
+			self._parked.append(i)
+			return 0
+
+		xfer = self._transfers[i]
+		xfer.contents.buffer = self.ring.pointers[slot]
+		xfer.contents.length = self.transfer_size
+		xfer.contents.timeout = self.timeout
+		self._slot[i] = slot
+		r = usb.submit_transfer(xfer)
+		if r < 0:
+			self._slot[i] = -1
+			self.ring.release(slot)
+			self._fail(r)
+		else:
+			self._in_flight += 1
+			if self.metrics is not None:
+				self._submitted[i] = self.metrics.clock()
+		return r
+
+	def _fail(self, r):
+		if self.error == 0:
+			self.error = r
+		self.running = False
+
+	def _free_transfers(self):
+		if self._in_flight > 0:
+			# libusb still owns these - leaking beats a use after free
+			return
+		for xfer in self._transfers:
+			usb.free_transfer(xfer)
+		self._transfers = []
+		self._index = {}
+		self._slot = []
+		self._submitted = []
+		self._parked.clear()
+		self._idle = []
+		self._active = 0
+
+	# --------------------------------------
+	# transfer completion callback
+	# --------------------------------------
+	def _on_complete(self, xfer):
+		self._in_flight -= 1
+		i = self._index[ct.addressof(xfer.contents)]
+		slot = self._slot[i]
+		self._slot[i] = -1
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+
+		# a transfer queued before metrics were attached has no start time
+		if self.metrics is not None and self._submitted[i] and status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self.metrics.record(self.endpoint, STATUS_CODES.get(status, usb.LIBUSB_ERROR_IO),
+								xfer.contents.length, n, self.metrics.clock() - self._submitted[i])
+
+		if status == usb.LIBUSB_TRANSFER_COMPLETED:
+			self.transfers_completed += 1
+		elif status == usb.LIBUSB_TRANSFER_TIMED_OUT:
+			# no data inside the timeout window - idle, not an error
+			self.timeouts += 1
+		elif status == usb.LIBUSB_TRANSFER_NO_DEVICE:
+			if self.resumable:
+				self.suspended = True
+				self.running = False
+			else:
+				self._fail(usb.LIBUSB_ERROR_NO_DEVICE)
+			n = 0
+		elif status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self._fail(usb.LIBUSB_ERROR_IO)
+			n = 0
+
+		if n > 0:
+			self.bytes_received += n
+			self.ring.commit(slot, n)
+			if self.callback is not None:
+				self.callback(self.ring.get()[1])
+				self.ring.release(slot)
+		else:
+			self.ring.release(slot)
+
+		if self.running:
+			self._resubmit(i)
+
+	def _resubmit(self, i):
+		if self._active > self.num_transfers:
+			self._active -= 1
+			self._idle.append(i)
+		else:
+			self._submit(i)
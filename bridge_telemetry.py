@@ -0,0 +1,316 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - INT1 telemetry reader
+#
+# Project Description:
+# ----------------------------------------------------------------
+# Interface 1 is the bridge's low rate (64kB/s) interrupt data
+# path. The host polls it every 1mS, which makes it the natural
+# channel for telemetry from the embedded system, but the
+# tutorials only ever claim interface 2.
+#
+# TelemetryReader claims interface 1 on an already open bridge
+# handle and keeps several interrupt transfers queued on INT1 IN
+# (0x82). A background thread handles libusb events so telemetry
+# keeps flowing whether or not the application is polling, and
+# every packet is time stamped and appended to a deque. The
+# application takes packets off the other end; deque append and
+# popleft are atomic, so the handoff takes no lock.
+#
+# libusb runs completions for every transfer on a context on
+# whichever thread is handling events. BulkStream is not thread
+# safe, so when the reader shares a handle and context with a
+# BULK2 stream it must not run its own event thread: pass
+# thread=False and the stream's poll() completes the INT1 reads
+# as well (the INT1 callback is only a copy and an append).
+# Interrupt transfers are scheduled by the host controller ahead
+# of bulk traffic, so a saturated BULK2 path does not delay
+# telemetry on the bus.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import collections
+import ctypes as ct
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_defs import (ENDPOINT_INT1_OUT, ENDPOINT_INT1_IN, INT1_INTERFACE,
+							USB_PACKET_SIZE)
+from bridge_stream import STATUS_CODES
+
+
+#
+# Definitions
+#
+INT1_XFER_COUNT = 4				# interrupt reads kept queued
+INT1_TIMEOUT = 0				# mS, 0 = wait forever for telemetry
+INT1_OUT_TIMEOUT = 100			# mS
+INT1_QUEUE_SIZE = 4096			# packets held before the oldest are dropped
+INT1_POLL_TIMEOUT = 50			# mS per pass of the reader thread
+
+
+# ------------------------------------------------------------
+# Description: TelemetryReader
+# ------------------------------------------------------------
+# Reads INT1 IN into a bounded queue of (timestamp_ns, bytes)
+# records, timestamp_ns being time.perf_counter_ns() at
+# completion:
+#
+#   with TelemetryReader(session.dev_handle, session.ctx) as tlm:
+#       for t, pkt in tlm.drain():
+#           handle(pkt)
+#
+# 'callback(timestamp_ns, data)' may be given instead to receive
+# each packet as it completes, inside libusb event handling.
+#
+# With thread=False nothing handles events in the background:
+# whoever owns the context (BulkStream.poll(), the session or
+# poll() here) completes the reads, and get() handles events
+# itself while it waits.
+#
+# When the application falls behind, the oldest packets are
+# dropped once 'max_queue' are waiting and counted in 'dropped'.
+# get() blocks until a packet arrives; drain() and get_nowait()
+# never block.
+#
+# 'metrics' (a bridge_metrics.BridgeMetrics) records each INT1
+# transfer as BulkStream does for BULK2.
+# ------------------------------------------------------------
+class TelemetryReader:
+
+	def __init__(self, dev_handle, ctx=None, endpoint=ENDPOINT_INT1_IN,
+					interface=INT1_INTERFACE, packet_size=USB_PACKET_SIZE,
+					num_transfers=INT1_XFER_COUNT, timeout=INT1_TIMEOUT,
+					max_queue=INT1_QUEUE_SIZE, callback=None, metrics=None, thread=True):
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.endpoint = endpoint
+		self.interface = interface
+		self.packet_size = packet_size
+		self.num_transfers = num_transfers
+		self.timeout = timeout
+		self.max_queue = max_queue
+		self.callback = callback
+		self.metrics = metrics
+		self.thread = thread
+
+		self.running = False
+		self.claimed = False
+		self.error = 0
+
+		# statistics
+		self.packets = 0
+		self.bytes_received = 0
+		self.dropped = 0
+
+		self._queue = collections.deque(maxlen=max_queue)
+		self._ready = threading.Event()
+		self._thread = None
+		self._transfers = []
+		self._buffers = []
+		self._index = {}				# transfer address -> transfer number
+		self._submitted = []			# perf_counter_ns at submission (metrics only)
+		self._in_flight = 0
+		self._out_transferred = ct.c_int(0)
+
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+	def __enter__(self):
+		r = self.start()
+		if r < 0:
+			raise RuntimeError(f'telemetry start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.stop()
+		return False
+
+	# --------------------------------------
+	# claim INT1, queue the reads and start
+	# the event thread
+	# --------------------------------------
+	def start(self):
+		if self.running:
+			return 0
+
+		r = usb.claim_interface(self.dev_handle, self.interface)
+		if r < 0:
+			return r
+		self.claimed = True
+
+		self.error = 0
+		for i in range(self.num_transfers):
+			xfer = usb.alloc_transfer(0)
+			if not xfer:
+				self.stop()
+				return usb.LIBUSB_ERROR_NO_MEM
+			buf = (ct.c_ubyte*self.packet_size)()
+			usb.fill_interrupt_transfer(xfer, self.dev_handle, self.endpoint, buf,
+										self.packet_size, self._cb, None, self.timeout)
+			self._index[ct.addressof(xfer.contents)] = i
+			self._transfers.append(xfer)
+			self._buffers.append(buf)
+			self._submitted.append(0)
+
+		self.running = True
+		for i in range(len(self._transfers)):
+			r = self._submit(i)
+			if r < 0:
+				self.stop()
+				return r
+
+		if self.thread:
+			self._thread = threading.Thread(target=self._event_loop, name='bridge-int1',
+											daemon=True)
+			self._thread.start()
+		return 0
+
+	def stop(self):
+		self.running = False
+		for xfer in self._transfers:
+			usb.cancel_transfer(xfer)
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+		# the thread is gone - collect any cancellations ourselves
+		while self._in_flight > 0:
+			tv = usb.timeval(0, INT1_POLL_TIMEOUT * 1000)
+			if usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None) < 0:
+				break
+
+		if self._in_flight == 0:
+			for xfer in self._transfers:
+				usb.free_transfer(xfer)
+			self._transfers = []
+			self._buffers = []
+			self._index = {}
+			self._submitted = []
+
+		if self.claimed:
+			usb.release_interface(self.dev_handle, self.interface)
+			self.claimed = False
+		self._ready.set()
+
+	# --------------------------------------
+	# application side of the queue
+	# --------------------------------------
+	def __len__(self):
+		return len(self._queue)
+
+	def get_nowait(self):
+		try:
+			return self._queue.popleft()
+		except IndexError:
+			return None
+
+	def get(self, timeout=None):
+		end = time.perf_counter() + timeout if timeout is not None else None
+		while True:
+			item = self.get_nowait()
+			if item is not None or not self.running:
+				return item
+			self._ready.clear()
+			if self._queue:
+				continue
+			wait = None if end is None else end - time.perf_counter()
+			if wait is not None and wait <= 0:
+				return None
+			if self._thread is None:
+				ms = INT1_POLL_TIMEOUT if wait is None else min(INT1_POLL_TIMEOUT, int(wait * 1000) + 1)
+				self.poll(ms)
+			else:
+				self._ready.wait(wait)
+
+	def drain(self):
+		queue = self._queue
+		while queue:
+			yield queue.popleft()
+
+	# --------------------------------------
+	# send one packet on INT1 OUT
+	# --------------------------------------
+	def send(self, data, endpoint=ENDPOINT_INT1_OUT, timeout=INT1_OUT_TIMEOUT):
+		buf = (ct.c_ubyte*USB_PACKET_SIZE).from_buffer_copy(bytes(data).ljust(USB_PACKET_SIZE, b'\0'))
+		return usb.interrupt_transfer(self.dev_handle, endpoint, buf, USB_PACKET_SIZE,
+										ct.byref(self._out_transferred), timeout)
+
+	# --------------------------------------
+	# run one pass of libusb event handling
+	# (thread=False)
+	# --------------------------------------
+	def poll(self, timeout_ms=INT1_POLL_TIMEOUT):
+		tv = usb.timeval(timeout_ms // 1000, (timeout_ms % 1000) * 1000)
+		r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+		if r < 0 and r != usb.LIBUSB_ERROR_INTERRUPTED:
+			if self.error == 0:
+				self.error = r
+			self.running = False
+		return r
+
+	# --------------------------------------
+	# internals
+	# --------------------------------------
+	def _submit(self, i):
+		r = usb.submit_transfer(self._transfers[i])
+		if r < 0:
+			if self.error == 0:
+				self.error = r
+			self.running = False
+		else:
+			self._in_flight += 1
+			if self.metrics is not None:
+				self._submitted[i] = self.metrics.clock()
+		return r
+
+	def _event_loop(self):
+		while self.running:
+			self.poll()
+		self._ready.set()
+
+	def _on_complete(self, xfer):
+		now = time.perf_counter_ns()
+		self._in_flight -= 1
+		i = self._index[ct.addressof(xfer.contents)]
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+
+		if self.metrics is not None and status != usb.LIBUSB_TRANSFER_CANCELLED:
+			self.metrics.record(self.endpoint, STATUS_CODES.get(status, usb.LIBUSB_ERROR_IO),
+								self.packet_size, n, now - self._submitted[i])
+
+		if status == usb.LIBUSB_TRANSFER_NO_DEVICE:
+			self.error = self.error or usb.LIBUSB_ERROR_NO_DEVICE
+			self.running = False
+		elif status not in (usb.LIBUSB_TRANSFER_COMPLETED, usb.LIBUSB_TRANSFER_TIMED_OUT,
+							usb.LIBUSB_TRANSFER_CANCELLED):
+			self.error = self.error or usb.LIBUSB_ERROR_IO
+			self.running = False
+		elif n > 0:
+			data = ct.string_at(self._buffers[i], n)
+			self.packets += 1
+			self.bytes_received += n
+			if self.callback is not None:
+				self.callback(now, data)
+			else:
+				# the deque drops the oldest itself - never popleft()
+				# here, the application may empty it meanwhile
+				if len(self._queue) == self._queue.maxlen:
+					self.dropped += 1
+				self._queue.append((now, data))
+				self._ready.set()
+
+		if self.running:
+			self._submit(i)
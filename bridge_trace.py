@@ -0,0 +1,386 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Transfer trace record and replay
+#
+# Project Description:
+# ----------------------------------------------------------------
+# A throughput drop seen in the field can't be reproduced on a
+# dev box without the exact traffic that caused it: which
+# transfers ran, how large they were, when they completed and
+# what came back.
+#
+# TraceWriter logs every transfer to a compact binary file. It
+# wraps the blocking usb calls (so testcase1_exe/testcase2_exe
+# style code can be traced unchanged) and can also be added as a
+# BridgeMetrics hook to follow the asynchronous streams.
+#
+# TraceReplayer plays a trace back, at the original speed or
+# scaled, either as drop in usb.bulk_transfer() /
+# usb.interrupt_transfer() calls that hand the host code the
+# recorded data, return codes and timing, or as timed callbacks
+# to a processing pipeline. Replays of the same trace are the
+# same every time, so timing regressions in the processing code
+# can be profiled deterministically.
+#
+# File format, all little endian:
+#
+#   header  8s   magic 'BRTRACE\0'
+#           H    version (1)
+#           H    flags (bit 0: payloads recorded)
+#           q    wall clock start, nS since the epoch
+#
+#   record  B    endpoint
+#           B    flags (bit 0: payload follows, bit 1: async)
+#           h    libusb return code
+#           I    bytes requested
+#           I    bytes transferred
+#           Q    start, nS since the trace started
+#           I    duration nS (saturates at ~4.3S)
+#           I    payload bytes that follow
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import argparse
+import collections
+import ctypes as ct
+import struct
+import sys
+import threading
+import time
+from bridge_backend import usb
+
+from bridge_metrics import ref_value, set_ref_value
+
+#
+# Definitions
+#
+TRACE_MAGIC = b'BRTRACE\0'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<8sHHq')
+TRACE_RECORD = struct.Struct('<BBhIIQII')
+
+TRACE_HAS_PAYLOAD = 0x01			# header: payloads recorded
+REC_PAYLOAD = 0x01					# record: payload follows
+REC_ASYNC = 0x02					# record: asynchronous transfer
+
+TRACE_BUFFER = 1024*1024			# file write buffer
+DURATION_MAX = 0xffffffff
+REPLAY_SPIN_NS = 1000000			# busy wait the last mS of a delay
+
+TraceRecord = collections.namedtuple('TraceRecord',
+	'endpoint flags r requested transferred start_ns duration_ns payload')
+
+
+# ------------------------------------------------------------
+# Description: _UsbProxy
+# ------------------------------------------------------------
+# Stands in for the usb module with some functions replaced:
+#
+#   tutorial2.usb = writer.wrap(tutorial2.usb)
+# ------------------------------------------------------------
+class _UsbProxy:
+
+	def __init__(self, module, **overrides):
+		self._module = module
+		self.__dict__.update(overrides)
+
+	def __getattr__(self, name):
+		return getattr(self._module, name)
+
+
+# ------------------------------------------------------------
+# Description: TraceWriter
+# ------------------------------------------------------------
+# Records transfers to 'path':
+#
+#   with TraceWriter('field.trc') as trace:
+#       r = trace.bulk_transfer(h, 0x83, buf, 8192, ct.byref(n), 1000)
+#       metrics.add_hook(trace.hook)        # async streams, no payload
+#
+# 'payload' False records sizes and timing only; 'max_payload'
+# caps the bytes kept per transfer. record() can be called
+# directly for transfers made some other way. Safe to call from
+# several threads.
+# ------------------------------------------------------------
+class TraceWriter:
+
+	def __init__(self, path, payload=True, max_payload=None):
+		self.path = path
+		self.payload = payload
+		self.max_payload = max_payload
+		self.records = 0
+		self.clock = time.perf_counter_ns
+
+		self._lock = threading.Lock()
+		self._file = open(path, 'wb', buffering=TRACE_BUFFER)
+		self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+											TRACE_HAS_PAYLOAD if payload else 0, time.time_ns()))
+		self._t0 = self.clock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	def close(self):
+		with self._lock:
+			if not self._file.closed:
+				self._file.close()
+
+	# --------------------------------------
+	# one transfer - 'data' is the buffer
+	# it used (any buffer protocol object)
+	# --------------------------------------
+	def record(self, endpoint, r, requested, transferred, start_ns, end_ns, data=None,
+				async_=False):
+		flags = REC_ASYNC if async_ else 0
+		body = b''
+		if self.payload and data is not None and transferred > 0:
+			n = transferred if self.max_payload is None else min(transferred, self.max_payload)
+			body = memoryview(data).cast('B')[:n]
+			flags |= REC_PAYLOAD
+		head = TRACE_RECORD.pack(endpoint, flags, r, requested, transferred,
+									max(0, start_ns - self._t0),
+									min(DURATION_MAX, end_ns - start_ns), len(body))
+		with self._lock:
+			self._file.write(head)
+			if body:
+				self._file.write(body)
+			self.records += 1
+
+	# --------------------------------------
+	# traced blocking transfers - same
+	# arguments as the usb functions
+	# --------------------------------------
+	def bulk_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		return self._transfer(usb.bulk_transfer, dev_handle, endpoint, data, length,
+								transferred, timeout)
+
+	def interrupt_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		return self._transfer(usb.interrupt_transfer, dev_handle, endpoint, data, length,
+								transferred, timeout)
+
+	def _transfer(self, fn, dev_handle, endpoint, data, length, transferred, timeout):
+		t0 = self.clock()
+		r = fn(dev_handle, endpoint, data, length, transferred, timeout)
+		t1 = self.clock()
+		self.record(endpoint, r, length, ref_value(transferred), t0, t1, data)
+		return r
+
+	def wrap(self, module=usb):
+		return _UsbProxy(module, bulk_transfer=self.bulk_transfer,
+							interrupt_transfer=self.interrupt_transfer)
+
+	# --------------------------------------
+	# BridgeMetrics hook - sizes and timing
+	# of async transfers
+	# --------------------------------------
+	def hook(self, endpoint, r, requested, n, ns):
+		end = self.clock()
+		self.record(endpoint, r, requested, n, end - ns, end, async_=True)
+
+
+# ------------------------------------------------------------
+# Description: TraceReader
+# ------------------------------------------------------------
+# Iterates the TraceRecords of a trace file. 'payload' is bytes
+# or None. summary() gives per endpoint totals.
+# ------------------------------------------------------------
+class TraceReader:
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			head = f.read(TRACE_HEADER.size)
+		if len(head) < TRACE_HEADER.size:
+			raise RuntimeError(f'trace file truncated: {path}')
+		magic, self.version, self.flags, self.wall_ns = TRACE_HEADER.unpack(head)
+		if magic != TRACE_MAGIC:
+			raise RuntimeError(f'not a bridge trace: {path}')
+		if self.version != TRACE_VERSION:
+			raise RuntimeError(f'trace version {self.version} not supported')
+
+	def __iter__(self):
+		with open(self.path, 'rb', buffering=TRACE_BUFFER) as f:
+			f.seek(TRACE_HEADER.size)
+			while True:
+				head = f.read(TRACE_RECORD.size)
+				if len(head) < TRACE_RECORD.size:
+					return					# end, or a record cut off by a crash
+				fields = TRACE_RECORD.unpack(head)
+				size = fields[-1]
+				payload = f.read(size) if size else None
+				if size and len(payload) < size:
+					return
+				yield TraceRecord(*fields[:-1], payload)
+
+	def summary(self):
+		out = {}
+		for rec in self:
+			s = out.setdefault(f'0x{rec.endpoint:02x}', {'transfers': 0, 'bytes': 0,
+											'errors': 0, 'timeouts': 0, 'busy_ms': 0.0,
+											'first_ms': rec.start_ns / 1e6, 'last_ms': 0.0})
+			s['transfers'] += 1
+			s['bytes'] += rec.transferred
+			if rec.r == usb.LIBUSB_ERROR_TIMEOUT:
+				s['timeouts'] += 1
+			elif rec.r < 0:
+				s['errors'] += 1
+			s['busy_ms'] += rec.duration_ns / 1e6
+			s['last_ms'] = (rec.start_ns + rec.duration_ns) / 1e6
+		for s in out.values():
+			span = (s['last_ms'] - s['first_ms']) / 1000
+			s['kB/s'] = round(s['bytes'] / span / 1000, 2) if span > 0 else 0.0
+		return out
+
+
+# ------------------------------------------------------------
+# Description: TraceReplayer
+# ------------------------------------------------------------
+# Plays a trace back. 'speed' scales time: 1.0 is the original
+# pace, 2.0 twice as fast, 0 as fast as possible.
+#
+# Drop in transfers - each call takes the next recorded transfer
+# on its endpoint, copies its payload into 'data', sets the
+# transferred count, waits until the recorded completion time
+# and returns the recorded code. Once an endpoint runs out the
+# calls return LIBUSB_ERROR_NO_DEVICE, like an unplug. The
+# wrapped module also answers claim_interface() and
+# release_interface() with 0, as there is no handle to claim.
+#
+#   replay = TraceReplayer('field.trc')
+#   tutorial2.usb = replay.wrap(tutorial2.usb)
+#   tutorial2.testcase2_exe(None)
+#
+# play(handler) instead calls handler(record) for every record
+# as it completes, for feeding a processing pipeline directly.
+# 'late_ns' is how far behind schedule the replay ran at worst,
+# i.e. how far the host code fell behind the recorded traffic.
+# ------------------------------------------------------------
+class TraceReplayer:
+
+	def __init__(self, trace, speed=1.0, endpoints=None):
+		if isinstance(trace, str):
+			trace = TraceReader(trace)
+		self.speed = speed
+		self.records = [r for r in trace if endpoints is None or r.endpoint in endpoints]
+		self.clock = time.perf_counter_ns
+		self.late_ns = 0
+		self.replayed = 0
+		self.rewind()
+
+	def rewind(self):
+		self._queues = {}
+		for rec in self.records:
+			self._queues.setdefault(rec.endpoint, collections.deque()).append(rec)
+		self._start = None
+		self.late_ns = 0
+		self.replayed = 0
+
+	# --------------------------------------
+	# wait until a record's completion time
+	# --------------------------------------
+	def _wait(self, rec):
+		now = self.clock()
+		if self._start is None:
+			# time 0 is the first record replayed
+			self._start = now - self._scaled(rec.start_ns)
+		if not self.speed:
+			return
+		due = self._start + self._scaled(rec.start_ns + rec.duration_ns)
+		late = now - due
+		if late >= 0:
+			self.late_ns = max(self.late_ns, late)
+			return
+		while True:
+			left = due - self.clock()
+			if left <= 0:
+				return
+			if left > REPLAY_SPIN_NS:
+				time.sleep((left - REPLAY_SPIN_NS) / 1e9)
+
+	def _scaled(self, ns):
+		return int(ns / self.speed) if self.speed else 0
+
+	# --------------------------------------
+	# drop in usb transfer functions
+	# --------------------------------------
+	def bulk_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		return self._transfer(endpoint, data, length, transferred)
+
+	def interrupt_transfer(self, dev_handle, endpoint, data, length, transferred, timeout):
+		return self._transfer(endpoint, data, length, transferred)
+
+	def _transfer(self, endpoint, data, length, transferred):
+		q = self._queues.get(endpoint)
+		if not q:
+			set_ref_value(transferred, 0)
+			return usb.LIBUSB_ERROR_NO_DEVICE
+		rec = q.popleft()
+		self._wait(rec)
+
+		n = min(rec.transferred, length)
+		if endpoint & usb.LIBUSB_ENDPOINT_IN and rec.payload is not None:
+			ct.memmove(data, rec.payload, min(n, len(rec.payload)))
+		set_ref_value(transferred, n)
+		self.replayed += 1
+		return rec.r
+
+	def wrap(self, module=usb):
+		return _UsbProxy(module, bulk_transfer=self.bulk_transfer,
+							interrupt_transfer=self.interrupt_transfer,
+							claim_interface=self.claim_interface,
+							release_interface=self.release_interface)
+
+	def claim_interface(self, dev_handle, interface):
+		return 0
+
+	def release_interface(self, dev_handle, interface):
+		return 0
+
+	# --------------------------------------
+	# timed callbacks in trace order
+	# --------------------------------------
+	def play(self, handler):
+		for rec in sorted(self.records, key=lambda r: r.start_ns + r.duration_ns):
+			self._wait(rec)
+			handler(rec)
+			self.replayed += 1
+		return self.stats()
+
+	def stats(self):
+		return {
+			'records': len(self.records),
+			'replayed': self.replayed,
+			'speed': self.speed,
+			'late_ms': self.late_ns / 1e6,
+		}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='USB bridge trace summary')
+	parser.add_argument('trace', help='trace file written by TraceWriter')
+	args = parser.parse_args(argv)
+
+	trace = TraceReader(args.trace)
+	print(f"{'endpoint':<10}{'transfers':>10}{'bytes':>12}{'errors':>8}{'timeouts':>10}{'kB/s':>10}")
+	for ep, s in sorted(trace.summary().items()):
+		print(f"{ep:<10}{s['transfers']:>10}{s['bytes']:>12}{s['errors']:>8}{s['timeouts']:>10}{s['kB/s']:>10}")
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
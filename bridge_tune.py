@@ -0,0 +1,284 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Adaptive transfer tuning
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials hard code the read size (64, then 64*128 bytes)
+# and the timeouts (EP2IN_TIMEOUT 1000mS, EP2OUT_TIMEOUT 250mS).
+# The right values depend on how fast the embedded system is
+# sending: small reads waste round trips at full rate, large ones
+# hold data back when traffic is light, and a fixed timeout is
+# either far too long or too short.
+#
+# StreamTuner watches a running BulkStream and resizes it toward
+# one of two goals:
+#  - throughput: transfers grow while they keep coming back full
+#    and shrink when the device ends most of them early with a
+#    short packet, enough of them are queued to hold
+#    TUNE_BUFFER_TIME of data, and the timeout is a few times the
+#    time the whole queue takes to fill so partial transfers are
+#    not handed back needlessly
+#  - latency: transfers are sized to fill in half the latency
+#    budget at the observed rate and time out within it, so no
+#    byte waits in a buffer longer than the budget
+#
+# AdaptiveTimeout does the same for blocking transfers. It tracks
+# the smoothed time per packet and its variation (the TCP
+# retransmit timer method) and derives a timeout for a transfer
+# of any size.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import math
+import time
+from bridge_backend import usb
+
+from bridge_defs import EP2IN_TIMEOUT, EP2OUT_TIMEOUT, USB_PACKET_SIZE
+from bridge_metrics import BridgeMetrics
+
+
+#
+# Definitions
+#
+TUNE_THROUGHPUT = 'throughput'
+TUNE_LATENCY = 'latency'
+
+TUNE_INTERVAL = 0.25			# S between adjustments
+TUNE_LATENCY_MS = 20			# default latency budget
+TUNE_MIN_SIZE = USB_PACKET_SIZE*8
+TUNE_MIN_DEPTH = 2
+TUNE_MAX_DEPTH = 32
+TUNE_BUFFER_TIME = 0.02			# S of data kept queued in throughput mode
+TUNE_FILL_MARGIN = 4			# throughput timeout, in queue fill times
+TUNE_FULL = 0.9					# fraction of full transfers that grows them
+TUNE_SHORT = 0.5				# fraction of short transfers that shrinks them
+TUNE_MIN_RATE = 1000			# B/S treated as idle
+TUNE_MIN_TIMEOUT = 5			# mS
+TUNE_MAX_TIMEOUT = EP2IN_TIMEOUT
+TUNE_SMOOTHING = 0.5			# weight of the newest rate sample
+
+
+# ------------------------------------------------------------
+# Description: StreamTuner
+# ------------------------------------------------------------
+# Adjusts transfer size, depth and timeout of 'stream' every
+# 'interval' seconds. The stream's ring must have slots of the
+# largest size the tuner may pick ('max_size' defaults to the
+# ring slot size):
+#
+#   ring = BufferRing(64*1024, 2*TUNE_MAX_DEPTH)
+#   with session.stream(ring=ring) as stream:
+#       tuner = StreamTuner(stream, goal=TUNE_LATENCY, latency_ms=10)
+#       for slot, data in stream:
+#           ...
+#
+# The tuner runs from the stream's after_poll hook (chaining any
+# hook already set) and observes completions through a
+# BridgeMetrics hook, adding a BridgeMetrics to the stream if it
+# has none. It is rate driven: only the received byte count and
+# whether transfers came back full, short or timed out are used.
+# Completion latency is not - it is bounded by the timeout the
+# tuner itself sets. Sizes are kept to powers of two times 64
+# bytes.
+# ------------------------------------------------------------
+class StreamTuner:
+
+	def __init__(self, stream, goal=TUNE_THROUGHPUT, latency_ms=TUNE_LATENCY_MS,
+					min_size=TUNE_MIN_SIZE, max_size=None, min_depth=TUNE_MIN_DEPTH,
+					max_depth=TUNE_MAX_DEPTH, interval=TUNE_INTERVAL):
+		if goal not in (TUNE_THROUGHPUT, TUNE_LATENCY):
+			raise ValueError(f'unknown goal {goal}')
+
+		self.stream = stream
+		self.goal = goal
+		self.latency_ms = latency_ms
+		self.min_size = min_size
+		self.max_size = min(max_size or stream.ring.slot_size, stream.ring.slot_size)
+		self.min_depth = min_depth
+		self.max_depth = max_depth
+		self.interval = interval
+
+		# observations
+		self.rate = 0.0					# smoothed B/S
+		self.adjustments = 0
+		self._full = 0
+		self._short = 0					# ended early by a short packet
+		self._timed_out = 0
+		self._bytes = stream.bytes_received
+		self._last = time.perf_counter()
+
+		if stream.metrics is None:
+			stream.metrics = BridgeMetrics()
+		stream.metrics.add_hook(self._on_transfer)
+		self._after_poll = stream.after_poll
+		stream.after_poll = self._poll
+
+	def detach(self):
+		self.stream.metrics.remove_hook(self._on_transfer)
+		self.stream.after_poll = self._after_poll
+
+	# --------------------------------------
+	# completion observer (BridgeMetrics hook)
+	# --------------------------------------
+	def _on_transfer(self, endpoint, r, requested, n, ns):
+		if endpoint != self.stream.endpoint:
+			return
+		if r == usb.LIBUSB_ERROR_TIMEOUT:
+			self._timed_out += 1
+		elif n >= requested:
+			self._full += 1
+		else:
+			self._short += 1
+
+	def _poll(self):
+		if self._after_poll is not None:
+			self._after_poll()
+		now = time.perf_counter()
+		if now - self._last >= self.interval:
+			self.update(now)
+
+	# --------------------------------------
+	# one adjustment step
+	# --------------------------------------
+	def update(self, now=None):
+		now = time.perf_counter() if now is None else now
+		dt = now - self._last
+		received = self.stream.bytes_received
+		sample = (received - self._bytes) / dt if dt > 0 else 0.0
+		self.rate += TUNE_SMOOTHING * (sample - self.rate)
+
+		if self.goal == TUNE_THROUGHPUT:
+			size, depth, timeout = self._throughput()
+		else:
+			size, depth, timeout = self._latency()
+
+		s = self.stream
+		if (size, depth, timeout) != (s.transfer_size, s.num_transfers, s.timeout):
+			self.adjustments += 1
+			s.resize(transfer_size=size, num_transfers=depth, timeout=timeout)
+
+		self._bytes = received
+		self._last = now
+		self._full = self._short = self._timed_out = 0
+
+	def _throughput(self):
+		size = self.stream.transfer_size
+		done = self._full + self._short + self._timed_out
+		if done:
+			if self._full / done >= TUNE_FULL:
+				size *= 2
+			elif self._short / done >= TUNE_SHORT:
+				size //= 2
+		size = self._clamp_size(size)
+
+		if self.rate < TUNE_MIN_RATE:
+			# idle - keep the queue short and stop waking up
+			return size, self.min_depth, TUNE_MAX_TIMEOUT
+
+		depth = self._clamp_depth(math.ceil(self.rate * TUNE_BUFFER_TIME / size) + 1)
+		fill_ms = depth * size / self.rate * 1000
+		return size, depth, self._clamp_timeout(TUNE_FILL_MARGIN * fill_ms)
+
+	def _latency(self):
+		budget = self.latency_ms
+		rate = max(self.rate, TUNE_MIN_RATE)
+		size = self._clamp_size(rate * budget / 2000)
+		depth = math.ceil(rate * budget / 1000 / size) + 1
+		return size, self._clamp_depth(depth), self._clamp_timeout(budget / 2)
+
+	def _clamp_size(self, size):
+		size = max(self.min_size, min(self.max_size, int(size)))
+		# largest power of two multiple of a packet not above 'size'
+		packets = max(1, size // USB_PACKET_SIZE)
+		return min(self.max_size, USB_PACKET_SIZE << (packets.bit_length() - 1))
+
+	def _clamp_depth(self, depth):
+		return max(self.min_depth, min(self.max_depth, depth))
+
+	def _clamp_timeout(self, ms):
+		return int(max(TUNE_MIN_TIMEOUT, min(TUNE_MAX_TIMEOUT, math.ceil(ms))))
+
+	def stats(self):
+		s = self.stream
+		return {
+			'goal': self.goal,
+			'kB/s': round(self.rate / 1000, 2),
+			'transfer_size': s.transfer_size,
+			'num_transfers': s.num_transfers,
+			'timeout_ms': s.timeout,
+			'adjustments': self.adjustments,
+		}
+
+
+# ------------------------------------------------------------
+# Description: AdaptiveTimeout
+# ------------------------------------------------------------
+# Timeout for blocking transfers learned from completed ones.
+# Each sample is normalised to time per 64 byte packet; the
+# smoothed value and mean deviation give
+#
+#   timeout(n) = packets(n) * (srtt + 4 * rttvar) + margin_ms
+#
+# clamped to [lo, hi]. A timed out transfer doubles the estimate
+# (backoff) so one stall does not cause a run of failures.
+#
+#   out_timeout = AdaptiveTimeout()
+#   metrics.add_hook(out_timeout.hook(0x03))
+#   metrics.bulk_transfer(h, 0x03, buf, n, ct.byref(x), out_timeout.timeout(n))
+# ------------------------------------------------------------
+class AdaptiveTimeout:
+
+	def __init__(self, initial=EP2OUT_TIMEOUT, lo=TUNE_MIN_TIMEOUT, hi=EP2IN_TIMEOUT,
+					margin_ms=TUNE_MIN_TIMEOUT):
+		self.lo = lo
+		self.hi = hi
+		self.margin_ms = margin_ms
+		self.initial = initial
+		self.srtt = None				# mS per packet
+		self.rttvar = 0.0
+
+	def update(self, ms, nbytes):
+		per = ms / max(1, -(-nbytes // USB_PACKET_SIZE))
+		if self.srtt is None:
+			self.srtt = per
+			self.rttvar = per / 2
+		else:
+			self.rttvar += 0.25 * (abs(self.srtt - per) - self.rttvar)
+			self.srtt += 0.125 * (per - self.srtt)
+
+	def backoff(self):
+		if self.srtt is not None:
+			self.srtt *= 2
+
+	def timeout(self, nbytes=USB_PACKET_SIZE):
+		if self.srtt is None:
+			return self.initial
+		packets = max(1, -(-nbytes // USB_PACKET_SIZE))
+		ms = packets * (self.srtt + 4 * self.rttvar) + self.margin_ms
+		return int(max(self.lo, min(self.hi, math.ceil(ms))))
+
+	# --------------------------------------
+	# BridgeMetrics hook feeding this
+	# estimator from one endpoint
+	# --------------------------------------
+	def hook(self, endpoint):
+		def on_transfer(ep, r, requested, n, ns):
+			if ep != endpoint:
+				return
+			if r == 0:
+				self.update(ns / 1e6, n)
+			elif r == usb.LIBUSB_ERROR_TIMEOUT:
+				self.backoff()
+		return on_transfer
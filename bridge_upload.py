@@ -0,0 +1,320 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - BULK2 OUT block upload
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tutorials only ever write one 64 byte packet (EP2OUT_SIZE)
+# per blocking bulk_transfer() call. Sending a multi megabyte
+# firmware image or waveform table that way costs a round trip
+# per packet and never gets near the bus rate.
+#
+# BulkUpload sends any buffer protocol object (bytes, bytearray,
+# memoryview, mmap, NumPy arrays, ctypes arrays) on BULK2 OUT as
+# large multi packet asynchronous transfers, several of them in
+# flight at once. Every transfer points straight into the
+# caller's buffer at its offset, so nothing is sliced or copied
+# (see _buffer_address for the one exception).
+#
+# With 'ack' the upload ends with an echo packet (opcode 10d)
+# carrying a block tag. The embedded system handles packets in
+# order, so the tag coming back on BULK2 IN confirms the whole
+# block was consumed, not just accepted by the bridge.
+#
+# The data is sent as is. Framing it for the embedded side's
+# packet protocol (byte[0] is read as an opcode) is up to the
+# caller.
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import ctypes as ct
+import struct
+import time
+from bridge_backend import usb
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, EP2OUT_TIMEOUT,
+							EP2IN_TIMEOUT, USB_PACKET_SIZE, OPCODE_ECHO)
+from bridge_stream import STREAM_POLL_TIMEOUT, STATUS_CODES
+
+
+#
+# Definitions
+#
+UPLOAD_XFER_SIZE = USB_PACKET_SIZE*256	# bytes per transfer (~25mS of bus time)
+UPLOAD_XFER_COUNT = 4					# transfers kept in flight
+UPLOAD_MIN_RATE = 100					# kB/S assumed when sizing timeouts
+UPLOAD_ACK_MAGIC = b'UPLD'
+UPLOAD_ACK = struct.Struct('<B4sI')		# opcode, magic, block number
+UPLOAD_ACK_READS = 256					# IN packets skipped looking for the ack at most
+
+
+# ------------------------------------------------------------
+# Description: _buffer_address
+# ------------------------------------------------------------
+# Address of the first byte of a contiguous buffer plus the
+# object that has to stay alive while libusb uses it. Writable
+# buffers are mapped with ctypes from_buffer(), bytes through
+# c_char_p and other read only buffers through NumPy. Without
+# NumPy a read only buffer that is not bytes is copied once.
+# ------------------------------------------------------------
+def _buffer_address(data):
+	view = memoryview(data)
+	if not view.contiguous:
+		raise ValueError('upload buffer must be contiguous')
+	view = view.cast('B')
+	n = len(view)
+	if n == 0:
+		return 0, None, False
+	if not view.readonly:
+		keep = (ct.c_ubyte*n).from_buffer(view)
+		return ct.addressof(keep), keep, False
+	if type(data) is bytes:
+		keep = ct.c_char_p(data)
+		return ct.cast(keep, ct.c_void_p).value, (keep, data), False
+	if np is not None:
+		keep = np.frombuffer(view, dtype=np.uint8)
+		return keep.ctypes.data, keep, False
+	keep = (ct.c_ubyte*n).from_buffer_copy(view)
+	return ct.addressof(keep), keep, True
+
+
+# ------------------------------------------------------------
+# Description: BulkUpload
+# ------------------------------------------------------------
+# Sends blocks on BULK2 OUT (0x03) with 'num_transfers'
+# asynchronous transfers of up to 'transfer_size' bytes in
+# flight:
+#
+#   with BulkUpload(session.dev_handle, ctx=session.ctx) as up:
+#       r = up.upload(open('image.bin', 'rb').read(), ack=True)
+#       if r < 0:
+#           print(f'failed after {up.sent} bytes')
+#
+# upload() returns 0 or the first libusb error, with 'sent'
+# holding the bytes the bridge accepted in order before it. A
+# transfer's timeout is sized from its length so large transfers
+# are not cut short. Events are handled on the calling thread.
+#
+# 'ack' may be True (echo tag on BULK2 IN, see above; nothing
+# else may be reading BULK2 IN meanwhile) or a function
+# ack(dev_handle) returning a libusb code for a device specific
+# acknowledgement. 'metrics' (a bridge_metrics.BridgeMetrics)
+# records every transfer.
+# ------------------------------------------------------------
+class BulkUpload:
+
+	def __init__(self, dev_handle, ctx=None, endpoint=ENDPOINT_BLK2_OUT,
+					transfer_size=UPLOAD_XFER_SIZE, num_transfers=UPLOAD_XFER_COUNT,
+					timeout=EP2OUT_TIMEOUT, ack_timeout=EP2IN_TIMEOUT, metrics=None):
+		if transfer_size % USB_PACKET_SIZE:
+			raise ValueError(f'transfer size must be a multiple of {USB_PACKET_SIZE}')
+		self.dev_handle = dev_handle
+		self.ctx = ctx
+		self.endpoint = endpoint
+		self.transfer_size = transfer_size
+		self.num_transfers = num_transfers
+		self.timeout = timeout
+		self.ack_timeout = ack_timeout
+		self.metrics = metrics
+
+		# statistics
+		self.sent = 0					# bytes of the last upload
+		self.bytes_sent = 0
+		self.uploads = 0
+		self.transfers = 0
+		self.copies = 0					# read only buffers that had to be copied
+		self.rate = 0.0					# B/S of the last upload
+
+		self._transfers = []
+		self._index = {}
+		self._submitted = []
+		self._length = []
+		self._in_flight = 0
+		self._block = 0
+		self._keep = None				# caller's buffer while transfers use it
+		self._cb = usb.transfer_cb_fn(self._on_complete)
+
+	def __enter__(self):
+		r = self.open()
+		if r < 0:
+			raise RuntimeError(f'upload start failure: {r} - {usb.strerror(r)}')
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close()
+		return False
+
+	def open(self):
+		while len(self._transfers) < self.num_transfers:
+			xfer = usb.alloc_transfer(0)
+			if not xfer:
+				return usb.LIBUSB_ERROR_NO_MEM
+			self._index[ct.addressof(xfer.contents)] = len(self._transfers)
+			self._transfers.append(xfer)
+			self._submitted.append(0)
+			self._length.append(0)
+		return 0
+
+	def close(self):
+		if self._in_flight > 0:
+			# libusb still owns these - leaking beats a use after free
+			return
+		for xfer in self._transfers:
+			usb.free_transfer(xfer)
+		self._transfers = []
+		self._index = {}
+		self._submitted = []
+		self._length = []
+
+	# --------------------------------------
+	# send one block
+	# --------------------------------------
+	def upload(self, data, ack=None):
+		r = self.open()
+		if r < 0:
+			return r
+		addr, self._keep, copied = _buffer_address(data)
+		self.copies += copied
+		total = len(memoryview(data).cast('B')) if addr else 0
+
+		self.sent = 0
+		self._addr = addr
+		self._total = total
+		self._offset = 0
+		self._error = 0
+		self._done = 0
+		t0 = time.perf_counter()
+
+		for i in range(len(self._transfers)):
+			if self._offset >= total:
+				break
+			r = self._submit(i)
+			if r < 0:
+				self._error = r
+				break
+
+		while self._in_flight > 0:
+			tv = usb.timeval(STREAM_POLL_TIMEOUT // 1000, (STREAM_POLL_TIMEOUT % 1000) * 1000)
+			r = usb.handle_events_timeout_completed(self.ctx, ct.byref(tv), None)
+			if r < 0 and r != usb.LIBUSB_ERROR_INTERRUPTED:
+				self._error = self._error or r
+				self._cancel()
+				break
+		if self._in_flight == 0:
+			self._keep = None
+
+		self.sent = self._done
+		self.bytes_sent += self._done
+		self.uploads += 1
+		dt = time.perf_counter() - t0
+		self.rate = self._done / dt if dt > 0 else 0.0
+
+		if self._error < 0:
+			return self._error
+		if ack is True:
+			return self._echo_ack()
+		if ack:
+			return ack(self.dev_handle)
+		return 0
+
+	def _submit(self, i):
+		n = min(self.transfer_size, self._total - self._offset)
+		timeout = self.timeout
+		if timeout:
+			timeout = max(timeout, n // UPLOAD_MIN_RATE)
+		xfer = self._transfers[i]
+		usb.fill_bulk_transfer(xfer, self.dev_handle, self.endpoint,
+								ct.cast(ct.c_void_p(self._addr + self._offset), ct.POINTER(ct.c_ubyte)), n, self._cb, None, timeout)
+		r = usb.submit_transfer(xfer)
+		if r == 0:
+			self._in_flight += 1
+			self._length[i] = n
+			self._offset += n
+			if self.metrics is not None:
+				self._submitted[i] = self.metrics.clock()
+		return r
+
+	def _cancel(self):
+		for xfer in self._transfers:
+			usb.cancel_transfer(xfer)
+
+	# --------------------------------------
+	# transfer completion callback - OUT
+	# transfers on one endpoint complete in
+	# submission order
+	# --------------------------------------
+	def _on_complete(self, xfer):
+		self._in_flight -= 1
+		i = self._index[ct.addressof(xfer.contents)]
+		status = xfer.contents.status
+		n = xfer.contents.actual_length
+		code = STATUS_CODES.get(status, usb.LIBUSB_ERROR_IO)
+
+		if status == usb.LIBUSB_TRANSFER_CANCELLED:
+			return
+		if self.metrics is not None and self._submitted[i]:
+			self.metrics.record(self.endpoint, code, self._length[i], n,
+								self.metrics.clock() - self._submitted[i])
+		self.transfers += 1
+
+		if self._error < 0:
+			return
+		self._done += n
+		if code < 0 or n < self._length[i]:
+			self._error = code if code < 0 else usb.LIBUSB_ERROR_IO
+			self._cancel()
+		elif self._offset < self._total:
+			r = self._submit(i)
+			if r < 0:
+				self._error = r
+				self._cancel()
+
+	# --------------------------------------
+	# end of block acknowledgement through
+	# the embedded echo
+	# --------------------------------------
+	def _echo_ack(self):
+		self._block = (self._block + 1) & 0xffffffff
+		pkt = (ct.c_ubyte*USB_PACKET_SIZE)()
+		UPLOAD_ACK.pack_into(pkt, 0, OPCODE_ECHO, UPLOAD_ACK_MAGIC, self._block)
+		transferred = ct.c_int(0)
+		r = usb.bulk_transfer(self.dev_handle, self.endpoint, pkt, USB_PACKET_SIZE,
+								ct.byref(transferred), self.timeout)
+		if r < 0:
+			return r
+
+		expect = bytes(pkt[:UPLOAD_ACK.size])
+		rx = (ct.c_ubyte*USB_PACKET_SIZE)()
+		for i in range(UPLOAD_ACK_READS):
+			r = usb.bulk_transfer(self.dev_handle, ENDPOINT_BLK2_IN, rx, USB_PACKET_SIZE,
+									ct.byref(transferred), self.ack_timeout)
+			if r < 0:
+				return r
+			if bytes(rx[:UPLOAD_ACK.size]) == expect:
+				return 0
+		return usb.LIBUSB_ERROR_IO
+
+	def stats(self):
+		return {
+			'uploads': self.uploads,
+			'bytes': self.bytes_sent,
+			'transfers': self.transfers,
+			'copies': self.copies,
+			'kB/s': round(self.rate / 1000, 2),
+		}
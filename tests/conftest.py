@@ -0,0 +1,77 @@
+# ################################################################
+#
+# Project Name:
+# USB Bridge - Test fixtures
+#
+# Project Description:
+# ----------------------------------------------------------------
+# The tests run every module against bridge_sim, so no bridge
+# hardware or libusb is needed:
+#
+#   python -m pytest -q tests
+#
+# BRIDGE_BACKEND is forced to 'sim' before any bridge_* module is
+# imported. Each test starts from an empty simulator with one
+# bridge attached ('sim_bridge') and an empty session path cache,
+# optionally opened as a BridgeSession ('session').
+#
+# ----------------------------------------------------------------
+# Disclaimer:
+# ----------------------------------------------------------------
+# This library is provided strictly as example code. There is no
+# expected reliablity of operation from RisingEdgeIndustries and
+# this source code is not to be sold or represented as a 3'd party
+# solution for commercial use. The below code is development code
+# for example use only supporting customers as they test the bridge
+# products from RisingEdgeIndustries. No code below is released with
+# the intention or expectation of reliable operation.
+# ################################################################
+
+import os
+import sys
+
+os.environ['BRIDGE_BACKEND'] = 'sim'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ctypes as ct
+import pytest
+
+import bridge_session
+import bridge_sim
+from bridge_backend import usb
+from bridge_defs import USB_PACKET_SIZE, OPCODE_BURST_8K, ENDPOINT_BLK2_OUT
+
+
+@pytest.fixture
+def sim_bridge():
+	# the session path cache would point at the last test's bridge
+	bridge_session._path_cache.clear()
+	bridge_sim.reset()
+	bridge = bridge_sim.add_bridge(latency=0.0002, jitter=0.0)
+	yield bridge
+	bridge_sim.reset()
+	bridge_session._path_cache.clear()
+
+@pytest.fixture
+def session(sim_bridge):
+	with bridge_session.BridgeSession() as s:
+		yield s
+
+
+# ------------------------------------------------------------
+# Description: helpers
+# ------------------------------------------------------------
+def packet(opcode, payload=b''):
+	pkt = (ct.c_ubyte*USB_PACKET_SIZE)()
+	pkt[0] = opcode
+	for i, b in enumerate(payload):
+		pkt[1 + i] = b
+	return pkt
+
+def request_bursts(session, count):
+	# ask the emulator for 'count' 8k bursts in one OUT transfer
+	data = bytes(packet(OPCODE_BURST_8K)) * count
+	buf = (ct.c_ubyte*len(data)).from_buffer_copy(data)
+	n = ct.c_int(0)
+	return usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, buf, len(data),
+								ct.byref(n), 1000 + 20 * count)
@@ -0,0 +1,62 @@
+import asyncio
+
+import bridge_sim
+from bridge_aio import AsyncBridge
+from bridge_defs import OPCODE_ECHO
+
+
+def test_echo_round_trip(session):
+	async def main():
+		async with AsyncBridge(session.dev_handle, session.ctx) as bridge:
+			return await bridge.transact(OPCODE_ECHO, b'\x01\x02\x03')
+	data = asyncio.run(main())
+	assert data[:4] == bytes([OPCODE_ECHO, 1, 2, 3])
+
+
+def test_cancelled_read_cancels_transfer(session):
+	async def main():
+		async with AsyncBridge(session.dev_handle, session.ctx) as bridge:
+			task = asyncio.ensure_future(bridge.read(timeout=0))
+			await asyncio.sleep(0.05)
+			assert len(bridge._pending) == 1
+			task.cancel()
+			await asyncio.gather(task, return_exceptions=True)
+			for i in range(100):
+				if not bridge._pending:
+					break
+				await asyncio.sleep(0.01)
+			return len(bridge._pending)
+	assert asyncio.run(main()) == 0
+	assert not bridge_sim._in_flight
+
+
+def test_close_cancels_outstanding_reads(session):
+	async def main():
+		bridge = AsyncBridge(session.dev_handle, session.ctx)
+		bridge.open()
+		tasks = [asyncio.ensure_future(bridge.read(timeout=0)) for i in range(4)]
+		await asyncio.sleep(0.05)
+		bridge.close()
+		results = await asyncio.gather(*tasks, return_exceptions=True)
+		return bridge, results
+	bridge, results = asyncio.run(main())
+	assert all(isinstance(r, asyncio.CancelledError) for r in results)
+	assert not bridge._pending
+	assert bridge._free == []
+	assert not bridge_sim._in_flight
+
+
+def test_close_after_device_loss(session, sim_bridge):
+	async def main():
+		bridge = AsyncBridge(session.dev_handle, session.ctx)
+		bridge.open()
+		task = asyncio.ensure_future(bridge.read(timeout=0))
+		await asyncio.sleep(0.05)
+		sim_bridge.unplug()
+		result = await asyncio.gather(task, return_exceptions=True)
+		bridge.close()
+		return bridge, result[0]
+	bridge, result = asyncio.run(main())
+	assert isinstance(result, RuntimeError)
+	assert not bridge._pending
+	assert bridge._free == []
@@ -0,0 +1,31 @@
+import pytest
+
+from bridge_bench import bench_read, bench_echo
+
+
+def test_bench_read_measures_and_releases_stream(session):
+	res = bench_read(session, 8192, 4, total=64 * 1024, reps=2, warmup=1)
+	assert res['bytes'] == 2 * 64 * 1024
+	assert res['MB/s'] > 0
+	assert session._streams == []
+
+
+def test_lost_burst_fails_the_rep(session, sim_bridge):
+	# every other burst request is lost on the way
+	emulate = sim_bridge.emulate
+	calls = [0]
+
+	def lossy(endpoint, in_ep, pkt, now):
+		calls[0] += 1
+		if calls[0] % 2:
+			emulate(endpoint, in_ep, pkt, now)
+	sim_bridge.emulate = lossy
+
+	with pytest.raises(RuntimeError, match='read timeout'):
+		bench_read(session, 8192, 4, total=64 * 1024, reps=1, warmup=0, rep_timeout=0.5)
+	assert session._streams == []
+
+
+def test_bench_echo(session):
+	res = bench_echo(session, reps=20, warmup=2)
+	assert res['p50_us'] > 0
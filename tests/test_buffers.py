@@ -0,0 +1,45 @@
+import time
+
+from bridge_buffers import BufferRing
+from bridge_defs import BURST_8K_SIZE
+from bridge_stream import BulkStream
+
+from conftest import request_bursts
+
+
+def test_slot_life_cycle():
+	ring = BufferRing(16, 2)
+	a, b = ring.acquire(), ring.acquire()
+	assert ring.acquire() == -1
+	ring.buffers[b][:3] = [1, 2, 3]
+	ring.commit(b, 3)
+	ring.commit(a, 0)
+	assert len(ring) == 2
+	slot, view = ring.get()
+	assert (slot, bytes(view)) == (b, b'\x01\x02\x03')
+	ring.release(slot)
+	assert ring.free_slots() == 1
+	assert ring.get()[0] == a
+	assert ring.get() is None
+
+
+def test_held_slots_park_reads_until_released(session):
+	ring = BufferRing(BURST_8K_SIZE, 2)
+	assert request_bursts(session, 6) == 0
+	with BulkStream(session.dev_handle, ctx=session.ctx, ring=ring, num_transfers=2) as stream:
+		end = time.perf_counter() + 2.0
+		while not stream._parked and time.perf_counter() < end:
+			stream.poll(10)
+		# no free slot to read into, so the completed read waits
+		assert len(ring) >= 1 and ring.free_slots() == 0
+		assert stream._parked
+		got = 0
+		end = time.perf_counter() + 5.0
+		while got < 6 * BURST_8K_SIZE and time.perf_counter() < end:
+			item = ring.get()
+			if item is None:
+				stream.poll(10)
+				continue
+			got += len(item[1])
+			stream.release(item[0])
+	assert got == 6 * BURST_8K_SIZE
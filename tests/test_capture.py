@@ -0,0 +1,57 @@
+import os
+
+import bridge_sim
+from bridge_capture import BulkCapture
+from bridge_defs import BURST_8K_SIZE
+from bridge_integrity import IntegrityChecker
+
+from conftest import request_bursts
+
+
+def captured(cap):
+	data = b''
+	for path, length in cap.segments:
+		with open(path, 'rb') as f:
+			data += f.read()
+		assert os.path.getsize(path) == length
+	return data
+
+
+def test_capture_across_segments(session, tmp_path):
+	cap = BulkCapture(session.dev_handle, str(tmp_path / 'run'), ctx=session.ctx,
+						segment_size=4 * BURST_8K_SIZE, timeout=200)
+	assert cap.start() == 0
+	assert request_bursts(session, 10) == 0
+	assert cap.run(nbytes=10 * BURST_8K_SIZE, seconds=5.0) == 10 * BURST_8K_SIZE
+	cap.stop()
+	assert len(cap.segments) == 3
+	checker = IntegrityChecker()
+	checker.check(captured(cap))
+	assert checker.ok and checker.bytes == 10 * BURST_8K_SIZE
+
+
+def test_short_transfers_leave_no_gaps(session, tmp_path):
+	# reads larger than a burst end short on the timeout
+	cap = BulkCapture(session.dev_handle, str(tmp_path / 'short'), ctx=session.ctx,
+						transfer_size=3 * BURST_8K_SIZE, num_transfers=4, timeout=10)
+	assert cap.start() == 0
+	for i in range(5):
+		assert request_bursts(session, 1) == 0
+		cap.run(seconds=0.03)
+	cap.stop()
+	assert cap.timeouts > 0
+	checker = IntegrityChecker()
+	checker.check(captured(cap))
+	assert checker.ok and checker.bytes == 5 * BURST_8K_SIZE
+
+
+def test_stop_after_device_loss(session, sim_bridge, tmp_path):
+	cap = BulkCapture(session.dev_handle, str(tmp_path / 'lost'), ctx=session.ctx)
+	assert cap.start() == 0
+	sim_bridge.unplug()
+	cap.run(seconds=2.0)
+	assert not cap.running and cap.error < 0
+	cap.stop()
+	assert cap._transfers == []
+	assert not bridge_sim._in_flight
+	assert os.listdir(tmp_path) == []
@@ -0,0 +1,70 @@
+import struct
+import zlib
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bridge_decode import (packet_dtype, records, packets, verify_burst, crc16_packets,
+							verify_crc16, crc32)
+from bridge_defs import BURST_8K_SIZE, BURST_DATA_OFFSET, USB_PACKET_SIZE
+from bridge_sim import SimBridge
+
+
+def bursts(count):
+	sim = SimBridge()
+	return b''.join(sim.burst() for i in range(count))
+
+
+def test_clean_bursts_verify():
+	data = bursts(2)
+	res = verify_burst(data, expected_seq=0)
+	assert res['packets'] == 2 * BURST_8K_SIZE // USB_PACKET_SIZE
+	assert (res['bad_opcode'], res['bad_pattern'], res['seq_errors'], res['first_bad']) == (0, 0, 0, -1)
+	assert res['next_seq'] == res['packets']
+
+
+def test_corrupted_counter_byte_is_reported():
+	data = bytearray(bursts(1))
+	data[5 * USB_PACKET_SIZE + BURST_DATA_OFFSET + 7] ^= 0xff
+	res = verify_burst(data, expected_seq=0)
+	assert res['bad_pattern'] == 1
+	assert res['seq_errors'] == 0
+	assert res['first_bad'] == 5
+
+
+def test_crc16_known_vector():
+	pkt = b'123456789'.ljust(USB_PACKET_SIZE, b'\0')
+	assert list(crc16_packets(pkt, 0, 9)) == [0x29b1]
+
+
+def test_verify_crc16_reports_mismatch():
+	rows = []
+	for i in range(4):
+		body = bytes([i]) * (USB_PACKET_SIZE - 2)
+		crc = int(crc16_packets(body + b'\0\0', 0, USB_PACKET_SIZE - 2)[0])
+		rows.append(body + struct.pack('<H', crc))
+	data = bytearray(b''.join(rows))
+	assert len(verify_crc16(data)) == 0
+	data[2 * USB_PACKET_SIZE + 10] ^= 1
+	assert list(verify_crc16(data)) == [2]
+
+
+def test_records_round_trip():
+	dtype = packet_dtype([('opcode', 'u1', 0), ('value', '<u4', 4)])
+	rec = np.zeros(3, dtype=dtype)
+	rec['opcode'] = 12
+	rec['value'] = [1, 70000, 0xdeadbeef]
+	data = rec.tobytes()
+	assert len(data) == 3 * USB_PACKET_SIZE
+	back = records(data + b'\x0c', dtype)			# partial trailing packet ignored
+	assert list(back['value']) == [1, 70000, 0xdeadbeef]
+	assert packets(data).shape == (3, USB_PACKET_SIZE)
+	assert struct.unpack_from('<I', data, USB_PACKET_SIZE + 4)[0] == 70000
+
+
+def test_crc32_matches_zlib_across_buffers():
+	data = bursts(1)
+	half = len(data) // 2
+	assert crc32(data) == zlib.crc32(data)
+	assert crc32(memoryview(data)[half:], crc32(data[:half])) == zlib.crc32(data)
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+import bridge_sim
+from bridge_defs import USB_PACKET_SIZE, OPCODE_ECHO
+from bridge_duplex import DuplexChannel
+
+
+def test_unaligned_messages_each_start_a_packet(session):
+	count = 50
+	sent = threading.Event()
+	results = []
+
+	def done(r, n):
+		results.append((r, n))
+		if len(results) == count:
+			sent.set()
+
+	replies = b''
+	with DuplexChannel(session.dev_handle, session.ctx, out_transfer_size=USB_PACKET_SIZE*4) as chan:
+		for i in range(count):
+			assert chan.send(bytes([OPCODE_ECHO, i, 0x5a]), callback=done)
+		end = time.perf_counter() + 5.0
+		while len(replies) < count * USB_PACKET_SIZE and time.perf_counter() < end:
+			item = chan.get(timeout=0.1)
+			if item is not None:
+				slot, data = item
+				replies += bytes(data)
+				chan.release(slot)
+		assert sent.wait(1.0)
+	assert results == [(0, 3)] * count
+	for i in range(count):
+		pkt = replies[i * USB_PACKET_SIZE:(i + 1) * USB_PACKET_SIZE]
+		assert pkt[:3] == bytes([OPCODE_ECHO, i, 0x5a])
+	assert chan.stats()['out_bytes'] == count * USB_PACKET_SIZE
+
+
+def test_out_transfer_size_must_be_whole_packets(session):
+	with pytest.raises(ValueError):
+		DuplexChannel(session.dev_handle, session.ctx, out_transfer_size=100)
+
+
+def test_stop_after_device_loss(session, sim_bridge):
+	chan = DuplexChannel(session.dev_handle, session.ctx)
+	assert chan.start() == 0
+	sim_bridge.unplug()
+	end = time.perf_counter() + 2.0
+	while chan.running and time.perf_counter() < end:
+		time.sleep(0.01)
+	assert not chan.running
+	assert chan.error < 0
+	chan.stop()
+	assert chan._thread is None
+	assert chan._transfers == []
+	assert chan.stream._transfers == []
+	assert not bridge_sim._in_flight
@@ -0,0 +1,90 @@
+import ctypes as ct
+import time
+
+import pytest
+
+import bridge_sim
+from bridge_backend import usb
+from bridge_defs import ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, USB_PACKET_SIZE, OPCODE_ECHO
+from bridge_events import EventThread
+from bridge_metrics import ref_value
+
+
+def pointer_int():
+	p = ct.POINTER(ct.c_int)()
+	p.contents = ct.c_int(0)
+	return p
+
+
+def wait_for(cond, seconds=2.0):
+	end = time.perf_counter() + seconds
+	while not cond() and time.perf_counter() < end:
+		time.sleep(0.01)
+	return cond()
+
+
+@pytest.mark.parametrize('make_ref', [lambda: ct.byref(ct.c_int(0)), pointer_int],
+							ids=['byref', 'pointer'])
+def test_blocking_echo_sets_transferred(session, make_ref):
+	tx = (ct.c_ubyte*USB_PACKET_SIZE)(OPCODE_ECHO, 4, 5)
+	rx = (ct.c_ubyte*USB_PACKET_SIZE)()
+	with EventThread(session.ctx) as ev:
+		out, got = make_ref(), make_ref()
+		assert ev.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, tx, len(tx), out, 1000) == 0
+		assert ev.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), got, 1000) == 0
+	assert ref_value(out) == ref_value(got) == USB_PACKET_SIZE
+	assert bytes(rx[:3]) == bytes([OPCODE_ECHO, 4, 5])
+
+
+def test_submit_and_complete(session):
+	with EventThread(session.ctx) as ev:
+		assert ev.submit(session.dev_handle, ENDPOINT_BLK2_OUT, bytes([OPCODE_ECHO, 7]), tag='out') == 0
+		assert ev.submit(session.dev_handle, ENDPOINT_BLK2_IN, length=USB_PACKET_SIZE, tag='in') == 0
+		got = {}
+		while len(got) < 2:
+			c = ev.completions.get(timeout=1.0)
+			assert c is not None
+			got[c.tag] = c
+	assert got['out'].r == got['in'].r == 0
+	assert got['in'].data[:2] == bytes([OPCODE_ECHO, 7])
+
+
+def test_stop_after_device_loss(session, sim_bridge):
+	ev = EventThread(session.ctx, poll_ms=10)
+	assert ev.start() == 0
+	assert ev.submit(session.dev_handle, ENDPOINT_BLK2_IN, length=USB_PACKET_SIZE, tag=1) == 0
+	sim_bridge.unplug()
+	c = ev.completions.get(timeout=2.0)
+	assert c is not None and c.r < 0
+	ev.stop()
+	assert ev._thread is None
+	assert ev._free == []
+	assert not bridge_sim._in_flight
+
+
+def test_stop_and_submit_after_the_thread_dies(session, monkeypatch):
+	ev = EventThread(session.ctx, poll_ms=10)
+	assert ev.start() == 0
+	assert ev.submit(session.dev_handle, ENDPOINT_BLK2_IN, length=USB_PACKET_SIZE, timeout=0) == 0
+
+	handle_events = usb.handle_events_timeout_completed
+	failed = []
+
+	def fail_once(ctx, tv, completed):
+		if not failed:
+			failed.append(True)
+			return usb.LIBUSB_ERROR_IO
+		return handle_events(ctx, tv, completed)
+	monkeypatch.setattr(usb, 'handle_events_timeout_completed', fail_once)
+
+	assert wait_for(lambda: not ev._thread.is_alive())
+	assert not ev.running
+	assert ev.error == usb.LIBUSB_ERROR_IO
+	assert ev.submit(session.dev_handle, ENDPOINT_BLK2_OUT, bytes([OPCODE_ECHO])) == usb.LIBUSB_ERROR_IO
+	assert len(ev._pending) == 1
+
+	ev.stop()
+	assert ev._thread is None
+	assert ev._pending == {}
+	assert ev._free == []
+	assert not bridge_sim._in_flight
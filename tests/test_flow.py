@@ -0,0 +1,137 @@
+import time
+
+import pytest
+
+import bridge_sim
+from bridge_defs import BURST_8K_SIZE
+from bridge_flow import FlowQueue, FlowReader, Throttle, FLOW_BLOCK, FLOW_DROP_OLDEST, FLOW_SPILL
+from bridge_integrity import IntegrityChecker
+
+from conftest import request_bursts
+
+BURSTS = 16
+HIGH = 4 * BURST_8K_SIZE
+LOW = BURST_8K_SIZE
+
+
+def chunk(i, n=1000):
+	return bytes([i & 0xff]) * n
+
+
+def test_queue_block_refuses_until_low():
+	q = FlowQueue(high=3000, low=1000, policy=FLOW_BLOCK)
+	assert all(q.put(chunk(i)) for i in range(3))
+	assert not q.put(chunk(3))
+	assert q.refused == 1
+	q.get()
+	assert not q.put(chunk(3))				# still above the low watermark
+	q.get()
+	assert q.put(chunk(3))
+	assert [q.get(0)[0] for i in range(2)] == [2, 3]
+
+
+def test_queue_drop_oldest_keeps_newest():
+	dropped = []
+	q = FlowQueue(high=3000, low=1000, policy=FLOW_DROP_OLDEST, on_drop=dropped.append)
+	for i in range(5):
+		assert q.put(chunk(i))
+	assert q.dropped_buffers == 2
+	assert dropped == [1000, 1000]
+	assert [q.get(0)[0] for i in range(3)] == [2, 3, 4]
+
+
+def test_queue_spill_keeps_order(tmp_path):
+	q = FlowQueue(high=3000, low=1000, policy=FLOW_SPILL, spill_dir=str(tmp_path))
+	for i in range(10):
+		assert q.put(chunk(i))
+	assert q.stats()['spilled'] == 7000
+	assert [q.get(0)[0] for i in range(10)] == list(range(10))
+	assert q.backlog == 0
+
+
+def test_queue_watermark_hooks():
+	events = []
+	q = FlowQueue(high=2000, low=1000, policy=FLOW_SPILL,
+					on_high=lambda: events.append('high'), on_low=lambda: events.append('low'))
+	for i in range(4):
+		q.put(chunk(i))
+	while q.get(0) is not None:
+		pass
+	assert events == ['high', 'low']
+
+
+def fill(reader, total, seconds=5.0):
+	end = time.perf_counter() + seconds
+	while reader.stream.bytes_received < total and time.perf_counter() < end:
+		time.sleep(0.01)
+
+
+def drain(reader, total, seconds=5.0):
+	checker = IntegrityChecker()
+	end = time.perf_counter() + seconds
+	while checker.bytes < total and time.perf_counter() < end:
+		data = reader.get(timeout=0.1)
+		if data is not None:
+			checker.check(data)
+	return checker
+
+
+@pytest.mark.parametrize('policy', [FLOW_BLOCK, FLOW_SPILL])
+def test_reader_lossless_policies(session, policy, tmp_path):
+	total = BURSTS * BURST_8K_SIZE
+	with FlowReader(session.dev_handle, session.ctx, high=HIGH, low=LOW, policy=policy,
+					spill_dir=str(tmp_path), throttle=True) as reader:
+		assert request_bursts(session, BURSTS) == 0
+		fill(reader, total if policy == FLOW_SPILL else HIGH)
+		time.sleep(0.05)
+		checker = drain(reader, total)
+		stats = reader.stats()
+	assert checker.ok
+	assert checker.bytes == total
+	assert stats['pauses'] == stats['resumes'] == stats['high_events']
+	if policy == FLOW_BLOCK:
+		assert stats['refused'] > 0
+	else:
+		assert stats['spilled_total'] > 0
+
+
+def test_reader_drop_oldest(session):
+	total = BURSTS * BURST_8K_SIZE
+	with FlowReader(session.dev_handle, session.ctx, high=HIGH, low=LOW,
+					policy=FLOW_DROP_OLDEST) as reader:
+		assert request_bursts(session, BURSTS) == 0
+		fill(reader, total)
+		stats = reader.stats()
+	assert stats['dropped_bytes'] > 0
+	assert stats['backlog'] <= HIGH
+	assert stats['dropped_bytes'] + stats['backlog'] == total
+
+
+def test_throttle_counts_state_changes(session):
+	throttle = Throttle(session.dev_handle, session.ctx)
+	assert throttle.open() == 0
+	throttle.pause()
+	throttle.pause()
+	throttle.resume()
+	throttle.resume()
+	assert (throttle.pauses, throttle.resumes) == (1, 1)
+	throttle.close()
+
+
+def test_stop_after_device_loss(session, sim_bridge):
+	reader = FlowReader(session.dev_handle, session.ctx, high=HIGH, low=LOW, throttle=True)
+	assert reader.start() == 0
+	reader.throttle.pause()
+	sim_bridge.unplug()
+	end = time.perf_counter() + 2.0
+	while reader.running and time.perf_counter() < end:
+		time.sleep(0.01)
+	assert not reader.running
+	assert reader.error < 0
+	reader.stop()
+	assert reader._thread is None
+	assert reader.stream._transfers == []
+	assert reader.throttle._xfer is None
+	assert not reader.throttle.paused
+	assert reader.get(timeout=0) is None
+	assert not bridge_sim._in_flight
@@ -0,0 +1,70 @@
+import ctypes as ct
+
+import pytest
+
+from bridge_backend import usb
+from bridge_defs import (ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, USB_PACKET_SIZE, OPCODE_ECHO,
+							INT1_INTERFACE, BULK2_INTERFACE)
+from bridge_frames import (Message, SSI_FRAME_SIZE, PAYLOAD_SIZE, encode_packets, decode_packets,
+							encode_frames, decode_frames)
+import bridge_frames
+
+
+def messages(count):
+	return [Message(OPCODE_ECHO, bytes([i, i >> 8, 0xa5])) for i in range(count)]
+
+
+def test_frame_layout_matches_mosi():
+	frame = Message(OPCODE_ECHO, b'\x01', interface=BULK2_INTERFACE).frame()
+	assert len(frame) == SSI_FRAME_SIZE
+	assert frame[:4] == bytes([0x02, 0x00, 0x0a, 0x01])
+	assert Message.from_frame(frame) == Message(OPCODE_ECHO, b'\x01')
+
+
+def test_payload_too_long():
+	with pytest.raises(ValueError):
+		Message(OPCODE_ECHO, bytes(PAYLOAD_SIZE + 1))
+
+
+def test_packet_and_frame_round_trip():
+	msgs = messages(10)
+	data = encode_packets(msgs)
+	assert len(data) == 10 * USB_PACKET_SIZE
+	assert decode_packets(bytes(data) + b'\x0a\x01') == msgs		# partial packet ignored
+
+	frames = encode_frames(data, interface=INT1_INTERFACE)
+	assert len(frames) == 10 * SSI_FRAME_SIZE
+	decoded = decode_frames(frames)
+	assert [iface for iface, pkt in decoded] == [INT1_INTERFACE] * 10
+	assert b''.join(pkt for iface, pkt in decoded) == bytes(data)
+
+
+def test_numpy_conversion_matches_struct():
+	np = pytest.importorskip('numpy')
+	data = encode_packets(messages(8))
+	frames = bridge_frames.packets_to_frames(data, interface=INT1_INTERFACE)
+	assert frames.tobytes() == bytes(encode_frames(data, interface=INT1_INTERFACE))
+
+	view = bridge_frames.frames_array(frames.tobytes())
+	assert list(view['interface']) == [INT1_INTERFACE] * 8
+	assert bridge_frames.frames_to_packets(view).tobytes() == bytes(data)
+	assert len(bridge_frames.frames_to_packets(view, interface=BULK2_INTERFACE)) == 0
+
+	pkts = bridge_frames.packets_array(data)
+	assert np.all(pkts['opcode'] == OPCODE_ECHO)
+	assert list(pkts['payload'][:, 0]) == list(range(8))
+
+
+def test_encoded_echoes_come_back(session):
+	msgs = messages(12)
+	data = encode_packets(msgs)
+	tx = (ct.c_ubyte*len(data)).from_buffer(data)
+	n = ct.c_int(0)
+	assert usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, tx, len(tx), ct.byref(n), 1000) == 0
+
+	rx = (ct.c_ubyte*len(data))()
+	got = b''
+	while len(got) < len(data):
+		assert usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 1000) == 0
+		got += bytes(rx[:n.value])
+	assert decode_packets(got) == msgs
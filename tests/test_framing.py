@@ -0,0 +1,36 @@
+import ctypes as ct
+
+from bridge_backend import usb
+from bridge_defs import ENDPOINT_BLK2_IN, USB_PACKET_SIZE, OPCODE_ECHO, OPCODE_BATCH
+from bridge_framing import BatchWriter, bulk_sink, deframe
+
+
+def test_packets_are_opcode_led_and_deframe():
+	batches = []
+	msgs = [bytes([OPCODE_ECHO, i]) * (1 + i % 20) for i in range(40)]
+	with BatchWriter(lambda buf, n: batches.append(bytes(buf[:n])), max_packets=4) as writer:
+		for m in msgs:
+			writer.send(m)
+	data = b''.join(batches)
+	assert len(data) % USB_PACKET_SIZE == 0
+	assert all(data[i] == OPCODE_BATCH for i in range(0, len(data), USB_PACKET_SIZE))
+	assert [bytes(m) for m in deframe(data)] == msgs
+
+
+def test_batched_echoes_reach_the_emulator(session):
+	with BatchWriter(bulk_sink(session.dev_handle)) as writer:
+		for i in range(20):
+			writer.send(bytes([OPCODE_ECHO, i, 0xa5]))
+	assert writer.error == 0
+	assert writer.packets == 2				# 15 messages of 4 bytes per packet
+
+	rx = (ct.c_ubyte*(20 * USB_PACKET_SIZE))()
+	got = b''
+	n = ct.c_int(0)
+	while len(got) < 20 * USB_PACKET_SIZE:
+		r = usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 1000)
+		assert r == 0
+		got += bytes(rx[:n.value])
+	for i in range(20):
+		pkt = got[i * USB_PACKET_SIZE:(i + 1) * USB_PACKET_SIZE]
+		assert pkt[:3] == bytes([OPCODE_ECHO, i, 0xa5])
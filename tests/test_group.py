@@ -0,0 +1,27 @@
+import collections
+import time
+
+import bridge_sim
+from bridge_defs import BURST_8K_SIZE
+from bridge_session import BridgeGroup
+
+from conftest import request_bursts
+
+
+def test_every_bridge_streams(sim_bridge):
+	for i in range(2):
+		bridge_sim.add_bridge(latency=0.0002, jitter=0.0)
+	got = collections.Counter()
+	with BridgeGroup(callback=lambda session, data: got.update({session.serial: len(data)})) as group:
+		assert len(group.sessions) == 3
+		assert group.start() == 0
+		for n, session in enumerate(group.sessions, 1):
+			assert request_bursts(session, n) == 0
+		end = time.perf_counter() + 5.0
+		while sum(got.values()) < 6 * BURST_8K_SIZE and time.perf_counter() < end:
+			time.sleep(0.01)
+		stats = group.stats()
+	assert [got[s['serial']] for s in stats['devices']] == [BURST_8K_SIZE, 2 * BURST_8K_SIZE,
+															3 * BURST_8K_SIZE]
+	assert stats['bytes'] == 6 * BURST_8K_SIZE
+	assert not bridge_sim._claims and not bridge_sim._in_flight
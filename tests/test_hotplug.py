@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from bridge_backend import usb
+from bridge_defs import BURST_8K_SIZE
+
+from conftest import request_bursts
+
+
+def poll_until(session, cond, seconds=2.0):
+	end = time.perf_counter() + seconds
+	while not cond() and time.perf_counter() < end:
+		session.handle_events(10)
+	return cond()
+
+
+@pytest.mark.parametrize('hotplug', [True, False], ids=['callbacks', 'polling'])
+def test_stream_follows_replug(session, sim_bridge, monkeypatch, hotplug):
+	if not hotplug:
+		monkeypatch.setattr(usb, 'has_capability', lambda cap: 0)
+	changes = []
+	assert session.enable_hotplug(on_change=changes.append) == 0
+	stream = session.stream()
+	assert stream.start() == 0
+
+	sim_bridge.unplug()
+	assert poll_until(session, lambda: changes == [False])
+	assert stream.suspended and session.dev_handle is None
+
+	sim_bridge.plug()
+	assert poll_until(session, lambda: changes == [False, True])
+	assert not stream.suspended and stream.running
+
+	assert request_bursts(session, 2) == 0
+	got = 0
+	end = time.perf_counter() + 5.0
+	while got < 2 * BURST_8K_SIZE and time.perf_counter() < end:
+		stream.poll(10)
+		while len(stream.ring):
+			slot, data = stream.ring.get()
+			got += len(data)
+			stream.release(slot)
+	assert got == 2 * BURST_8K_SIZE
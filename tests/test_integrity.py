@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from bridge_decode import BurstVerifier
+from bridge_defs import BURST_8K_SIZE, USB_PACKET_SIZE
+from bridge_integrity import IntegrityChecker
+from bridge_sim import SimBridge
+from bridge_stream import BulkStream
+
+from conftest import request_bursts
+
+
+def bursts(count):
+	# 8k bursts the way the emulator builds them, from sequence 0
+	sim = SimBridge()
+	return b''.join(sim.burst() for i in range(count))
+
+
+def test_stream_of_bursts_is_intact(session):
+	checker = IntegrityChecker()
+	assert request_bursts(session, 4) == 0
+	with BulkStream(session.dev_handle, ctx=session.ctx) as stream:
+		end = time.perf_counter() + 5.0
+		for slot, data in stream:
+			checker.check(data, stream.transfer_size)
+			stream.release(slot)
+			if checker.bytes >= 4 * BURST_8K_SIZE or time.perf_counter() > end:
+				break
+	assert checker.ok
+	assert checker.packets == 4 * BURST_8K_SIZE // USB_PACKET_SIZE
+
+
+def test_gap_and_duplicate():
+	data = bursts(1)
+	pkt = USB_PACKET_SIZE
+	lost = data[:10 * pkt] + data[12 * pkt:]
+	repeated = lost[:20 * pkt] + lost[19 * pkt:]
+	checker = IntegrityChecker()
+	checker.check(repeated)
+	assert (checker.gaps, checker.gap_events, checker.duplicates) == (2, 1, 1)
+	assert checker.seq_errors == 2
+	assert not checker.ok
+	assert [e[0] for e in checker.errors] == ['gap', 'duplicate']
+
+
+def test_partial_packets_carry_to_the_next_buffer():
+	data = bursts(2)
+	checker = IntegrityChecker()
+	for i in range(0, len(data), 1000):
+		checker.check(data[i:i + 1000])
+	assert checker.ok
+	assert checker.packets == len(data) // USB_PACKET_SIZE
+	assert checker.partial > 0
+	assert checker.stats()['pending_bytes'] == 0
+
+
+def test_agrees_with_numpy_verifier():
+	pytest.importorskip('numpy')
+	data = bursts(2)
+	pkt = USB_PACKET_SIZE
+	broken = data[:50 * pkt] + data[53 * pkt:]
+	checker, verifier = IntegrityChecker(), BurstVerifier()
+	for i in range(0, len(broken), 3000):
+		checker.check(broken[i:i + 3000])
+		verifier.check(broken[i:i + 3000])
+	assert checker.packets == verifier.packets
+	assert checker.seq_errors == verifier.seq_errors == 1
+	assert checker.expected_seq == verifier.expected_seq
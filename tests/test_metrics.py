@@ -0,0 +1,59 @@
+import ctypes as ct
+
+import pytest
+
+from bridge_defs import ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, USB_PACKET_SIZE, OPCODE_ECHO
+from bridge_metrics import BridgeMetrics, LatencyHistogram, HIST_SIZE, ref_value
+from bridge_trace import TraceWriter, TraceReader, TraceReplayer
+
+
+def pointer_int():
+	# the form the tutorials use
+	p = ct.POINTER(ct.c_int)()
+	p.contents = ct.c_int(0)
+	return p
+
+
+@pytest.mark.parametrize('make_ref', [lambda: ct.byref(ct.c_int(0)), pointer_int],
+							ids=['byref', 'pointer'])
+def test_transfer_records_either_ref_form(session, make_ref):
+	metrics = BridgeMetrics()
+	tx = (ct.c_ubyte*USB_PACKET_SIZE)(OPCODE_ECHO, 1, 2)
+	rx = (ct.c_ubyte*USB_PACKET_SIZE)()
+	out, got = make_ref(), make_ref()
+	assert metrics.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, tx, len(tx), out, 1000) == 0
+	assert metrics.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), got, 1000) == 0
+	assert ref_value(got) == USB_PACKET_SIZE
+	assert rx[0] == OPCODE_ECHO
+
+	snap = metrics.snapshot()
+	assert snap['0x03']['bytes'] == USB_PACKET_SIZE
+	assert snap['0x83']['bytes'] == USB_PACKET_SIZE
+	assert snap['0x83']['latency_us']['count'] == 1
+
+
+def test_trace_round_trip_with_pointer(session, tmp_path):
+	path = str(tmp_path / 'echo.trace')
+	tx = (ct.c_ubyte*USB_PACKET_SIZE)(OPCODE_ECHO, 9)
+	rx = (ct.c_ubyte*USB_PACKET_SIZE)()
+	with TraceWriter(path) as trace:
+		assert trace.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, tx, len(tx), pointer_int(), 1000) == 0
+		assert trace.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), pointer_int(), 1000) == 0
+	assert [r.transferred for r in TraceReader(path)] == [USB_PACKET_SIZE] * 2
+
+	replay = TraceReplayer(path, speed=0)
+	n = pointer_int()
+	rx2 = (ct.c_ubyte*USB_PACKET_SIZE)()
+	assert replay.bulk_transfer(None, ENDPOINT_BLK2_IN, rx2, len(rx2), n, 0) == 0
+	assert ref_value(n) == USB_PACKET_SIZE
+	assert bytes(rx2) == bytes(rx)
+
+
+def test_histogram_percentiles():
+	hist = LatencyHistogram()
+	assert len(hist.counts) == HIST_SIZE == 528
+	for ns in range(1000, 101000, 1000):
+		hist.record(ns)
+	assert hist.count == 100
+	assert 49000 <= hist.percentile(50) <= 53000
+	assert hist.percentile(100) >= 100000
@@ -0,0 +1,30 @@
+import zlib
+
+from bridge_mp import BridgePipeline
+from bridge_sim import SimBridge
+
+from conftest import request_bursts
+
+BURSTS = 8
+
+
+def ask_for_bursts(session):
+	# runs in the reader process
+	request_bursts(session, BURSTS)
+
+
+def test_workers_see_every_burst():
+	# the spawned reader runs its own simulator with one bridge
+	sim = SimBridge()
+	expected = [zlib.crc32(sim.burst()) for i in range(BURSTS)]
+	results = {}
+	with BridgePipeline(zlib.crc32, workers=2, num_slots=8, on_start=ask_for_bursts,
+						stream_kwargs={'timeout': 100}) as pipe:
+		for seq, crc in pipe.results(timeout=5.0):
+			results[seq] = crc
+			if len(results) == BURSTS:
+				break
+	stats = pipe.stats()
+	assert [results[i] for i in range(BURSTS)] == expected
+	assert stats['reader']['bytes'] == sum(w['bytes'] for w in stats['workers'].values())
+	assert pipe.shared is None
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+import bridge_sim
+from bridge_aio import AsyncBridge, PipelinedChannel
+from bridge_defs import OPCODE_ECHO
+
+OPCODE_IGNORED = 0x55					# the emulator does not answer it
+
+
+def test_pipelined_echo(session):
+	async def main():
+		async with AsyncBridge(session.dev_handle, session.ctx) as bridge:
+			async with PipelinedChannel(bridge, window=8) as chan:
+				return await asyncio.gather(*(chan.request(OPCODE_ECHO, bytes([i])) for i in range(20)))
+	replies = asyncio.run(main())
+	assert [r[0] for r in replies] == list(range(20))
+
+
+def test_lost_responses_time_out_and_free_the_window(session):
+	async def main():
+		async with AsyncBridge(session.dev_handle, session.ctx) as bridge:
+			async with PipelinedChannel(bridge, window=2, timeout=0.1) as chan:
+				lost = await asyncio.gather(*(chan.request(OPCODE_IGNORED) for i in range(5)),
+											return_exceptions=True)
+				reply = await chan.request(OPCODE_ECHO, b'\x07')
+				return chan, lost, reply
+	chan, lost, reply = asyncio.run(main())
+	assert all(isinstance(r, TimeoutError) for r in lost)
+	assert chan.timeouts == 5
+	assert reply[0] == 7
+	assert chan._waiting == {}
+
+
+def test_stop_cancels_queued_reads(session):
+	async def main():
+		async with AsyncBridge(session.dev_handle, session.ctx) as bridge:
+			chan = PipelinedChannel(bridge, reads=4)
+			chan.start()
+			await asyncio.sleep(0.05)
+			assert len(bridge._pending) == 4
+			await chan.stop()
+			return len(bridge._pending)
+	assert asyncio.run(main()) == 0
+	assert not bridge_sim._in_flight
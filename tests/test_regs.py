@@ -0,0 +1,41 @@
+import pytest
+
+from bridge_defs import REG_ID, REG_VERSION, REG_STATUS, REG_CONFIG, REG_READS_PER_PACKET
+from bridge_metrics import BridgeMetrics
+from bridge_regs import RegisterBank
+
+
+def test_read_write_and_shadow(session, sim_bridge):
+	metrics = BridgeMetrics()
+	with RegisterBank(session.dev_handle, metrics=metrics) as regs:
+		addrs = range(REG_CONFIG, REG_CONFIG + 2 * REG_READS_PER_PACKET)
+		regs.write_many({a: a * 3 for a in addrs})
+		assert regs.round_trips == 1
+		assert sim_bridge.registers[REG_CONFIG + 1] == (REG_CONFIG + 1) * 3
+
+		regs.invalidate()
+		assert regs.read_many(addrs) == {a: a * 3 for a in addrs}
+		assert regs.round_trips == 2				# 30 reads in one transfer
+		assert regs.read(REG_CONFIG) == REG_CONFIG * 3
+		assert regs.round_trips == 2 and regs.hits == 1
+		regs.read(REG_STATUS)
+		regs.read(REG_STATUS)
+		assert regs.round_trips == 4				# volatile, always from the bus
+		assert regs.read(REG_ID) == sim_bridge.registers[REG_ID]
+	assert metrics.snapshot()['0x81']['transfers'] == 5
+	assert not regs.claimed
+
+
+def test_rejected_write_drops_the_shadow(session):
+	with RegisterBank(session.dev_handle) as regs:
+		regs.read_many([REG_VERSION, REG_CONFIG])
+		with pytest.raises(RuntimeError, match='rejected'):
+			regs.write_many({REG_CONFIG: 1, REG_VERSION: 2})
+		assert regs.cached(REG_CONFIG) is None and regs.cached(REG_VERSION) is None
+
+
+def test_device_loss_raises(session, sim_bridge):
+	with RegisterBank(session.dev_handle) as regs:
+		sim_bridge.unplug()
+		with pytest.raises(RuntimeError, match='failure'):
+			regs.read(REG_CONFIG)
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+import bridge_sim
+from bridge_defs import ENDPOINT_BLK2_OUT, INT1_INTERFACE, OPCODE_ECHO
+from bridge_sched import TrafficScheduler, TrafficClass, SCHED_STRICT, SCHED_WEIGHTED
+
+SCHED_CONTROL_BOUND = 0.05			# S - generous for loaded test machines
+
+
+def claimed_interfaces():
+	return {iface for (bridge, iface) in bridge_sim._claims}
+
+
+def test_messages_are_sent_and_interface_released(session):
+	done = threading.Event()
+	results = []
+
+	def sent(r, n):
+		results.append((r, n))
+		if len(results) == 2:
+			done.set()
+
+	with TrafficScheduler(session.dev_handle, policy=SCHED_WEIGHTED) as sched:
+		assert INT1_INTERFACE in claimed_interfaces()
+		sched.submit('bulk', bytes([OPCODE_ECHO]) * 4096, callback=sent)
+		sched.submit('control', bytes([OPCODE_ECHO, 1, 2]), callback=sent)
+		assert done.wait(5.0)
+	assert sorted(results) == [(0, 3), (0, 4096)]
+	assert sched.stats()['bulk']['bytes'] == 4096
+	assert INT1_INTERFACE not in claimed_interfaces()
+
+
+def test_restart_after_stop(session):
+	sched = TrafficScheduler(session.dev_handle)
+	for i in range(2):
+		assert sched.start() == 0
+		sched.stop()
+	assert INT1_INTERFACE not in claimed_interfaces()
+
+
+@pytest.mark.parametrize('weight', [0, -1])
+def test_non_positive_weight_is_rejected(weight):
+	with pytest.raises(ValueError):
+		TrafficClass('bulk', ENDPOINT_BLK2_OUT, weight=weight)
+
+
+@pytest.mark.parametrize('policy', [SCHED_STRICT, SCHED_WEIGHTED])
+def test_control_overtakes_a_large_upload(session, policy):
+	order = []
+	done = threading.Event()
+
+	def sent(name):
+		def cb(r, n):
+			order.append((name, r, time.perf_counter()))
+			if len(order) == 2:
+				done.set()
+		return cb
+
+	with TrafficScheduler(session.dev_handle, policy=policy) as sched:
+		sched.submit('bulk', bytes(256 * 1024), callback=sent('bulk'))
+		while sched.stats()['bulk']['chunks'] < 4:
+			time.sleep(0.001)
+		queued = time.perf_counter()
+		sched.submit('control', bytes([OPCODE_ECHO, 1, 2]), callback=sent('control'))
+		assert done.wait(10.0)
+	assert [(name, r) for name, r, t in order] == [('control', 0), ('bulk', 0)]
+	# ~3mS against ~0.5S for the upload with the simulator
+	control_s = order[0][2] - queued
+	upload_s = order[1][2] - queued
+	assert control_s < SCHED_CONTROL_BOUND
+	assert control_s < upload_s / 10
@@ -0,0 +1,49 @@
+import pytest
+
+import bridge_sim
+from bridge_session import BridgeSession, find_bridges, _path_cache
+
+
+def test_find_and_open_by_serial(sim_bridge):
+	other = bridge_sim.add_bridge(serial='SIM-B', ports=(4, 2))
+	found = find_bridges()
+	assert [serial for path, serial in found] == [sim_bridge.serial, 'SIM-B']
+	with BridgeSession(serial='SIM-B') as s:
+		assert s.path == (other.bus, other.ports)
+		assert s.claimed
+
+
+def test_close_releases_the_bridge(sim_bridge):
+	with BridgeSession() as s:
+		assert bridge_sim._claims
+	assert s.dev_handle is None and s.ctx is None
+	assert not bridge_sim._claims
+	assert not bridge_sim._handles
+
+
+def test_cached_path_falls_back_to_a_scan(sim_bridge):
+	assert not _path_cache					# nothing carried over from earlier tests
+	with BridgeSession() as s:
+		first = s.path
+	assert _path_cache[s._key()] == first
+	sim_bridge.unplug()
+	sim_bridge.plug(ports=(7,))
+	with BridgeSession() as s:
+		assert s.path == (sim_bridge.bus, (7,))
+	assert _path_cache[s._key()] == s.path
+
+
+def test_missing_bridge(sim_bridge):
+	sim_bridge.unplug()
+	with pytest.raises(RuntimeError, match='not found'):
+		BridgeSession().open()
+
+
+def test_remove_stream_stops_and_forgets_it(session):
+	stream = session.stream(num_transfers=2)
+	assert stream.start() == 0
+	session.remove_stream(stream)
+	assert not stream.running
+	assert stream._transfers == []
+	assert stream not in session._streams
+	assert not bridge_sim._in_flight
@@ -0,0 +1,48 @@
+import time
+
+from bridge_defs import BURST_8K_SIZE, OPCODE_BURST_8K
+from bridge_stream import BulkStream
+
+from conftest import request_bursts
+
+
+def test_stream_receives_every_burst(session):
+	assert request_bursts(session, 4) == 0
+	got = 0
+	with BulkStream(session.dev_handle, ctx=session.ctx, num_transfers=4) as stream:
+		end = time.perf_counter() + 5.0
+		for slot, data in stream:
+			assert data[0] == OPCODE_BURST_8K
+			got += len(data)
+			stream.release(slot)
+			if got >= 4 * BURST_8K_SIZE or time.perf_counter() > end:
+				break
+	assert got == 4 * BURST_8K_SIZE
+	assert stream.error == 0
+
+
+def test_stream_callback_mode(session):
+	sizes = []
+	stream = BulkStream(session.dev_handle, ctx=session.ctx, callback=lambda d: sizes.append(len(d)))
+	assert stream.start() == 0
+	assert request_bursts(session, 2) == 0
+	end = time.perf_counter() + 5.0
+	while sum(sizes) < 2 * BURST_8K_SIZE and time.perf_counter() < end:
+		stream.poll(10)
+	stream.stop()
+	assert sum(sizes) == 2 * BURST_8K_SIZE
+	assert stream._in_flight == 0
+
+
+def test_stream_stops_after_device_loss(session, sim_bridge):
+	stream = BulkStream(session.dev_handle, ctx=session.ctx)
+	assert stream.start() == 0
+	sim_bridge.unplug()
+	end = time.perf_counter() + 2.0
+	while stream.running and time.perf_counter() < end:
+		stream.poll(10)
+	assert not stream.running
+	assert stream.error < 0
+	stream.stop()
+	assert stream._in_flight == 0
+	assert stream._transfers == []
@@ -0,0 +1,117 @@
+import collections
+import threading
+import time
+
+import bridge_sim
+from bridge_defs import INT1_INTERFACE, OPCODE_ECHO, BURST_8K_SIZE
+from bridge_stream import BulkStream
+from bridge_telemetry import TelemetryReader
+
+from conftest import request_bursts
+
+
+def test_echo_over_int1(session):
+	with TelemetryReader(session.dev_handle, session.ctx) as tlm:
+		for i in range(5):
+			assert tlm.send(bytes([OPCODE_ECHO, i])) == 0
+		got = [tlm.get(timeout=1.0) for i in range(5)]
+	assert [pkt[:2] for t, pkt in got] == [bytes([OPCODE_ECHO, i]) for i in range(5)]
+	assert all(a[0] <= b[0] for a, b in zip(got, got[1:]))
+	assert not any(iface == INT1_INTERFACE for bridge, iface in bridge_sim._claims)
+
+
+def test_oldest_packets_dropped(session):
+	with TelemetryReader(session.dev_handle, session.ctx, max_queue=2) as tlm:
+		for i in range(5):
+			assert tlm.send(bytes([OPCODE_ECHO, i])) == 0
+		end = time.perf_counter() + 2.0
+		while tlm.packets < 5 and time.perf_counter() < end:
+			time.sleep(0.01)
+		assert [pkt[1] for t, pkt in tlm.drain()] == [3, 4]
+	assert tlm.dropped == 3
+
+
+def test_stop_after_device_loss(session, sim_bridge):
+	tlm = TelemetryReader(session.dev_handle, session.ctx)
+	assert tlm.start() == 0
+	sim_bridge.unplug()
+	assert tlm.get(timeout=2.0) is None
+	assert not tlm.running and tlm.error < 0
+	tlm.stop()
+	assert tlm._transfers == [] and not tlm.claimed
+	assert not bridge_sim._in_flight
+
+
+def test_full_queue_drained_concurrently(session):
+	count = 400
+	with TelemetryReader(session.dev_handle, session.ctx, max_queue=1) as tlm:
+		taken = []
+		done = threading.Event()
+
+		def drainer():
+			while not done.is_set():
+				taken.extend(tlm.drain())
+				time.sleep(0.0001)
+		t = threading.Thread(target=drainer)
+		t.start()
+		for i in range(count):
+			assert tlm.send(bytes([OPCODE_ECHO, i & 0xff])) == 0
+		end = time.perf_counter() + 5.0
+		while tlm.packets < count and time.perf_counter() < end:
+			time.sleep(0.01)
+		done.set()
+		t.join()
+		taken.extend(tlm.drain())
+		assert tlm.packets == count
+		assert len(taken) + tlm.dropped == count
+		assert tlm._in_flight == tlm.num_transfers		# every read was resubmitted
+
+
+class RacingDeque(collections.deque):
+	# the application empties the queue right after the callback looks at it
+	def __len__(self):
+		n = super().__len__()
+		self.clear()
+		return n
+
+
+def test_consumer_empties_queue_inside_callback(session):
+	with TelemetryReader(session.dev_handle, session.ctx, max_queue=1) as tlm:
+		tlm._queue = RacingDeque(maxlen=1)
+		for i in range(3):
+			assert tlm.send(bytes([OPCODE_ECHO, i])) == 0
+		end = time.perf_counter() + 2.0
+		while tlm.packets < 3 and time.perf_counter() < end:
+			time.sleep(0.01)
+		time.sleep(0.05)
+		assert tlm._in_flight == tlm.num_transfers		# every read was resubmitted
+		t, pkt = tlm._queue[0]
+		assert pkt[1] == 2
+
+
+def test_shared_context_without_thread(session):
+	threads = set()
+	stream = BulkStream(session.dev_handle, ctx=session.ctx,
+						callback=lambda d: threads.add(threading.current_thread()))
+	with TelemetryReader(session.dev_handle, session.ctx, thread=False,
+							callback=lambda t, d: threads.add(threading.current_thread())) as tlm:
+		assert tlm._thread is None
+		assert stream.start() == 0
+		assert request_bursts(session, 2) == 0
+		for i in range(3):
+			assert tlm.send(bytes([OPCODE_ECHO, i])) == 0
+		end = time.perf_counter() + 5.0
+		while (stream.bytes_received < 2 * BURST_8K_SIZE or tlm.packets < 3) and time.perf_counter() < end:
+			stream.poll(10)
+		stream.stop()
+	assert stream.bytes_received == 2 * BURST_8K_SIZE
+	assert tlm.packets == 3
+	assert threads == {threading.current_thread()}
+
+
+def test_get_polls_without_thread(session):
+	with TelemetryReader(session.dev_handle, session.ctx, thread=False) as tlm:
+		assert tlm.send(bytes([OPCODE_ECHO, 9])) == 0
+		t, pkt = tlm.get(timeout=1.0)
+		assert pkt[:2] == bytes([OPCODE_ECHO, 9])
+		assert tlm.get(timeout=0.05) is None
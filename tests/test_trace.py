@@ -0,0 +1,101 @@
+import ctypes as ct
+import sys
+import time
+
+import bridge_sim
+from bridge_backend import usb
+from bridge_defs import ENDPOINT_BLK2_OUT, ENDPOINT_BLK2_IN, BURST_8K_SIZE, OPCODE_BURST_8K
+from bridge_metrics import BridgeMetrics
+from bridge_stream import BulkStream
+from bridge_trace import TraceWriter, TraceReader, TraceReplayer, REC_ASYNC
+
+from conftest import packet, request_bursts
+
+
+def record_bursts(session, path, count):
+	# a tutorial style burst read through the wrapped usb module
+	rx = (ct.c_ubyte*BURST_8K_SIZE)()
+	n = ct.c_int(0)
+	with TraceWriter(path) as trace:
+		traced = trace.wrap(usb)
+		for i in range(count):
+			tx = packet(OPCODE_BURST_8K)
+			assert traced.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_OUT, tx, len(tx), ct.byref(n), 1000) == 0
+			assert traced.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 1000) == 0
+		assert traced.strerror is usb.strerror
+	return bytes(rx)
+
+
+def test_record_summary_and_replay(session, tmp_path):
+	path = str(tmp_path / 'bursts.trc')
+	last = record_bursts(session, path, 3)
+	summary = TraceReader(path).summary()
+	assert summary['0x83']['transfers'] == 3
+	assert summary['0x83']['bytes'] == 3 * BURST_8K_SIZE
+
+	replay = TraceReplayer(path, speed=0, endpoints=(ENDPOINT_BLK2_IN,))
+	rx = (ct.c_ubyte*BURST_8K_SIZE)()
+	n = ct.c_int(0)
+	for i in range(3):
+		assert replay.bulk_transfer(None, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 0) == 0
+	assert bytes(rx) == last and n.value == BURST_8K_SIZE
+	# out of records - like an unplug
+	assert replay.bulk_transfer(None, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 0) == usb.LIBUSB_ERROR_NO_DEVICE
+	assert n.value == 0
+
+
+def test_replay_keeps_the_recorded_pace(session, tmp_path):
+	path = str(tmp_path / 'paced.trc')
+	start = time.perf_counter()
+	record_bursts(session, path, 4)
+	recorded = time.perf_counter() - start
+
+	replay = TraceReplayer(path, speed=2.0)
+	start = time.perf_counter()
+	stats = replay.play(lambda rec: None)
+	elapsed = time.perf_counter() - start
+	assert stats['replayed'] == 8
+	assert recorded / 4 < elapsed < recorded
+
+
+def test_async_hook_records_sizes(session, tmp_path):
+	path = str(tmp_path / 'stream.trc')
+	metrics = BridgeMetrics()
+	with TraceWriter(path, payload=False) as trace:
+		metrics.add_hook(trace.hook)
+		assert request_bursts(session, 2) == 0
+		with BulkStream(session.dev_handle, ctx=session.ctx, metrics=metrics) as stream:
+			got = 0
+			end = time.perf_counter() + 5.0
+			while got < 2 * BURST_8K_SIZE and time.perf_counter() < end:
+				stream.poll(10)
+				while len(stream.ring):
+					slot, data = stream.ring.get()
+					got += len(data)
+					stream.release(slot)
+	recs = [r for r in TraceReader(path) if r.transferred]
+	assert sum(r.transferred for r in recs) == 2 * BURST_8K_SIZE
+	assert all(r.flags & REC_ASYNC and r.payload is None for r in recs)
+
+
+def test_tutorial_replay_without_bridge(sim_bridge, tmp_path, monkeypatch):
+	monkeypatch.delitem(sys.modules, 'tutorial2', raising=False)
+	import tutorial2
+	assert not bridge_sim._handles			# importing runs no test case
+
+	path = str(tmp_path / 'field.trc')
+	r = tutorial2.find_bridge(tutorial2.DEF_VID, tutorial2.DEF_PID)
+	assert r[0] == 0
+	with TraceWriter(path) as trace:
+		monkeypatch.setattr(tutorial2, 'usb', trace.wrap(usb))
+		assert tutorial2.testcase2_exe(r[1]) is None
+
+	bridge_sim.reset()						# no bridge on the dev box
+	claims = []
+	monkeypatch.setattr(usb, 'claim_interface', lambda *args: claims.append(args) or -1)
+	replay = TraceReplayer(path, speed=0)
+	monkeypatch.setattr(tutorial2, 'usb', replay.wrap(usb))
+	assert tutorial2.testcase2_exe(None) is None
+	assert replay.replayed == 2
+	assert tutorial2.bulk_transferred.contents.value == BURST_8K_SIZE
+	assert claims == []
@@ -0,0 +1,36 @@
+import time
+
+from bridge_buffers import BufferRing
+from bridge_stream import BulkStream
+from bridge_tune import StreamTuner, TUNE_LATENCY, TUNE_MIN_SIZE
+
+from conftest import request_bursts
+
+
+def test_full_transfers_grow(session):
+	ring = BufferRing(64 * 1024, 16)
+	with BulkStream(session.dev_handle, ctx=session.ctx, ring=ring, transfer_size=1024,
+					num_transfers=4) as stream:
+		tuner = StreamTuner(stream, interval=60)
+		assert request_bursts(session, 64) == 0
+		end = time.perf_counter() + 5.0
+		while stream.bytes_received < 32 * 1024 and time.perf_counter() < end:
+			stream.poll(10)
+			while len(stream.ring):
+				slot, data = stream.ring.get()
+				stream.release(slot)
+		tuner.update()
+		assert stream.transfer_size == 2048
+		assert tuner.adjustments == 1
+		tuner.detach()
+
+
+def test_latency_goal_when_idle(session):
+	ring = BufferRing(64 * 1024, 16)
+	with BulkStream(session.dev_handle, ctx=session.ctx, ring=ring) as stream:
+		tuner = StreamTuner(stream, goal=TUNE_LATENCY, latency_ms=10, interval=60)
+		tuner.update()
+		assert stream.transfer_size == TUNE_MIN_SIZE
+		assert stream.timeout == 5
+		assert tuner.stats()['goal'] == TUNE_LATENCY
+		tuner.detach()
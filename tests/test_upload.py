@@ -0,0 +1,49 @@
+import ctypes as ct
+
+import pytest
+
+import bridge_sim
+from bridge_backend import usb
+from bridge_defs import ENDPOINT_BLK2_IN, USB_PACKET_SIZE, OPCODE_ECHO
+from bridge_upload import BulkUpload
+
+
+def echo_block(count):
+	return b''.join(bytes([OPCODE_ECHO, i & 0xff, i >> 8]).ljust(USB_PACKET_SIZE, b'\xa5')
+					for i in range(count))
+
+
+def test_upload_arrives_in_order(session):
+	block = echo_block(200)
+	with BulkUpload(session.dev_handle, ctx=session.ctx, transfer_size=USB_PACKET_SIZE*16,
+					num_transfers=4) as up:
+		assert up.upload(block) == 0
+	assert up.sent == len(block)
+	assert up.transfers == 13
+
+	rx = (ct.c_ubyte*len(block))()
+	got = b''
+	n = ct.c_int(0)
+	while len(got) < len(block):
+		assert usb.bulk_transfer(session.dev_handle, ENDPOINT_BLK2_IN, rx, len(rx), ct.byref(n), 1000) == 0
+		got += bytes(rx[:n.value])
+	assert got == block
+
+
+@pytest.mark.parametrize('kind', [bytes, bytearray, lambda b: memoryview(b).toreadonly()])
+def test_buffer_kinds_with_ack(session, sim_bridge, kind):
+	block = bytes(256 * 1024)				# opcode 0 packets are ignored
+	before = sim_bridge.packets_out
+	with BulkUpload(session.dev_handle, ctx=session.ctx) as up:
+		assert up.upload(kind(block), ack=True) == 0
+	assert sim_bridge.packets_out - before == len(block) // USB_PACKET_SIZE + 1
+	assert up.copies == 0
+
+
+def test_upload_after_device_loss(session, sim_bridge):
+	with BulkUpload(session.dev_handle, ctx=session.ctx) as up:
+		sim_bridge.unplug()
+		assert up.upload(bytes(64 * 1024)) < 0
+		assert up.sent == 0
+	assert up._transfers == []
+	assert not bridge_sim._in_flight
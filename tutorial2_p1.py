@@ -50,7 +50,7 @@
 # ################################################################
 
 import ctypes as ct
-import libusb as usb
+from bridge_backend import usb
 import time
 
 
@@ -50,7 +50,7 @@
 # ################################################################
 
 import ctypes as ct
-import libusb as usb
+from bridge_backend import usb
 import time
 
 
@@ -195,10 +195,10 @@ def testcase2_exe(dev_handle):
 	# --------------------------------------
 
 	# execute write transaction
-	start = time.time()
+	start = time.perf_counter()
 	r = usb.bulk_transfer(dev_handle, ENDPOINT_BLK2_IN, ep_data_in, 
 							EP2IN_SIZE, bulk_transferred, EP2IN_TIMEOUT)
-	stop = time.time()
+	stop = time.perf_counter()
 	# error check
 	if (r < 0):
 		print(f'ERROR: Total bytes transferred <{bulk_transferred.contents}> bytes!')
@@ -207,14 +207,15 @@ def testcase2_exe(dev_handle):
 		return (1, -1)
 	else:	
 		print(f'Received {bulk_transferred.contents} bytes!')
+		if bulk_transferred.contents.value < EP2IN_SIZE:
+			print(f'WARNING: short read, expected <{EP2IN_SIZE}> bytes!')
 
 	# print out time for 8k benchmark
 	print("\nBenchmark Results:")
 	dt = stop - start
 	print(f"dt: {dt}S")
 	print(f"Benchmark time: {round(dt*1000, 3)}mS")
-	val = round((8192/dt)/1000, 2)
-	#print(f"Throughput: {round((8192/dt)/1000, 2)}kB/S")
+	val = round((bulk_transferred.contents.value/dt)/1000, 2)
 	print(f"Throughput: {val}kB/S")
 	print(f"Throughput: {round(val*8/1000, 2)}Mb/S")
 